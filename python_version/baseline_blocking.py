@@ -0,0 +1,61 @@
+import weakref
+
+import numpy as np
+
+from csr_graph import CSRGraph
+
+# The degree ranking of every CSRGraph, computed on first use.
+_rankings = weakref.WeakKeyDictionary()
+
+
+def degree_ranking(csr):
+    """
+    :param csr: A CSRGraph.
+    :return: The rows by decreasing degree, ties in row order like sorting G.degree() with reverse=True.
+    """
+    ranking = _rankings.get(csr)
+    if ranking is None:
+        ranking = _rankings[csr] = np.argsort(-np.diff(csr.indptr), kind='stable')
+    return ranking
+
+
+def eligible_mask(csr, seed_set):
+    """
+    :param csr: A CSRGraph.
+    :param seed_set: The seed nodes, which are never blocked.
+    :return: The mask of the rows that may be blocked.
+    """
+    mask = np.ones(csr.number_of_nodes(), dtype=bool)
+    mask[csr.rows_of(seed_set)] = False
+    return mask
+
+
+def choose_nodes_by_degree(G, budget_1, budget_2, seed_set):
+    """
+    Block the non-seed nodes of highest degree, the same ones for both contagions up to the smaller budget.
+    :param G: The network, a networkx graph or a CSRGraph.
+    :param budget_1: The number of nodes blocked for contagion 1.
+    :param budget_2: The number of nodes blocked for contagion 2.
+    :param seed_set: The seed nodes.
+    :return: The lists of nodes blocked for contagion 1 and for contagion 2.
+    """
+    csr = CSRGraph.of(G)
+    ranking = degree_ranking(csr)
+    ranking = ranking[eligible_mask(csr, seed_set)[ranking]]
+    return csr.ids_of(ranking[:budget_1]), csr.ids_of(ranking[:budget_2])
+
+
+def choose_randomly(rng, G, budget_1, budget_2, seed_set):
+    """
+    Block non-seed nodes chosen uniformly without repeats, independently for both contagions.
+    :param rng: A numpy Generator.
+    :param G: The network, a networkx graph or a CSRGraph.
+    :param budget_1: The number of nodes blocked for contagion 1.
+    :param budget_2: The number of nodes blocked for contagion 2.
+    :param seed_set: The seed nodes.
+    :return: The lists of nodes blocked for contagion 1 and for contagion 2.
+    """
+    csr = CSRGraph.of(G)
+    eligible = np.flatnonzero(eligible_mask(csr, seed_set))
+    return (csr.ids_of(rng.choice(eligible, budget_1, replace=False)),
+            csr.ids_of(rng.choice(eligible, budget_2, replace=False)))
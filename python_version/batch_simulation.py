@@ -0,0 +1,92 @@
+import numpy as np
+
+
+def state_matrix(csr, seed_sets):
+    """
+    Build the initial states of several replicates.
+    :param csr: The CSRGraph to simulate on.
+    :param seed_sets: A list with a (seed_set_1, seed_set_2, seed_set_3) tuple for each replicate.
+    :return: A uint8 array of shape (nodes, replicates).
+    """
+    states = np.zeros((csr.number_of_nodes(), len(seed_sets)), dtype=np.uint8)
+    for r, seeds in enumerate(seed_sets):
+        for status, seed_set in zip((1, 2, 3), seeds):
+            if seed_set is not None and len(seed_set):
+                states[csr.rows_of(seed_set), r] = status
+    return states
+
+
+def mask_matrix(csr, node_sets):
+    """
+    Build the blocked masks of several replicates.
+    :param csr: The CSRGraph to simulate on.
+    :param node_sets: A list with the blocked nodes of each replicate.
+    :return: A bool array of shape (nodes, replicates).
+    """
+    masks = np.zeros((csr.number_of_nodes(), len(node_sets)), dtype=bool)
+    for r, node_set in enumerate(node_sets):
+        if len(node_set):
+            masks[csr.rows_of(node_set), r] = True
+    return masks
+
+
+def node_counts(states):
+    """
+    :param states: A state array of shape (nodes, replicates).
+    :return: The node_count dict of each replicate.
+    """
+    counts = np.stack([(states == st).sum(axis=0) for st in range(4)], axis=1).tolist()
+    return [{st: count[st] for st in range(4)} for count in counts]
+
+
+def simulate_batch(csr, initial_states, thresholds, blocked_1=None, blocked_2=None, interaction_1=0, interaction_2=0):
+    """
+    Runs many replicates of the threshold model to their fixed points together. Each step is one sparse-dense
+    matrix product of the adjacency with the contagion indicators of the replicates that are still changing;
+    a replicate is retired as soon as a step leaves it unchanged. The rules are those of
+    MultipleContagionThreshold.iteration, with the threshold of a replicate used for both contagions as
+    utils.config_model sets them.
+    :param csr: The CSRGraph to simulate on.
+    :param initial_states: A uint8 array of shape (nodes, replicates) with the initial statuses.
+    :param thresholds: The threshold of each replicate, or an array of shape (nodes, replicates).
+    :param blocked_1: A bool array of shape (nodes, replicates) marking the nodes blocked for contagion 1.
+    :param blocked_2: A bool array of shape (nodes, replicates) marking the nodes blocked for contagion 2.
+    :param interaction_1: The interaction term for contagion 1.
+    :param interaction_2: The interaction term for contagion 2.
+    :return: A dict with the final statuses, the node counts and the steps taken by each replicate, and the time
+    each node was infected with each contagion (0 for seeds, -1 if never).
+    """
+    state = np.array(initial_states, dtype=np.uint8)
+    n, replicates = state.shape
+    thresholds = np.broadcast_to(np.asarray(thresholds, dtype=np.int64), (n, replicates))
+    threshold_1 = thresholds + (thresholds * interaction_1).astype(np.int64)
+    threshold_2 = thresholds + (thresholds * interaction_2).astype(np.int64)
+    if blocked_1 is None:
+        blocked_1 = np.zeros((n, replicates), dtype=bool)
+    if blocked_2 is None:
+        blocked_2 = np.zeros((n, replicates), dtype=bool)
+    infect_time_1 = np.where(state & 1, 0, -1).astype(np.int32)
+    infect_time_2 = np.where(state & 2, 0, -1).astype(np.int32)
+    steps = np.zeros(replicates, dtype=np.int32)
+    adjacency = csr.adjacency
+    active = np.arange(replicates)
+    step = 0
+    while len(active):
+        step += 1
+        active_state = state[:, active]
+        # Count both contagions for every active replicate in one product.
+        counts = adjacency @ np.concatenate((active_state & 1, active_state >> 1), axis=1)
+        new_1 = (((active_state & 1) == 0) & (counts[:, :len(active)] >= threshold_1[:, active]) &
+                 ~blocked_1[:, active])
+        new_2 = (((active_state & 2) == 0) & (counts[:, len(active):] >= threshold_2[:, active]) &
+                 ~blocked_2[:, active])
+        state[:, active] = active_state | new_1.astype(np.uint8) | (new_2.astype(np.uint8) << 1)
+        rows, columns = np.nonzero(new_1)
+        infect_time_1[rows, active[columns]] = step
+        rows, columns = np.nonzero(new_2)
+        infect_time_2[rows, active[columns]] = step
+        changed = new_1.any(axis=0) | new_2.any(axis=0)
+        steps[active[changed]] = step
+        active = active[changed]
+    return {"status": state, "node_count": node_counts(state), "steps": steps,
+            "infect_time_1": infect_time_1, "infect_time_2": infect_time_2}
@@ -0,0 +1,57 @@
+import sys
+import time
+from sys import argv
+
+import networkx as nx
+import numpy as np
+
+import utils
+
+
+def random_seed_sets(core_nodes, seed_size, replicates):
+    """
+    Draw seed sets like the drivers' choose_seed: a random sample of the core split uniformly over the three states.
+    """
+    seed_sets = []
+    for _ in range(replicates):
+        component = np.random.choice(core_nodes, seed_size, replace=False)
+        rolls = np.random.randint(1, 4, seed_size)
+        seed_sets.append(tuple(list(component[rolls == roll]) for roll in (1, 2, 3)))
+    return seed_sets
+
+
+def bench_packed(G, threshold, seed_sets, baseline_replicates):
+    """
+    Compare simulation_run on the python engine with the bit-parallel packed runs.
+    """
+    now = time.time()
+    for seed_set_1, seed_set_2, seed_set_3 in seed_sets[:baseline_replicates]:
+        model = utils.config_model(G, threshold, seed_set_1, seed_set_2, seed_set_3)
+        model.simulation_run(first_infected=False)
+    baseline = (time.time() - now) / baseline_replicates
+    model = utils.config_model(G, threshold, [], [], [])
+    model.csr
+    now = time.time()
+    counts = model.packed_simulation_run(seed_sets)
+    packed = (time.time() - now) / len(seed_sets)
+    print('python engine: %.4f s/simulation, packed: %.6f s/simulation, speedup %.1fx' % (baseline, packed,
+                                                                                         baseline / packed))
+    print('state bytes per replicate: status dict %d, packed %.1f' % (
+        sys.getsizeof(model.status), G.number_of_nodes() * 2 / 8))
+    return counts
+
+
+def main():
+    nodes = int(argv[1]) if len(argv) > 1 else 10000
+    replicates = int(argv[2]) if len(argv) > 2 else 1024
+    np.random.seed(12324)
+    G = nx.barabasi_albert_graph(nodes, 5)
+    core_nodes = list(nx.k_core(G, 5).nodes())
+    seed_sets = random_seed_sets(core_nodes, 20, replicates)
+    for threshold in (2, 3, 4):
+        print('threshold', threshold)
+        bench_packed(G, threshold, seed_sets, 5)
+
+
+if __name__ == '__main__':
+    main()
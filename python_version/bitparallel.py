@@ -0,0 +1,172 @@
+import numpy as np
+
+LANES = 64
+ALL_LANES = np.uint64(0xFFFFFFFFFFFFFFFF)
+
+
+class SlotSchedule(object):
+    """
+    The CSR edges regrouped by their position within a row. Rows are ranked by decreasing degree, so the rows that
+    have a k-th neighbor are always the first rows in rank order and every neighbor slot adds into a prefix of the
+    rank ordered counters.
+    """
+
+    def __init__(self, csr):
+        degrees = np.diff(csr.indptr)
+        self.order = np.argsort(-degrees, kind='stable')
+        rank = np.empty(len(degrees), dtype=np.int64)
+        rank[self.order] = np.arange(len(degrees))
+        rows = np.repeat(np.arange(len(degrees)), degrees)
+        slots = np.arange(len(csr.indices)) - csr.indptr[rows]
+        by_slot = np.lexsort((rank[rows], slots))
+        self.neighbors = csr.indices[by_slot].astype(np.int64)
+        # Number of rows holding each slot and where each slot starts in self.neighbors.
+        self.rows_per_slot = np.bincount(slots, minlength=degrees.max(initial=0)).astype(np.int64)
+        self.offsets = np.concatenate(([0], np.cumsum(self.rows_per_slot)))
+
+
+def pack(csr, node_sets, words):
+    """
+    :param csr: The CSRGraph to simulate on.
+    :param node_sets: A list with a node collection for each replicate.
+    :param words: The number of uint64 words per node.
+    :return: A uint64 array of shape (nodes, words) with bit r set for the nodes of replicate r.
+    """
+    packed = np.zeros((csr.number_of_nodes(), words), dtype=np.uint64)
+    for r, node_set in enumerate(node_sets):
+        if node_set is not None and len(node_set):
+            packed[csr.rows_of(node_set), r // LANES] |= np.uint64(1 << (r % LANES))
+    return packed
+
+
+def unpack(packed, replicates):
+    """
+    :param packed: A uint64 array of shape (nodes, words).
+    :param replicates: The number of replicates packed.
+    :return: A bool array of shape (nodes, replicates).
+    """
+    bits = np.unpackbits(packed.view(np.uint8), axis=1, bitorder='little')
+    return bits[:, :replicates].astype(bool)
+
+
+def lane_counts(packed, replicates, chunk=1 << 16):
+    """
+    Count the set bits of every lane over the nodes.
+    :param packed: A uint64 array of shape (nodes, words).
+    :param replicates: The number of replicates packed.
+    :param chunk: The number of nodes unpacked at a time.
+    :return: An int64 array with the count of each replicate.
+    """
+    counts = np.zeros(replicates, dtype=np.int64)
+    for start in range(0, len(packed), chunk):
+        counts += unpack(packed[start:start + chunk], replicates).sum(axis=0)
+    return counts
+
+
+def _add(planes, overflow, x):
+    """
+    Ripple carry the bits of x into the leading rows of the bit-sliced counters, saturating in overflow.
+    """
+    m = len(x)
+    carry = x
+    for plane in planes:
+        bits = plane[:m]
+        sum_bits = bits ^ carry
+        carry = bits & carry
+        plane[:m] = sum_bits
+    overflow[:m] |= carry
+
+
+def _at_least(planes, overflow, threshold_bits):
+    """
+    Bit-sliced comparison of the counters against per node thresholds, from the most significant plane down.
+    :return: The lanes whose count is at least the threshold.
+    """
+    greater = np.zeros_like(overflow)
+    equal = np.full_like(overflow, ALL_LANES)
+    for plane, bits in zip(planes[::-1], threshold_bits[::-1]):
+        greater |= equal & plane & ~bits
+        equal &= ~(plane ^ bits)
+    return overflow | greater | equal
+
+
+def _count(schedule, infected, planes, overflow):
+    for plane in planes:
+        plane[:] = 0
+    overflow[:] = 0
+    for k in range(len(schedule.rows_per_slot)):
+        _add(planes, overflow, infected[schedule.neighbors[schedule.offsets[k]:schedule.offsets[k + 1]]])
+
+
+def simulate_packed(csr, seed_sets, threshold_1, threshold_2, blocked_1=None, blocked_2=None, shared_blocked_1=None,
+                    shared_blocked_2=None, schedule=None):
+    """
+    Runs many seedings of the threshold model at once with the contagion 1 and contagion 2 flags of 64 replicates
+    packed into the bits of a uint64 word per node. Infected neighbors are counted with bit-sliced saturating
+    adders over the CSR adjacency, so a node costs a few words for every 64 replicates instead of a dict entry
+    each. The rules are those of MultipleContagionThreshold.iteration.
+    :param csr: The CSRGraph to simulate on.
+    :param seed_sets: A list with a (seed_set_1, seed_set_2, seed_set_3) tuple for each replicate.
+    :param threshold_1: The interaction adjusted thresholds for contagion 1 in row order, shared by all replicates.
+    :param threshold_2: The interaction adjusted thresholds for contagion 2 in row order, shared by all replicates.
+    :param blocked_1: A list with the nodes blocked for contagion 1 in each replicate.
+    :param blocked_2: A list with the nodes blocked for contagion 2 in each replicate.
+    :param shared_blocked_1: A bool mask in row order of nodes blocked for contagion 1 in every replicate.
+    :param shared_blocked_2: A bool mask in row order of nodes blocked for contagion 2 in every replicate.
+    :param schedule: The SlotSchedule of csr, built if not given.
+    :return: A dict with the packed final flags of each contagion and the node_count dict of each replicate.
+    """
+    if schedule is None:
+        schedule = SlotSchedule(csr)
+    replicates = len(seed_sets)
+    words = -(-replicates // LANES)
+    order = schedule.order
+    # Neighbor flags are gathered by row id, the counters and masks are kept in the degree rank order.
+    infected_1 = pack(csr, [seeds[0] for seeds in seed_sets], words) | pack(csr, [seeds[2] for seeds in seed_sets],
+                                                                             words)
+    infected_2 = pack(csr, [seeds[1] for seeds in seed_sets], words) | pack(csr, [seeds[2] for seeds in seed_sets],
+                                                                             words)
+    open_1 = ~pack(csr, blocked_1 or [], words)[order]
+    open_2 = ~pack(csr, blocked_2 or [], words)[order]
+    # Lanes past the last replicate never change.
+    valid = np.full(words, ALL_LANES)
+    if replicates % LANES:
+        valid[-1] = np.uint64((1 << (replicates % LANES)) - 1)
+    open_1 &= valid
+    open_2 &= valid
+    if shared_blocked_1 is not None:
+        open_1[shared_blocked_1[order]] = 0
+    if shared_blocked_2 is not None:
+        open_2[shared_blocked_2[order]] = 0
+    cap = max(int(np.max(threshold_1, initial=0)), int(np.max(threshold_2, initial=0)), 1)
+    plane_count = cap.bit_length()
+    thresholds = []
+    for threshold in (threshold_1, threshold_2):
+        # Thresholds below one are met by every count.
+        threshold = np.maximum(np.asarray(threshold, dtype=np.int64)[order], 0)
+        thresholds.append([np.where((threshold >> b) & 1, ALL_LANES, np.uint64(0))[:, None]
+                           for b in range(plane_count)])
+    planes_1 = [np.zeros((len(order), words), dtype=np.uint64) for _ in range(plane_count)]
+    planes_2 = [np.zeros((len(order), words), dtype=np.uint64) for _ in range(plane_count)]
+    overflow_1 = np.zeros((len(order), words), dtype=np.uint64)
+    overflow_2 = np.zeros((len(order), words), dtype=np.uint64)
+    rank_1 = infected_1[order]
+    rank_2 = infected_2[order]
+    while True:
+        _count(schedule, infected_1, planes_1, overflow_1)
+        _count(schedule, infected_2, planes_2, overflow_2)
+        new_1 = ~rank_1 & open_1 & _at_least(planes_1, overflow_1, thresholds[0])
+        new_2 = ~rank_2 & open_2 & _at_least(planes_2, overflow_2, thresholds[1])
+        if not new_1.any() and not new_2.any():
+            break
+        rank_1 |= new_1
+        rank_2 |= new_2
+        infected_1[order] = rank_1
+        infected_2[order] = rank_2
+    both = lane_counts(infected_1 & infected_2, replicates)
+    only_1 = lane_counts(infected_1, replicates) - both
+    only_2 = lane_counts(infected_2, replicates) - both
+    susceptible = csr.number_of_nodes() - both - only_1 - only_2
+    node_count = [{0: int(counts[0]), 1: int(counts[1]), 2: int(counts[2]), 3: int(counts[3])}
+                  for counts in zip(susceptible, only_1, only_2, both)]
+    return {"infected_1": infected_1, "infected_2": infected_2, "node_count": node_count}
@@ -1,65 +1,14 @@
 import csv
-from os.path import exists
 
-import networkx as nx
 import numpy as np
 
+import baseline_blocking
 import coverage_heuristic as cbh
+import graph_store
+import seed_selection
 import utils
 
 
-def choose_seed(core, seed_size):
-    component = np.random.choice(core, seed_size, replace=False)
-    seed_set_1 = []
-    seed_set_2 = []
-    seed_set_3 = []
-    for index in range(len(component)):
-        roll = np.random.randint(1, 4)
-        if roll == 3:
-            seed_set_3.append(component[index])
-        elif roll == 2:
-            seed_set_2.append(component[index])
-        elif roll == 1:
-            seed_set_1.append(component[index])
-        else:
-            raise ValueError("Not in the correct range")
-    return seed_set_1, seed_set_2, seed_set_3
-
-
-def choose_nodes_by_degree(G, budget_1, budget_2, seed_set):
-    choices_1 = []
-    choices_2 = []
-    nodes_by_degree = sorted(G.degree(), key=lambda x: x[1], reverse=True)
-    index = 0
-    while len(choices_1) < budget_1:
-        if nodes_by_degree[index][0] not in seed_set:
-            choices_1.append(nodes_by_degree[index][0])
-        index += 1
-    index = 0
-    while len(choices_2) < budget_2:
-        if nodes_by_degree[index][0] not in seed_set:
-            choices_2.append(nodes_by_degree[index][0])
-        index += 1
-    return choices_1, choices_2
-
-
-def choose_randomly(G, budget_1, budget_2, seed_set):
-    nodes = list(G.nodes())
-    choices_1 = []
-    choices_2 = []
-    index = np.random.randint(0, len(nodes))
-    while len(choices_1) < budget_1:
-        if nodes[index] not in seed_set and nodes[index] not in choices_1:
-            choices_1.append(nodes[index])
-        index = np.random.randint(0, len(nodes))
-    index = np.random.randint(0, len(nodes))
-    while len(choices_2) < budget_2:
-        if nodes[index] not in seed_set and nodes[index] not in choices_2:
-            choices_2.append(nodes[index])
-        index = np.random.randint(0, len(nodes))
-    return choices_1, choices_2
-
-
 def main():
     field_names = ['network_name', 'threshold', 'seed_size', 'budget_total']
     # Add fields for node counts for each blocking method
@@ -80,27 +29,15 @@ def main():
     sample_number = 10
 
     for i in range(len(net_names)):
-        np.random.seed(seeds[i])
+        rng = np.random.default_rng(seeds[i])
         net_name = net_names[i]
-        G = nx.read_edgelist(network_folder + net_name + '.edges', nodetype=int, create_using=nx.Graph)
-        # If there is a node file add it.
-        if exists(net_name + ".nodes"):
-            with open(network_folder + net_name + ".nodes", 'r') as node_fp:
-                node_str = node_fp.readline().strip('\n')
-                node_id = int(node_str)
-                G.add_node(node_id)
-        for node in G.nodes:
-            G.nodes[node]['affected_1'] = 0
-            G.nodes[node]['affected_2'] = 0
-        # Select k-core
-        k_core = list(nx.k_core(G, 20).nodes())[0]
-        connected_core = [k_core]
-        while len(connected_core) < 200:
-            index_to_expand = np.random.randint(0, len(connected_core))
-            choose_from = list(nx.neighbors(G, connected_core[index_to_expand]))
-            choice = choose_from[np.random.randint(0, len(choose_from))]
-            if choice not in connected_core:
-                connected_core.append(choice)
+        # Parsed once with the node file next to it into a binary cache, later runs memory map it.
+        G, _, core_numbers = graph_store.load_network(network_folder + net_name + '.edges')
+        # One model per threshold for the unblocked runs and one for the blocked ones, reset for every scenario.
+        models = {threshold: utils.build_model(G, threshold) for threshold in thresholds}
+        blocked_models = {threshold: utils.build_model(G, threshold) for threshold in thresholds}
+        # Grow a connected core of 200 nodes from the first node of the k-core
+        connected_core = seed_selection.choose_connected(rng, G, 200, seed_selection.k_core(core_numbers, 20)[0])
         for seed_size in [20]:
             # Initialize accumulators Mult-level dict threshold -> (budget -> (results_avg, results_blocked_avg,
             # results_degree_avg, results_random))
@@ -110,7 +47,8 @@ def main():
                 thresholds}
             for sample in range(sample_number):
                 # Choose seed set
-                seed_set_1, seed_set_2, seed_set_3 = choose_seed(connected_core, seed_size)
+                seed_set_1, seed_set_2, seed_set_3 = seed_selection.split_seeds(
+                    rng, G, seed_selection.choose_random_k_core(rng, connected_core, seed_size))
                 seed_set = set(seed_set_1 + seed_set_2 + seed_set_3)
                 for k in range(len(thresholds)):
                     # Pull out threshold
@@ -119,7 +57,7 @@ def main():
                         # Get the budget
                         budget = int(budgets[j] * G.number_of_nodes())
                         # Configure model
-                        model = utils.config_model(G, threshold, seed_set_1, seed_set_2, seed_set_3)
+                        model = models[threshold].reset(seed_set_1, seed_set_2, seed_set_3)
                         node_infections_1, node_infections_2, results = model.simulation_run()
                         # Analyze node counts
                         infected_1 = results['node_count'][1] + results['node_count'][3]
@@ -145,20 +83,20 @@ def main():
 
                         # Run again with the CBH blocking
                         # Configure model
-                        model = utils.config_model(G, threshold, seed_set_1, seed_set_2, seed_set_3, choices_1,
-                                                   choices_2)
+                        model = blocked_models[threshold].reset(seed_set_1, seed_set_2, seed_set_3, choices_1,
+                                                                choices_2)
                         results_blocked = model.simulation_run(first_infected=False)
                         # Find high degree nodes
-                        choices_1, choices_2 = choose_nodes_by_degree(G, budget_1, budget_2, seed_set)
+                        choices_1, choices_2 = baseline_blocking.choose_nodes_by_degree(G, budget_1, budget_2, seed_set)
                         # Run forward
-                        model = utils.config_model(G, threshold, seed_set_1, seed_set_2, seed_set_3, choices_1,
-                                                   choices_2)
+                        model = blocked_models[threshold].reset(seed_set_1, seed_set_2, seed_set_3, choices_1,
+                                                                choices_2)
                         results_blocked_degree = model.simulation_run(first_infected=False)
                         # Find random nodes
-                        choices_1, choices_2 = choose_randomly(G, budget_1, budget_2, seed_set)
+                        choices_1, choices_2 = baseline_blocking.choose_randomly(rng, G, budget_1, budget_2, seed_set)
                         # Run forward
-                        model = utils.config_model(G, threshold, seed_set_1, seed_set_2, seed_set_3, choices_1,
-                                                   choices_2)
+                        model = blocked_models[threshold].reset(seed_set_1, seed_set_2, seed_set_3, choices_1,
+                                                                choices_2)
                         results_random = model.simulation_run(first_infected=False)
                         for state in range(4):
                             avgs[threshold][budget][0][state] += results['node_count'][state]
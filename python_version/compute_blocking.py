@@ -1,77 +1,145 @@
 import csv
-from os.path import exists
+import time
+import weakref
+from sys import argv
 
-import networkx as nx
 import numpy as np
 
+import baseline_blocking
+import batch_simulation
 import coverage_heuristic as cbh
+import graph_store
+import potential_heuristic
+import seed_selection
+import sweep
 import utils
+from csr_graph import CSRGraph
 
+# The models of the graphs of this process by threshold, built by the first cell and reset by the others.
+_models = weakref.WeakKeyDictionary()
 
-def choose_seed(core, seed_size):
-    core_nodes = list(core.nodes())
-    # component = [core_nodes[np.random.randint(0, len(core_nodes))]]
-    # while len(component) < seed_size:
-    #     node_to_expand = component[np.random.randint(0, len(component))]
-    #     choose_from = list(core.neighbors(node_to_expand))
-    #     selection = choose_from[np.random.randint(0, len(choose_from))]
-    #     if selection not in component:
-    #         component.append(selection)
-    component = np.random.choice(core_nodes, seed_size, replace=False)
-    seed_set_1 = []
-    seed_set_2 = []
-    seed_set_3 = []
-    for index in range(len(component)):
-        roll = np.random.randint(1, 4)
-        if roll == 3:
-            seed_set_3.append(component[index])
-        elif roll == 2:
-            seed_set_2.append(component[index])
-        elif roll == 1:
-            seed_set_1.append(component[index])
-        else:
-            raise ValueError("Not in the correct range")
-    return seed_set_1, seed_set_2, seed_set_3
 
+def cover_choices(node_infections, budgets, model, seed_set, contagion_index, choices=None):
+    """
+    The CBH choices for a list of budgets from one try_all_sets sweep.
+    :param node_infections: The newly infected nodes at each time, or the InfectionTimes of the run.
+    :param budgets: The budgets.
+    :param model: The model that was run.
+    :param seed_set: The seed nodes of the contagion.
+    :param contagion_index: The contagion to block.
+    :param choices: A dict of choices already found, only the budgets missing from it are solved.
+    :return: The dict from budget to choices.
+    """
+    if choices is None:
+        choices = {}
+    missing = sorted(set(budgets).difference(choices))
+    if missing:
+        solutions = cbh.try_all_sets_sweep(node_infections, missing, model, seed_set, contagion_index=contagion_index)
+        for budget, (solution, _) in zip(missing, solutions):
+            choices[budget] = solution
+    return choices
 
-def choose_nodes_by_degree(G, budget_1, budget_2, seed_set):
-    choices_1 = []
-    choices_2 = []
-    nodes_by_degree = sorted(G.degree(), key=lambda x: x[1], reverse=True)
-    index = 0
-    while len(choices_1) < budget_1:
-        if nodes_by_degree[index][0] not in seed_set:
-            choices_1.append(nodes_by_degree[index][0])
-        index += 1
-    index = 0
-    while len(choices_2) < budget_2:
-        if nodes_by_degree[index][0] not in seed_set:
-            choices_2.append(nodes_by_degree[index][0])
-        index += 1
-    return choices_1, choices_2
 
-
-def choose_randomly(G, budget_1, budget_2, seed_set):
-    nodes = list(G.nodes())
-    choices_1 = []
-    choices_2 = []
-    index = np.random.randint(0, len(nodes))
-    while len(choices_1) < budget_1:
-        if nodes[index] not in seed_set and nodes[index] not in choices_1:
-            choices_1.append(nodes[index])
-        index = np.random.randint(0, len(nodes))
-    index = np.random.randint(0, len(nodes))
-    while len(choices_2) < budget_2:
-        if nodes[index] not in seed_set and nodes[index] not in choices_2:
-            choices_2.append(nodes[index])
-        index = np.random.randint(0, len(nodes))
-    return choices_1, choices_2
+def block_cell(G, net_name, threshold, seed_size, seed_set_1, seed_set_2, seed_set_3, budgets, cell_seed):
+    """
+    Runs the unblocked, CBH, potential, degree and random blocked simulations of one seed sample and threshold for
+    every budget.
+    :param G: The network, a networkx graph or a CSRGraph.
+    :param net_name: The network name written to the results.
+    :param threshold: The threshold of every node.
+    :param seed_size: The seed size written to the results.
+    :param seed_set_1: The nodes initially infected with contagion 1.
+    :param seed_set_2: The nodes initially infected with contagion 2.
+    :param seed_set_3: The nodes initially infected with both.
+    :param budgets: The budgets as fractions of the number of nodes.
+    :param cell_seed: The seed for the random blocking of this cell.
+    :return: The result rows of the cell, one per budget.
+    """
+    csr = CSRGraph.of(G)
+    seed_set = set(seed_set_1 + seed_set_2 + seed_set_3)
+    # Reset the model of the graph and threshold to the seeds of this cell
+    models = _models.setdefault(G, {})
+    if threshold not in models:
+        models[threshold] = utils.build_model(G, threshold)
+    model = models[threshold].reset(seed_set_1, seed_set_2, seed_set_3)
+    # The random blocking of the cell, a generator of its own is not reseeded by the DiffusionModel constructor.
+    rng = np.random.default_rng(cell_seed)
+    initial_state = model.scenario_arrays()[0].copy()
+    node_infections_1, node_infections_2, results = model.simulation_run()
+    # The blocking reads the infections from the arrays of the run.
+    times = model.infection_times
+    # Analyze node counts
+    infected_1 = results['node_count'][1]
+    total_infected = sum(results['node_count'][i] for i in range(1, 4))
+    ratio_infected_1 = infected_1 / total_infected
+    # Split every budget between the contagions
+    budget_totals = [int(budget * G.number_of_nodes()) for budget in budgets]
+    budgets_1 = [int(ratio_infected_1 * budget) for budget in budget_totals]
+    budgets_2 = [budget - budget_1 for budget, budget_1 in zip(budget_totals, budgets_1)]
+    # Run through the CBH from DMKD for both contagions, one sweep over all budgets at a time. Budget left over by
+    # one contagion moves to the other.
+    start = time.time()
+    choices_1 = cover_choices(times, budgets_1, model, set(seed_set_1 + seed_set_3), 1)
+    budgets_2 = [budget_2 + max(budget_1 - len(choices_1[budget_1]), 0)
+                 for budget_1, budget_2 in zip(budgets_1, budgets_2)]
+    choices_2 = cover_choices(times, budgets_2, model, set(seed_set_2 + seed_set_3), 2)
+    budgets_1 = [budget_1 + max(budget_2 - len(choices_2[budget_2]), 0)
+                 for budget_1, budget_2 in zip(budgets_1, budgets_2)]
+    cover_choices(times, budgets_1, model, set(seed_set_1 + seed_set_3), 1, choices_1)
+    # The sweeps serve every budget of the cell at once.
+    timing_cbh = time.time() - start
+    # Potentials of the unblocked run, shared by every budget.
+    start = time.time()
+    potentials = potential_heuristic.find_potentials(
+        model, potential_heuristic.node_updates(csr, initial_state, node_infections_1, node_infections_2))
+    timing_potentials = time.time() - start
+    timings_potential = []
+    # Blocking choices for every budget, simulated together afterwards
+    blocked_1 = []
+    blocked_2 = []
+    for j in range(len(budgets)):
+        budget_1 = budgets_1[j]
+        budget_2 = budgets_2[j]
+        # CBH blocking
+        blocked_1.append(choices_1[budget_1])
+        blocked_2.append(choices_2[budget_2])
+        # Potential blocking of the whole budget
+        start = time.time()
+        blocking = potential_heuristic.choose_blocking(model, potentials, budget_totals[j], (1, 1), seed_set)
+        timings_potential.append(timing_potentials + time.time() - start)
+        blocked_1.append([u for u, contagions in blocking.items() if 1 in contagions])
+        blocked_2.append([u for u, contagions in blocking.items() if 2 in contagions])
+        # Find high degree nodes
+        degree_1, degree_2 = baseline_blocking.choose_nodes_by_degree(G, budget_1, budget_2, seed_set)
+        blocked_1.append(degree_1)
+        blocked_2.append(degree_2)
+        # Find random nodes
+        random_1, random_2 = baseline_blocking.choose_randomly(rng, G, budget_1, budget_2, seed_set)
+        blocked_1.append(random_1)
+        blocked_2.append(random_2)
+    # Run forward all blocked replicates of this sample and threshold in one batch
+    initial_states = batch_simulation.state_matrix(csr, [(seed_set_1, seed_set_2, seed_set_3)])
+    results_blocked = batch_simulation.simulate_batch(
+        csr, np.repeat(initial_states, len(blocked_1), axis=1), threshold,
+        batch_simulation.mask_matrix(csr, blocked_1), batch_simulation.mask_matrix(csr, blocked_2))
+    rows = []
+    for j in range(len(budgets)):
+        # Write problem data
+        result_data = [net_name, str(threshold), str(seed_size),
+                       str(budget_totals[j]), str(timing_cbh), str(timings_potential[j])]
+        # Add in the counts of no blocking, CBH, potential, degree and random blocking
+        for result_set in [results['node_count']] + results_blocked['node_count'][4 * j:4 * j + 4]:
+            result_data += list(
+                map(lambda x: str(x), result_set.values())
+            )
+        rows.append(result_data)
+    return rows
 
 
 def main():
-    field_names = ['network_name', 'threshold', 'seed_size', 'budget_total']
+    field_names = ['network_name', 'threshold', 'seed_size', 'budget_total', 'timing_cbh', 'timing_potential']
     # Add fields for node counts for each blocking method
-    for blocking in ["_no_block", "_cbh", "_degree", "_random"]:
+    for blocking in ["_no_block", "_cbh", "_potential", "_degree", "_random"]:
         field_names += [
             str(i) + blocking for i in
             range(4)]
@@ -87,91 +155,40 @@ def main():
     thresholds = (2, 3, 4)
     budgets = [.01 + i * .005 for i in range(20)]
     sample_number = 50
-    solver = cbh.multi_cover_formulation
+    # The number of worker processes, all CPUs by default
+    workers = int(argv[1]) if len(argv) > 1 else None
     # if len(argv) > 1 and argv[1] == "optimal":
     #     solver = cbh.ilp_formulation
     for i in range(len(net_names)):
-        np.random.seed(seeds[i])
+        rng = np.random.default_rng(seeds[i])
         net_name = net_names[i]
-        G = nx.read_edgelist(network_folder + net_name + '.edges', nodetype=int, create_using=nx.Graph)
-        # If there is a node file add it.
-        if exists(net_name + ".nodes"):
-            with open(network_folder + net_name + ".nodes", 'r') as node_fp:
-                node_str = node_fp.readline().strip('\n')
-                node_id = int(node_str)
-                G.add_node(node_id)
-        for node in G.nodes:
-            G.nodes[node]['affected_1'] = 0
-            G.nodes[node]['affected_2'] = 0
+        # Parsed once with the node file next to it into a binary cache, later runs memory map it.
+        G, _, core_numbers = graph_store.load_network(network_folder + net_name + '.edges')
         # Select k-core
-        k_core = G.subgraph(nx.k_core(G, 20).nodes())
+        k_core = seed_selection.k_core(core_numbers, 20)
+        # The (sample, threshold) cells of this network; seeds are drawn here so the grid does not depend on the
+        # order the workers finish in.
+        cells = []
         for seed_size in seed_sizes:
             for sample in range(sample_number):
                 # Choose seed set
-                seed_set_1, seed_set_2, seed_set_3 = choose_seed(k_core, seed_size)
-                seed_set = set(seed_set_1 + seed_set_2 + seed_set_3)
+                seed_set_1, seed_set_2, seed_set_3 = seed_selection.split_seeds(
+                    rng, G, seed_selection.choose_random_k_core(rng, k_core, seed_size))
                 for k in range(len(thresholds)):
-                    # Pull out threshold
-                    threshold = thresholds[k]
-                    # Configure model
-                    model = utils.config_model(G, threshold, seed_set_1, seed_set_2, seed_set_3)
-                    node_infections_1, node_infections_2, results = model.simulation_run()
-                    # Analyze node counts
-                    infected_1 = results['node_count'][1]
-                    total_infected = sum(results['node_count'][i] for i in range(1, 4))
-                    ratio_infected_1 = infected_1 / total_infected
-                    for j in range(len(budgets)):
-                        # Get the budget
-                        budget = int(budgets[j] * G.number_of_nodes())
-                        # Select nodes appropriately
-                        budget_1 = int(ratio_infected_1 * budget)
-                        budget_2 = budget - budget_1
-                        # Run through the CBH from DMKD for both contagions.
-                        choices_1 = cbh.try_all_sets(node_infections_1, budget_1, model, set(seed_set_1 + seed_set_3),
-                                                     solver,
-                                                     1)
-                        if len(choices_1) < budget_1:
-                            budget_2 += budget_1 - len(choices_1)
-                        choices_2 = cbh.try_all_sets(node_infections_2, budget_2, model, set(seed_set_2 + seed_set_3),
-                                                     solver,
-                                                     2)
-                        if len(choices_2) < budget_2:
-                            budget_1 += budget_2 - len(choices_2)
-                        choices_1 = cbh.try_all_sets(node_infections_1, budget_1, model, set(seed_set_1 + seed_set_3),
-                                                     solver,
-                                                     1)
-                        # Run again with the CBH blocking
-                        # Configure model
-                        model = utils.config_model(G, threshold, seed_set_1, seed_set_2, seed_set_3, choices_1,
-                                                   choices_2)
-
-                        results_blocked = model.simulation_run(first_infected=False)
-                        # Find high degree nodes
-                        choices_1, choices_2 = choose_nodes_by_degree(G, budget_1, budget_2, seed_set)
-                        # Run forward
-                        model = utils.config_model(G, threshold, seed_set_1, seed_set_2, seed_set_3, choices_1,
-                                                   choices_2)
-                        results_blocked_degree = model.simulation_run(first_infected=False)
-                        # Find random nodes
-                        choices_1, choices_2 = choose_randomly(G, budget_1, budget_2, seed_set)
-                        # Run forward
-                        model = utils.config_model(G, threshold, seed_set_1, seed_set_2, seed_set_3, choices_1,
-                                                   choices_2)
-                        results_random = model.simulation_run(first_infected=False)
-                        # Write out the results
-                        with open('complex_net_proposal/experiment_results/results_complex_update.csv', 'a',
-                                  newline='') as results_fp:
-                            csv_writer = csv.writer(results_fp, delimiter=',')
-                            # Write problem data
-                            result_data = [net_name, str(threshold), str(seed_size),
-                                           str(budget)]
-                            # Add in the averages
-                            for result_set in [results['node_count'], results_blocked['node_count'],
-                                               results_blocked_degree['node_count'], results_random['node_count']]:
-                                result_data += list(
-                                    map(lambda x: str(x), result_set.values())
-                                )
-                            csv_writer.writerow(result_data)
+                    cells.append((net_name, thresholds[k], seed_size, seed_set_1, seed_set_2, seed_set_3, budgets,
+                                  int(rng.integers(np.iinfo(np.int32).max))))
+        # Publish the graph once in shared memory for the workers.
+        shared = CSRGraph.of(G).share()
+        try:
+            # Write out the results of every cell as it arrives, in the order of the cells
+            with open('complex_net_proposal/experiment_results/results_complex_update.csv', 'a',
+                      newline='') as results_fp:
+                csv_writer = csv.writer(results_fp, delimiter=',')
+                for rows in sweep.run_sweep(shared, block_cell, cells, max_workers=workers):
+                    csv_writer.writerows(rows)
+                    results_fp.flush()
+        finally:
+            shared.unlink()
 
 
 if __name__ == '__main__':
@@ -1,78 +1,49 @@
 import csv
-from os.path import exists
+import time
+from concurrent.futures import ThreadPoolExecutor
 
-import networkx as nx
 import numpy as np
 
+import baseline_blocking
 import coverage_heuristic as cbh
+import graph_store
+import potential_heuristic
+import seed_selection
 import utils
+from simulation_cache import SimulationCache
 
 from sys import argv
 
 
-def choose_seed(core, seed_size):
-    core_nodes = list(core.nodes())
-    component = [core_nodes[np.random.randint(0, len(core_nodes))]]
-    while len(component) < seed_size:
-        node_to_expand = component[np.random.randint(0, len(component))]
-        choose_from = list(core.neighbors(node_to_expand))
-        selection = choose_from[np.random.randint(0, len(choose_from))]
-        if selection not in component:
-            component.append(selection)
-    seed_set_1 = []
-    seed_set_2 = []
-    seed_set_3 = []
-    for index in range(len(component)):
-        roll = np.random.randint(1, 4)
-        if roll == 3:
-            seed_set_3.append(component[index])
-        elif roll == 2:
-            seed_set_2.append(component[index])
-        elif roll == 1:
-            seed_set_1.append(component[index])
-        else:
-            raise ValueError("Not in the correct range")
-    return seed_set_1, seed_set_2, seed_set_3
-
-
-def choose_nodes_by_degree(G, budget_1, budget_2, seed_set):
-    choices_1 = []
-    choices_2 = []
-    nodes_by_degree = sorted(G.degree(), key=lambda x: x[1], reverse=True)
-    index = 0
-    while len(choices_1) < budget_1:
-        if nodes_by_degree[index][0] not in seed_set:
-            choices_1.append(nodes_by_degree[index][0])
-        index += 1
-    index = 0
-    while len(choices_2) < budget_2:
-        if nodes_by_degree[index][0] not in seed_set:
-            choices_2.append(nodes_by_degree[index][0])
-        index += 1
-    return choices_1, choices_2
-
-
-def choose_randomly(G, budget_1, budget_2, seed_set):
-    nodes = list(G.nodes())
-    choices_1 = []
-    choices_2 = []
-    index = np.random.randint(0, len(nodes))
-    while len(choices_1) < budget_1:
-        if nodes[index] not in seed_set and nodes[index] not in choices_1:
-            choices_1.append(nodes[index])
-        index = np.random.randint(0, len(nodes))
-    index = np.random.randint(0, len(nodes))
-    while len(choices_2) < budget_2:
-        if nodes[index] not in seed_set and nodes[index] not in choices_2:
-            choices_2.append(nodes[index])
-        index = np.random.randint(0, len(nodes))
-    return choices_1, choices_2
+def cover_choices(node_infections, budgets, model, seed_set, contagion_index, coverage_sweep, executor,
+                  choices=None):
+    """
+    The CBH choices for a list of budgets from one try_all_sets sweep.
+    :param node_infections: The newly infected nodes at each time, or the InfectionTimes of the run.
+    :param budgets: The budgets.
+    :param model: The model that was run.
+    :param seed_set: The seed nodes of the contagion.
+    :param contagion_index: The contagion to block.
+    :param coverage_sweep: The function solving a time step for a list of budgets.
+    :param executor: The executor solving the time steps in parallel, or None.
+    :param choices: A dict of choices already found, only the budgets missing from it are solved.
+    :return: The dict from budget to choices.
+    """
+    if choices is None:
+        choices = {}
+    missing = sorted(set(budgets).difference(choices))
+    if missing:
+        solutions = cbh.try_all_sets_sweep(node_infections, missing, model, seed_set, coverage_sweep,
+                                           contagion_index, executor)
+        for budget, (solution, _) in zip(missing, solutions):
+            choices[budget] = solution
+    return choices
 
 
 def main():
-    field_names = ['network_name', 'threshold', 'seed_size', 'budget_total']
+    field_names = ['network_name', 'threshold', 'seed_size', 'budget_total', 'timing_cbh', 'timing_potential']
     # Add fields for node counts for each blocking method
-    for blocking in ["_no_block", "_cbh", "_degree", "_random"]:
+    for blocking in ["_no_block", "_cbh", "_potential", "_degree", "_random"]:
         field_names += [
             str(i) + blocking for i in
             range(4)]
@@ -88,93 +59,122 @@ def main():
     thresholds = (2, 3, 4)
     budgets = [.005] + [.01 + i * .01 for i in range(10)]
     sample_number = 10
-    solver = cbh.multi_cover_formulation
+    coverage_sweep = cbh.multi_cover_sweep
+    executor = None
     if len(argv) > 1 and argv[1] == "optimal":
-        solver = cbh.ilp_formulation
+        # One ILP per time step, re-solved for every budget.
+        coverage_sweep = cbh.ilp_sweep
+        # Every time step is its own ILP, solve them side by side.
+        executor = ThreadPoolExecutor()
+    # Blockings repeat across budgets.
+    cache = SimulationCache()
 
     for i in range(len(net_names)):
-        np.random.seed(seeds[i])
+        rng = np.random.default_rng(seeds[i])
         net_name = net_names[i]
-        G = nx.read_edgelist(network_folder + net_name + '.edges', nodetype=int, create_using=nx.Graph)
-        # If there is a node file add it.
-        if exists(net_name + ".nodes"):
-            with open(network_folder + net_name + ".nodes", 'r') as node_fp:
-                node_str = node_fp.readline().strip('\n')
-                node_id = int(node_str)
-                G.add_node(node_id)
-        for node in G.nodes:
-            G.nodes[node]['affected_1'] = 0
-            G.nodes[node]['affected_2'] = 0
+        # Parsed once with the node file next to it into a binary cache, later runs memory map it.
+        G, _, core_numbers = graph_store.load_network(network_folder + net_name + '.edges')
+        # One model per threshold for the unblocked runs and one for the blocked ones, reset for every scenario.
+        models = {threshold: utils.build_model(G, threshold) for threshold in thresholds}
+        blocked_models = {threshold: utils.build_model(G, threshold) for threshold in thresholds}
         # Select k-core
-        k_core = G.subgraph(nx.k_core(G, 20).nodes())
+        k_core = G.subgraph(seed_selection.k_core(core_numbers, 20))
         for seed_size in seed_sizes:
             for sample in range(sample_number):
                 # Choose seed set
-                seed_set_1, seed_set_2, seed_set_3 = choose_seed(k_core, seed_size)
+                start = rng.integers(k_core.number_of_nodes())
+                seed_set_1, seed_set_2, seed_set_3 = seed_selection.split_seeds(
+                    rng, k_core, seed_selection.choose_connected(rng, k_core, seed_size, start))
                 seed_set = set(seed_set_1 + seed_set_2 + seed_set_3)
                 for k in range(len(thresholds)):
                     # Pull out threshold
                     threshold = thresholds[k]
+                    # Configure model
+                    model = models[threshold].reset(seed_set_1, seed_set_2, seed_set_3)
+                    initial_state = model.scenario_arrays()[0].copy()
+                    node_infections_1, node_infections_2, results = cache.simulation_run(model)
+                    # The blocking reads the infections from the arrays of the run.
+                    times = model.infection_times
+                    # Analyze node counts
+                    infected_1 = results['node_count'][1] + results['node_count'][3]
+                    total_infected = sum(results['node_count'][i] for i in range(1, 4))
+                    # Select nodes appropriately
+                    ratio_infected_1 = infected_1 / total_infected
+                    budget_totals = [int(budget * G.number_of_nodes()) for budget in budgets]
+                    budgets_1 = [int(ratio_infected_1 * budget) for budget in budget_totals]
+                    budgets_2 = [budget - budget_1 for budget, budget_1 in zip(budget_totals, budgets_1)]
+                    # Run through the CBH from DMKD for both contagions, sweeping all budgets at once.
+                    start = time.time()
+                    cover_1 = cover_choices(times, budgets_1, model, set(seed_set_1 + seed_set_3), 1,
+                                            coverage_sweep, executor)
+                    budgets_2 = [budget_2 + max(budget_1 - len(cover_1[budget_1]), 0)
+                                 for budget_1, budget_2 in zip(budgets_1, budgets_2)]
+                    cover_2 = cover_choices(times, budgets_2, model, set(seed_set_2 + seed_set_3), 2,
+                                            coverage_sweep, executor)
+                    # Contagion 1 may use what contagion 2 left over, the baselines keep the first split.
+                    cover_budgets_1 = [budget_1 + max(budget_2 - len(cover_2[budget_2]), 0)
+                                       for budget_1, budget_2 in zip(budgets_1, budgets_2)]
+                    cover_choices(times, cover_budgets_1, model, set(seed_set_1 + seed_set_3), 1,
+                                  coverage_sweep, executor, cover_1)
+                    timing_cbh = time.time() - start
+                    # Potentials of the unblocked run, shared by every budget.
+                    start = time.time()
+                    potentials = potential_heuristic.find_potentials(model, potential_heuristic.node_updates(
+                        model.csr, initial_state, node_infections_1, node_infections_2))
+                    timing_potentials = time.time() - start
+                    unblocked_model = model
                     for j in range(len(budgets)):
-                        # Get the budget
-                        budget = int(budgets[j] * G.number_of_nodes())
-                        # Configure model
-                        model = utils.config_model(G, threshold, seed_set_1, seed_set_2, seed_set_3)
-                        node_infections_1, node_infections_2, results = model.simulation_run()
-                        # Analyze node counts
-                        infected_1 = results['node_count'][1] + results['node_count'][3]
-                        total_infected = sum(results['node_count'][i] for i in range(1, 4))
-                        # Select nodes appropriately
-                        ratio_infected_1 = infected_1 / total_infected
-                        budget_1 = int(ratio_infected_1 * budget)
-                        budget_2 = budget - budget_1
-                        # Run through the CBH from DMKD for both contagions.
-                        choices_1 = cbh.try_all_sets(node_infections_1, budget_1, model, set(seed_set_1 + seed_set_3),
-                                                     solver,
-                                                     1)
-                        if len(choices_1) < budget_1:
-                            budget_2 += budget_1 - len(choices_1)
-                        choices_2 = cbh.try_all_sets(node_infections_2, budget_2, model, set(seed_set_2 + seed_set_3),
-                                                     solver,
-                                                     2)
-                        if len(choices_2) < budget_2:
-                            choices_1 = cbh.try_all_sets(node_infections_1, budget_1 + (budget_2 - len(choices_2)),
-                                                         model, set(seed_set_1 + seed_set_3), solver,
-                                                         1)
-
+                        budget = budget_totals[j]
+                        budget_1 = budgets_1[j]
+                        budget_2 = budgets_2[j]
                         # Run again with the CBH blocking
                         # Configure model
-                        model = utils.config_model(G, threshold, seed_set_1, seed_set_2, seed_set_3, choices_1,
-                                                   choices_2)
+                        model = blocked_models[threshold].reset(seed_set_1, seed_set_2, seed_set_3,
+                                                                cover_1[cover_budgets_1[j]], cover_2[budget_2])
 
-                        results_blocked = model.simulation_run(first_infected=False)
+                        results_blocked = cache.simulation_run(model, first_infected=False)
 
+                        # Potential blocking of the whole budget
+                        start = time.time()
+                        blocking = potential_heuristic.choose_blocking(unblocked_model, potentials, budget, (1, 1),
+                                                                       seed_set)
+                        timing_potential = timing_potentials + time.time() - start
+                        # Run forward
+                        blocked_1 = [u for u, contagions in blocking.items() if 1 in contagions]
+                        blocked_2 = [u for u, contagions in blocking.items() if 2 in contagions]
+                        model = blocked_models[threshold].reset(seed_set_1, seed_set_2, seed_set_3, blocked_1,
+                                                                blocked_2)
+                        results_potential = cache.simulation_run(model, first_infected=False)
                         # Find high degree nodes
-                        choices_1, choices_2 = choose_nodes_by_degree(G, budget_1, budget_2, seed_set)
+                        choices_1, choices_2 = baseline_blocking.choose_nodes_by_degree(G, budget_1, budget_2, seed_set)
                         # Run forward
-                        model = utils.config_model(G, threshold, seed_set_1, seed_set_2, seed_set_3, choices_1,
-                                                   choices_2)
-                        results_blocked_degree = model.simulation_run(first_infected=False)
+                        model = blocked_models[threshold].reset(seed_set_1, seed_set_2, seed_set_3, choices_1,
+                                                                choices_2)
+                        results_blocked_degree = cache.simulation_run(model, first_infected=False)
                         # Find random nodes
-                        choices_1, choices_2 = choose_randomly(G, budget_1, budget_2, seed_set)
+                        choices_1, choices_2 = baseline_blocking.choose_randomly(rng, G, budget_1, budget_2, seed_set)
                         # Run forward
-                        model = utils.config_model(G, threshold, seed_set_1, seed_set_2, seed_set_3, choices_1,
-                                                   choices_2)
-                        results_random = model.simulation_run(first_infected=False)
+                        model = blocked_models[threshold].reset(seed_set_1, seed_set_2, seed_set_3, choices_1,
+                                                                choices_2)
+                        results_random = cache.simulation_run(model, first_infected=False)
                         # Write out the results
                         with open('complex_net_proposal/experiment_results/results_ilp.csv', 'a',
                                   newline='') as results_fp:
                             csv_writer = csv.writer(results_fp, delimiter=',')
                             # Write problem data
                             result_data = [net_name, str(threshold), str(seed_size),
-                                           str(budget)]
+                                           str(budget), str(timing_cbh), str(timing_potential)]
                             # Add in the averages
                             for result_set in [results['node_count'], results_blocked['node_count'],
-                                               results_blocked_degree['node_count'], results_random['node_count']]:
+                                               results_potential['node_count'], results_blocked_degree['node_count'],
+                                               results_random['node_count']]:
                                 result_data += list(
                                     map(lambda x: str(x), result_set.values())
                                 )
                             csv_writer.writerow(result_data)
+    if executor is not None:
+        executor.shutdown()
+    print('Simulation cache hits: %d misses: %d' % (cache.hits, cache.misses))
 
 
 if __name__ == '__main__':
@@ -1,6 +1,10 @@
-# import gurobipy as gp
+from concurrent.futures import FIRST_COMPLETED, wait
+
 import numpy as np
-# from gurobipy import GRB
+import scipy.sparse as sp
+from scipy.optimize import Bounds, LinearConstraint, milp
+
+from infection_times import InfectionTimes
 
 
 def greedy_smc(budget, collection_of_subsets, unsatisfied, requirement_array):
@@ -44,29 +48,108 @@ def greedy_smc(budget, collection_of_subsets, unsatisfied, requirement_array):
     return coverage, chosen, unsatisfied
 
 
+def sparse_greedy_smc(budget, incidence, requirement, history=None):
+    """
+    greedy_smc on a candidate by element incidence matrix. The gains of all candidates are one sparse product with
+    the unsatisfied mask, and when elements are satisfied their columns are subtracted from the gains. Picks, ties
+    to the lowest index and the pick of candidate 0 when nothing has a positive gain are those of greedy_smc.
+    :param budget: The number of sets that may be chosen.
+    :param incidence: A scipy sparse matrix with a row for each candidate and a column for each element.
+    :param requirement: An int array with the coverage requirement of each element, which is decremented.
+    :param history: A list that receives the index picked and the number of unsatisfied elements after each pick.
+    :return: The indices chosen in order and the mask of unsatisfied elements.
+    """
+    incidence = incidence.tocsr()
+    by_element = incidence.tocsc()
+    unsatisfied = np.ones(incidence.shape[1], dtype=bool)
+    gains = incidence @ unsatisfied.astype(np.int64)
+    chosen = np.zeros(incidence.shape[0], dtype=bool)
+    picks = []
+    i = 0
+    while i < budget:
+        open_gains = np.where(chosen, -1, gains)
+        max_index = int(np.argmax(open_gains)) if len(open_gains) else 0
+        if not len(open_gains) or open_gains[max_index] <= 0:
+            max_index = 0
+        chosen[max_index] = True
+        picks.append(max_index)
+        # Decrement coverage requirements and remove from the unsatisfied set as necessary
+        elements = incidence.indices[incidence.indptr[max_index]:incidence.indptr[max_index + 1]]
+        requirement[elements] -= 1
+        satisfied = elements[requirement[elements] == 0]
+        if len(satisfied):
+            unsatisfied[satisfied] = False
+            gains -= np.asarray(by_element[:, satisfied].sum(axis=1)).ravel().astype(gains.dtype)
+        if history is not None:
+            history.append((max_index, int(unsatisfied.sum())))
+        # Check to see if unsatisfied is empty.
+        if not unsatisfied.any():
+            break
+        i += 1
+    return picks, unsatisfied
+
+
+def cover_matrix(available_to_block, next_infected, model, contagion_index):
+    """
+    Build the multicover instance of a time step from the adjacency of the model: the incidence of nodes that can
+    be blocked with their next infected neighbors, and the number of its infected neighbors each of those next
+    infected nodes has to lose to stay uninfected.
+    :param available_to_block: The nodes that can be blocked.
+    :param next_infected: The nodes infected at the next time step.
+    :param model: The model that was run, its infection_times give the infected neighbor counts.
+    :param contagion_index: The contagion to block.
+    :return: The incidence matrix, the requirement array and the element node ids.
+    """
+    csr = model.csr
+    candidates = csr.rows_of(available_to_block)
+    elements = np.unique(csr.rows_of(next_infected))
+    incidence = csr.adjacency[candidates][:, elements].tocsc()
+    # Only next infected nodes next to a candidate are unsatisfied.
+    covered = np.diff(incidence.indptr) > 0
+    incidence = incidence[:, covered].tocsr()
+    element_ids = csr.ids_of(elements[covered])
+    thresholds = model.params['nodes']["threshold_" + str(contagion_index)]
+    thresholds = np.fromiter((thresholds[v] for v in element_ids), dtype=np.int64, count=len(element_ids))
+    # Find number of infected neighbors
+    affected = model.infection_times.affected_count(contagion_index)[elements[covered]].astype(np.int64)
+    requirement = affected - thresholds + 1
+    return incidence, requirement, element_ids
+
+
 def multi_cover_formulation(available_to_block, next_infected, budget, model, contagion_index):
-    subsets = []
-    unsatisfied = set()
-    # Initialize requirement dict
-    requirement_dict = {}
-    # Construct subsets and unsatisfied array
-    for u in available_to_block:
-        subset = set()
-        for v in model.graph.neighbors(u):
-            if v in next_infected:
-                subset.add(v)
-                if v not in unsatisfied:
-                    unsatisfied.add(v)
-        subsets.append(subset)
-    # Compute requirement values
-    for unsat in unsatisfied:
-        threshold = model.params['nodes']["threshold_" + str(contagion_index)][unsat]
-        # Find number of infected neighbors
-        number_affected = model.graph.nodes[unsat]['affected_' + str(contagion_index)]
-        requirement_dict[unsat] = number_affected - threshold + 1
+    incidence, requirement, _ = cover_matrix(available_to_block, next_infected, model, contagion_index)
     # Find the cover approximation
-    cover_approximation, chosen, unsatisfied_return = greedy_smc(budget, subsets, unsatisfied, requirement_dict)
-    return [available_to_block[index] for index in chosen], len(unsatisfied_return)
+    picks, unsatisfied = sparse_greedy_smc(budget, incidence, requirement)
+    # Add the picks in order so the solution lists nodes like greedy_smc's chosen set does.
+    chosen = set()
+    for index in picks:
+        chosen.add(index)
+    return [available_to_block[index] for index in chosen], int(unsatisfied.sum())
+
+
+def multi_cover_sweep(available_to_block, next_infected, budgets, model, contagion_index):
+    """
+    multi_cover_formulation for several budgets from one greedy run to the largest of them, since the picks for a
+    budget are the first picks for any larger budget.
+    :param available_to_block: The nodes that can be blocked.
+    :param next_infected: The nodes infected at the next time step.
+    :param budgets: The budgets.
+    :param model: The model that was run.
+    :param contagion_index: The contagion to block.
+    :return: A list with the solution and the number of unsatisfied nodes for each budget.
+    """
+    incidence, requirement, _ = cover_matrix(available_to_block, next_infected, model, contagion_index)
+    history = []
+    sparse_greedy_smc(max(budgets, default=0), incidence, requirement, history)
+    solutions = []
+    for budget in budgets:
+        chosen = set()
+        for index, _ in history[:budget]:
+            chosen.add(index)
+        picks = min(budget, len(history))
+        solutions.append(([available_to_block[index] for index in chosen],
+                          history[picks - 1][1] if picks else incidence.shape[1]))
+    return solutions
 
 
 def coverage_heuristic(budget_1, budget_2, model):
@@ -85,87 +168,134 @@ def coverage_heuristic(budget_1, budget_2, model):
     return choices_1, choices_2
 
 
-# def mycallback(model, where):
-#     if where == GRB.Callback.POLLING:
-#         # Ignore polling callback
-#         pass
-#     elif where == GRB.Callback.MIP:
-#         # General MIP callback
-#         nodecnt = model.cbGet(GRB.Callback.MIP_NODCNT)
-#         objbst = model.cbGet(GRB.Callback.MIP_OBJBST)
-#         objbnd = model.cbGet(GRB.Callback.MIP_OBJBND)
-#         solcnt = model.cbGet(GRB.Callback.MIP_SOLCNT)
-#         time = model.cbGet(GRB.Callback.RUNTIME)
-#         if nodecnt - model._lastnode >= 100:
-#             model._lastnode = nodecnt
-#             actnodes = model.cbGet(GRB.Callback.MIP_NODLFT)
-#             itcnt = model.cbGet(GRB.Callback.MIP_ITRCNT)
-#             cutcnt = model.cbGet(GRB.Callback.MIP_CUTCNT)
-#             print('%d %d %d %g %g %d %d' % (nodecnt, actnodes,
-#                                             itcnt, objbst, objbnd, solcnt, cutcnt))
-#         if abs(objbst - objbnd) < 0.15 * (1.0 + abs(objbst)) and time > 900:
-#             print('Stop early - 15% gap achieved in 20 minutes')
-#             model.terminate()
-#
-#
-# def ilp_formulation(available_to_block, next_infected, budget, model, contagion_index):
-#     block = {}
-#     # Initialize requirement dict
-#     requirement_dict = {}
-#     # Construct subsets and unsatisfied array
-#     for u in available_to_block:
-#         block[u] = []
-#         for v in model.graph.neighbors(u):
-#             if v in next_infected:
-#                 block[u].append(v)
-#                 if v not in requirement_dict.keys():
-#                     threshold = model.params['nodes']["threshold_" + str(contagion_index)][v]
-#                     # Find number of infected neighbors
-#                     number_affected = model.graph.nodes[v]['affected_' + str(contagion_index)]
-#                     requirement_dict[v] = number_affected - threshold + 1
-#     # Compute requirement values
-#
-#     next_infected = list(requirement_dict.keys())
-#     m = gp.Model("smc_ilp")
-#
-#     blocking_vars = m.addVars(block.keys(), vtype=GRB.BINARY, name="Blocking node")
-#     is_covered = m.addVars(next_infected, vtype=GRB.BINARY, name="Is_covered")
-#
-#     m.addConstrs(
-#         (gp.quicksum(blocking_vars[t] for t in block.keys() if r in block[t]) - requirement_dict[r] + 1 <= is_covered[
-#             r] * len(available_to_block)
-#          for r in next_infected), name="Constraint 1")
-#
-#     m.addConstrs((gp.quicksum(blocking_vars[t] for t in block.keys() if r in block[t]) - requirement_dict[r] + len(
-#         available_to_block) >= is_covered[r] * len(available_to_block) for r in next_infected), name="Constraint 2")
-#
-#     m.addConstr(gp.quicksum(blocking_vars) <= budget, name="budget")
-#
-#     m.setObjective(gp.quicksum(is_covered), GRB.MAXIMIZE)
-#
-#     m._lastiter = -GRB.INFINITY
-#     m._lastnode = -GRB.INFINITY
-#     m._vars = m.getVars()
-#
-#     m.optimize(mycallback)
-#
-#     solution = [var for var in blocking_vars if blocking_vars[var].x == 1.0]
-#
-#     return solution, m.objVal
+class ILPSession(object):
+    """
+    The set multicover ILP of a time step, built once and solved by HiGHS through scipy.optimize.milp for any number
+    of budgets. A binary x per candidate and a binary c per element with the sum of x next to an element at least
+    its requirement times c, at most budget x, and the number of covered elements maximized. The session only
+    reuses the constraint matrix, every solve is a new milp with another budget bound since milp takes no warm
+    start. The solution of a smaller budget stays feasible and, with the greedy solution, is passed as a lower
+    bound on the objective, and a solve is skipped when that bound already covers every element. As the Gurobi
+    callback did, a solve is exact for gap_time seconds and then stops at a relative gap of gap, within time_limit
+    seconds.
+    """
+
+    def __init__(self, available_to_block, next_infected, model, contagion_index, gap_time=900, gap=.15,
+                 time_limit=1800):
+        """
+        :param available_to_block: The nodes that can be blocked.
+        :param next_infected: The nodes infected at the next time step.
+        :param model: The model that was run.
+        :param contagion_index: The contagion to block.
+        :param gap_time: The seconds spent looking for an optimal solution.
+        :param gap: The relative gap accepted after gap_time.
+        :param time_limit: The seconds after which the best solution found is returned.
+        """
+        self.available_to_block = available_to_block
+        self.incidence, self.requirement, _ = cover_matrix(available_to_block, next_infected, model,
+                                                           contagion_index)
+        number_candidates, number_elements = self.incidence.shape
+        # Variables are the x of the candidates followed by the c of the elements.
+        self.covering = LinearConstraint(
+            sp.hstack([self.incidence.T, -sp.diags(self.requirement.astype(float))], format='csr'), 0, np.inf)
+        self.budget_row = np.concatenate([np.ones(number_candidates), np.zeros(number_elements)])
+        self.objective_row = np.concatenate([np.zeros(number_candidates), np.ones(number_elements)])
+        self.phases = [{"time_limit": min(gap_time, time_limit)}]
+        if time_limit > gap_time:
+            self.phases.append({"time_limit": time_limit - gap_time, "mip_rel_gap": gap})
+        # The (budget, blocking x, number covered) of every solve.
+        self.solutions = []
+
+    def covered(self, x):
+        """
+        :param x: A blocking indicator over the candidates.
+        :return: The number of elements it covers.
+        """
+        return int(np.count_nonzero(self.incidence.T @ x >= self.requirement))
+
+    def solve(self, budget):
+        """
+        :param budget: The number of nodes that may be blocked.
+        :return: The nodes to block and the number of unsatisfied nodes.
+        """
+        number_candidates, number_elements = self.incidence.shape
+        picks, unsatisfied = sparse_greedy_smc(budget, self.incidence, self.requirement.copy())
+        best = np.zeros(number_candidates)
+        best[picks] = 1
+        best_covered = self.covered(best)
+        for solved_budget, x, number_covered in self.solutions:
+            if solved_budget <= budget and number_covered > best_covered:
+                best, best_covered = x, number_covered
+        if best_covered < number_elements:
+            for options in self.phases:
+                result = milp(-self.objective_row, integrality=np.ones(len(self.objective_row)),
+                              bounds=Bounds(0, 1),
+                              constraints=[self.covering, LinearConstraint(self.budget_row, 0, budget),
+                                           LinearConstraint(self.objective_row, best_covered, number_elements)],
+                              options=options)
+                if result.x is not None:
+                    x = np.round(result.x[:number_candidates])
+                    if self.covered(x) >= best_covered:
+                        best, best_covered = x, self.covered(x)
+                if result.status != 1:
+                    # Solved to optimality or gap, no time limit was hit.
+                    break
+        self.solutions.append((budget, best, best_covered))
+        return [self.available_to_block[index] for index in np.flatnonzero(best)], number_elements - best_covered
+
+
+def ilp_formulation(available_to_block, next_infected, budget, model, contagion_index, gap_time=900, gap=.15,
+                    time_limit=1800):
+    """
+    Solve the set multicover ILP of a time step for one budget, see ILPSession.
+    :return: The nodes to block and the number of unsatisfied nodes.
+    """
+    return ILPSession(available_to_block, next_infected, model, contagion_index, gap_time, gap,
+                      time_limit).solve(budget)
+
+
+def ilp_sweep(available_to_block, next_infected, budgets, model, contagion_index):
+    """
+    ilp_formulation for several budgets from one ILPSession, solved from the smallest budget up so the previous
+    optimum bounds every solve from below.
+    :return: A list with the solution and the number of unsatisfied nodes for each budget.
+    """
+    session = ILPSession(available_to_block, next_infected, model, contagion_index)
+    solutions = {}
+    for budget in sorted(set(budgets)):
+        solutions[budget] = session.solve(budget)
+    return [solutions[budget] for budget in budgets]
+
+
+def infected_steps(node_infections, contagion_index):
+    """
+    :param node_infections: The newly infected nodes at each time, or the InfectionTimes of the run.
+    :param contagion_index: The contagion.
+    :return: The newly infected nodes at each time.
+    """
+    if isinstance(node_infections, InfectionTimes):
+        return node_infections.node_infections(contagion_index)
+    return node_infections
 
 
 def try_all_sets(node_infections, budget, model, seed_set, coverage_function=multi_cover_formulation,
-                 contagion_index=1):
+                 contagion_index=1, executor=None):
     """
 
-    :param node_infections:
+    :param node_infections: The newly infected nodes at each time, or the InfectionTimes of the run.
     :param budget:
     :param model:
     :param seed_set:
     :param coverage_function:
     :param contagion_index:
+    :param executor: A concurrent.futures executor to solve the time steps in parallel on, see
+    try_all_sets_parallel.
     :return:
     """
+    if executor is not None:
+        return try_all_sets_parallel(node_infections, budget, model, seed_set, executor, coverage_function,
+                                     contagion_index)
+    node_infections = infected_steps(node_infections, contagion_index)
     # Start iteration at i = 1 to find best nodes for contagion contagion_index
     # Int max
     min_unsatisfied = np.iinfo(np.int32).max
@@ -188,3 +318,145 @@ def try_all_sets(node_infections, budget, model, seed_set, coverage_function=mul
             best_solution = solution
     # If no satisfied set is found, return the one with the least violations
     return best_solution
+
+
+def try_all_sets_parallel(node_infections, budget, model, seed_set, executor,
+                          coverage_function=multi_cover_formulation, contagion_index=1):
+    """
+    try_all_sets with the cover problems of all time steps submitted to an executor at once. The answer is that of
+    try_all_sets: the earliest time step that is covered, else the least violating solution. When a step is
+    covered the pending later steps are cancelled, and an error in a step is only raised if try_all_sets would
+    have reached that step.
+    :param node_infections: The newly infected nodes at each time, or the InfectionTimes of the run.
+    :param budget: The number of nodes that may be blocked.
+    :param model: The model that was run.
+    :param seed_set: The seed nodes, which are never blocked.
+    :param executor: A concurrent.futures executor; a process pool needs a picklable model and coverage_function.
+    :param coverage_function: The function solving the cover problem of a time step.
+    :param contagion_index: The contagion to block.
+    :return: The nodes to block.
+    """
+    node_infections = infected_steps(node_infections, contagion_index)
+    steps = []
+    block_all = None
+    for i in range(len(node_infections) - 1):
+        available_to_block = np.setdiff1d(node_infections[i], seed_set)
+        if len(available_to_block) <= budget:
+            # Blocking every node at this time step ends the search, later steps are never needed.
+            block_all = available_to_block
+            break
+        steps.append(available_to_block)
+    futures = [executor.submit(coverage_function, available_to_block, node_infections[i + 1], budget, model,
+                               contagion_index) for i, available_to_block in enumerate(steps)]
+    first_covered = len(steps)
+    pending = set(futures)
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            i = futures.index(future)
+            if i < first_covered and not future.cancelled() and future.exception() is None and \
+                    future.result()[1] == 0:
+                first_covered = i
+                for later in futures[i + 1:]:
+                    later.cancel()
+        pending = {future for future in pending if futures.index(future) < first_covered}
+    min_unsatisfied = np.iinfo(np.int32).max
+    best_solution = []
+    for i in range(first_covered):
+        solution, num_unsatisfied = futures[i].result()
+        if min_unsatisfied > num_unsatisfied:
+            min_unsatisfied = num_unsatisfied
+            best_solution = solution
+    if first_covered < len(steps):
+        return futures[first_covered].result()[0]
+    if block_all is not None:
+        return block_all
+    return best_solution
+
+
+def try_all_sets_sweep(node_infections, budgets, model, seed_set, coverage_sweep=multi_cover_sweep,
+                       contagion_index=1, executor=None):
+    """
+    try_all_sets for many budgets at once. Each time step is solved by one coverage_sweep call for all the budgets
+    still looking for a cover instead of one call per budget.
+    :param node_infections: The newly infected nodes at each time, or the InfectionTimes of the run.
+    :param budgets: The budgets.
+    :param model: The model that was run.
+    :param seed_set: The seed nodes, which are never blocked.
+    :param coverage_sweep: A function like multi_cover_sweep solving a time step for a list of budgets.
+    :param contagion_index: The contagion to block.
+    :param executor: A concurrent.futures executor to solve the time steps in parallel on. Every step is then
+    solved for the budgets that reach it when no earlier step is covered, and a step is cancelled as soon as all
+    of its budgets are covered at earlier steps.
+    :return: A list with what try_all_sets returns for each budget and its number of unsatisfied nodes, 0 when
+    the cover is complete or there was nothing to cover.
+    """
+    node_infections = infected_steps(node_infections, contagion_index)
+    steps = [np.setdiff1d(node_infections[i], seed_set) for i in range(len(node_infections) - 1)]
+    futures = {}
+    if executor is not None:
+        # The first step known to settle each budget, by a complete cover or by blocking the whole step.
+        settled = [len(steps)] * len(budgets)
+        reaching = list(range(len(budgets)))
+        for i, available_to_block in enumerate(steps):
+            for k in reaching:
+                if len(available_to_block) <= budgets[k]:
+                    settled[k] = i
+            reaching = [k for k in reaching if len(available_to_block) > budgets[k]]
+            if not reaching:
+                break
+            futures[i] = (reaching, executor.submit(coverage_sweep, available_to_block, node_infections[i + 1],
+                                                    [budgets[k] for k in reaching], model, contagion_index))
+        pending = {future: i for i, (_, future) in futures.items()}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                i = pending.pop(future)
+                if not future.cancelled() and future.exception() is None:
+                    for k, (_, num_unsatisfied) in zip(futures[i][0], future.result()):
+                        if num_unsatisfied == 0:
+                            settled[k] = min(settled[k], i)
+            for future, i in list(pending.items()):
+                if all(settled[k] < i for k in futures[i][0]):
+                    future.cancel()
+                    del pending[future]
+    min_unsatisfied = [np.iinfo(np.int32).max] * len(budgets)
+    best_solution = [[] for _ in budgets]
+    results = [None] * len(budgets)
+    searching = list(range(len(budgets)))
+    for i, available_to_block in enumerate(steps):
+        if not searching:
+            break
+        remaining = []
+        for k in searching:
+            if len(available_to_block) <= budgets[k]:
+                # If we can vaccinate all nodes at infected at this time step return that.
+                results[k] = (available_to_block, 0)
+            else:
+                remaining.append(k)
+        searching = []
+        if not remaining:
+            break
+        if i in futures:
+            reaching, future = futures[i]
+            solutions = dict(zip(reaching, future.result()))
+            solutions = [solutions[k] for k in remaining]
+        else:
+            solutions = coverage_sweep(available_to_block, node_infections[i + 1], [budgets[k] for k in remaining],
+                                       model, contagion_index)
+        for k, (solution, num_unsatisfied) in zip(remaining, solutions):
+            if num_unsatisfied == 0:
+                results[k] = (solution, 0)
+                continue
+            if min_unsatisfied[k] > num_unsatisfied:
+                min_unsatisfied[k] = num_unsatisfied
+                best_solution[k] = solution
+            searching.append(k)
+    for _, future in futures.values():
+        future.cancel()
+    for k in range(len(budgets)):
+        if results[k] is None:
+            # If no satisfied set is found, keep the one with the least violations
+            results[k] = (best_solution[k],
+                          0 if min_unsatisfied[k] == np.iinfo(np.int32).max else min_unsatisfied[k])
+    return results
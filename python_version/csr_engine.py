@@ -0,0 +1,55 @@
+import numpy as np
+
+
+def node_arrays(model, csr):
+    """
+    Read the node parameters of a configured model into arrays in CSR row order.
+    :param model: A configured MultipleContagionThreshold.
+    :param csr: The CSRGraph of the model's graph.
+    :return: The interaction adjusted thresholds and the blocked masks for both contagions.
+    """
+    nodes = csr.nodes
+    params = model.params['nodes']
+    # iteration() reads threshold_1 for both contagions, so the engines do the same to match it exactly.
+    threshold = np.fromiter((params['threshold_1'][u] for u in nodes), dtype=np.int64, count=len(nodes))
+    # int() truncates towards zero, as does the cast of the scaled float array.
+    threshold_1 = threshold + (threshold * model.params['model']['interaction_1']).astype(np.int64)
+    threshold_2 = threshold + (threshold * model.params['model']['interaction_2']).astype(np.int64)
+    blocked_1 = np.fromiter((params['blocked_1'][u] != 0 for u in nodes), dtype=bool, count=len(nodes))
+    blocked_2 = np.fromiter((params['blocked_2'][u] != 0 for u in nodes), dtype=bool, count=len(nodes))
+    return threshold_1, threshold_2, blocked_1, blocked_2
+
+
+def status_array(status, csr):
+    """
+    :param status: A dict from node id to status.
+    :param csr: The CSRGraph the status belongs to.
+    :return: A uint8 array of statuses in CSR row order.
+    """
+    return np.fromiter((status[u] for u in csr.nodes), dtype=np.uint8, count=len(csr.nodes))
+
+
+def step(adjacency, state, threshold_1, threshold_2, blocked_1, blocked_2):
+    """
+    Evaluate one synchronous step of the threshold model. Bit 1 of a state marks contagion 1 and bit 2
+    marks contagion 2, so the transitions 0 -> 1, 2, 3 and 1, 2 -> 3 are a bitwise or of the new infections.
+    :param adjacency: The scipy CSR adjacency matrix.
+    :param state: The uint8 state array.
+    :param threshold_1: The thresholds for contagion 1.
+    :param threshold_2: The thresholds for contagion 2.
+    :param blocked_1: The mask of nodes blocked for contagion 1.
+    :param blocked_2: The mask of nodes blocked for contagion 2.
+    :return: The masks of nodes newly infected with each contagion and the infected neighbor counts.
+    """
+    counts_1 = adjacency @ (state & 1)
+    counts_2 = adjacency @ (state >> 1)
+    new_1 = ((state & 1) == 0) & (counts_1 >= threshold_1) & ~blocked_1
+    new_2 = ((state & 2) == 0) & (counts_2 >= threshold_2) & ~blocked_2
+    return new_1, new_2, counts_1, counts_2
+
+
+def apply(state, new_1, new_2, out=None):
+    """
+    :return: The state after the new infections.
+    """
+    return np.bitwise_or(state, new_1.astype(np.uint8) | (new_2.astype(np.uint8) << 1), out=out)
@@ -0,0 +1,379 @@
+import hashlib
+import weakref
+from multiprocessing import shared_memory
+
+import numpy as np
+import scipy.sparse as sp
+
+# CSR views of networkx graphs keyed by the graph object, so models built on the same graph share one.
+_csr_cache = weakref.WeakKeyDictionary()
+
+
+class CSRGraph(object):
+    """
+    A compressed sparse row view of a graph. Row u of the adjacency holds the nodes whose states are counted
+    by u, i.e. its neighbors for undirected graphs and its successors for directed ones, which is what
+    AGraph.neighbors returns for the diffusion model.
+    """
+
+    def __init__(self, indptr, indices, nodes, directed=False):
+        """
+        :param indptr: The CSR row pointer array of length n + 1.
+        :param indices: The CSR column index array.
+        :param nodes: The original node ids in row order, a list or an integer array.
+        :param directed: If the rows hold successors of a directed graph.
+        """
+        self.indptr = indptr
+        self.indices = indices
+        self.directed = directed
+        # An id array stands in for the list and the index dict, which are only built if something asks for them.
+        if isinstance(nodes, np.ndarray):
+            self._nodes = None
+            self._node_ids = nodes
+        else:
+            self._nodes = nodes
+            self._node_ids = None
+        self._index = None
+        self._order = None
+        self._ids_sorted = None
+        self._adjacency = None
+        self._reverse = None
+        self._fingerprint = None
+
+    @classmethod
+    def from_networkx(cls, G):
+        """
+        Build the CSR view of a networkx graph with rows in G.nodes order.
+        :param G: A networkx graph.
+        :return: A CSRGraph.
+        """
+        nodes = list(G.nodes())
+        index = {node: i for i, node in enumerate(nodes)}
+        # Successors for directed graphs; parallel edges of multigraphs collapse to one neighbor like in G.neighbors.
+        adj = G.succ if G.is_directed() else G.adj
+        degrees = np.fromiter((len(adj[u]) for u in nodes), dtype=np.int64, count=len(nodes))
+        indptr = np.zeros(len(nodes) + 1, dtype=np.int64)
+        np.cumsum(degrees, out=indptr[1:])
+        indices = np.fromiter((index[v] for u in nodes for v in adj[u]), dtype=np.int32, count=indptr[-1])
+        # Sort the columns within each row.
+        order = np.lexsort((indices, np.repeat(np.arange(len(nodes)), degrees)))
+        csr = cls(indptr, indices[order], nodes, G.is_directed())
+        csr._index = index
+        return csr
+
+    @classmethod
+    def of(cls, G):
+        """
+        Return the cached CSR view of a networkx graph, building it if the graph is new or has changed size.
+        :param G: A networkx graph, or a CSRGraph which is returned as is.
+        :return: A CSRGraph.
+        """
+        if isinstance(G, CSRGraph):
+            return G
+        csr, size = _csr_cache.get(G, (None, None))
+        if csr is None or size != (G.number_of_nodes(), G.number_of_edges()):
+            csr = cls.from_networkx(G)
+            _csr_cache[G] = (csr, (G.number_of_nodes(), G.number_of_edges()))
+        return csr
+
+    @property
+    def nodes(self):
+        """
+        :return: The node ids as a list in row order.
+        """
+        if self._nodes is None:
+            self._nodes = self._node_ids.tolist()
+        return self._nodes
+
+    @property
+    def index(self):
+        """
+        :return: A dict from node id to row.
+        """
+        if self._index is None:
+            self._index = {node: i for i, node in enumerate(self.nodes)}
+        return self._index
+
+    @property
+    def node_ids(self):
+        """
+        :return: The node ids as an array in row order.
+        """
+        if self._node_ids is None:
+            self._node_ids = np.asarray(self.nodes)
+        return self._node_ids
+
+    @property
+    def fingerprint(self):
+        """
+        :return: A hex digest of the node ids and the adjacency, equal for equal graphs.
+        """
+        if self._fingerprint is None:
+            digest = hashlib.blake2b(digest_size=20)
+            digest.update(bytes([self.directed]))
+            digest.update(np.ascontiguousarray(self.indptr, dtype=np.int64).tobytes())
+            digest.update(np.ascontiguousarray(self.indices, dtype=np.int32).tobytes())
+            digest.update(repr(self.nodes).encode() if self.node_ids.dtype == object else self.node_ids.tobytes())
+            self._fingerprint = digest.hexdigest()
+        return self._fingerprint
+
+    @property
+    def adjacency(self):
+        """
+        :return: A scipy CSR matrix sharing the indptr and indices arrays.
+        """
+        if self._adjacency is None:
+            data = np.ones(len(self.indices), dtype=np.int32)
+            n = self.number_of_nodes()
+            self._adjacency = sp.csr_array((data, self.indices, self.indptr), shape=(n, n))
+        return self._adjacency
+
+    @property
+    def reverse(self):
+        """
+        :return: The CSRGraph whose rows hold the nodes that count each node, which is the graph itself when undirected.
+        """
+        if not self.directed:
+            return self
+        if self._reverse is None:
+            transpose = self.adjacency.T.tocsr()
+            transpose.sort_indices()
+            self._reverse = CSRGraph(transpose.indptr.astype(np.int64), transpose.indices.astype(np.int32),
+                                     self._nodes if self._nodes is not None else self._node_ids, True)
+            self._reverse._index = self._index
+            self._reverse._node_ids = self._node_ids
+            self._reverse._order = self._order
+            self._reverse._ids_sorted = self._ids_sorted
+            self._reverse._reverse = self
+        return self._reverse
+
+    def gather(self, rows):
+        """
+        Concatenate the adjacency rows of several nodes without a Python loop.
+        :param rows: An array of rows.
+        :return: The column indices of all the rows, with repeats.
+        """
+        starts = self.indptr[rows]
+        lengths = self.indptr[rows + 1] - starts
+        # Offset of every output slot from the start of its row.
+        offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        return self.indices[np.repeat(starts, lengths) + offsets]
+
+    def subgraph(self, rows):
+        """
+        :param rows: A sorted array of rows.
+        :return: The CSRGraph induced by the rows, with them in the same order.
+        """
+        rows = np.asarray(rows)
+        induced = self.adjacency[rows][:, rows]
+        induced.sort_indices()
+        return CSRGraph(induced.indptr.astype(np.int64), induced.indices.astype(np.int32), self.ids_of(rows),
+                        self.directed)
+
+    def number_of_nodes(self):
+        return len(self._nodes) if self._nodes is not None else len(self._node_ids)
+
+    def number_of_edges(self):
+        return len(self.indices) if self.directed else len(self.indices) // 2
+
+    def degree(self):
+        """
+        :return: A list of (node, degree) pairs in row order like networkx G.degree().
+        """
+        return list(zip(self.nodes, np.diff(self.indptr).tolist()))
+
+    def share(self):
+        """
+        Publish the arrays in one shared memory block that other processes attach to without copying.
+        :return: The SharedCSRGraph handle, which owns the block until unlinked.
+        """
+        return SharedCSRGraph(self)
+
+    def _id_order(self):
+        # The rows by increasing id, None if the ids already increase with the rows.
+        if self._ids_sorted is None:
+            ids = self._node_ids
+            self._ids_sorted = bool(np.all(ids[:-1] < ids[1:]))
+            if not self._ids_sorted:
+                self._order = np.argsort(ids, kind='stable')
+        return self._order
+
+    def _searchable(self):
+        # Without an index dict integer ids are looked up by binary search.
+        return self._index is None and self._node_ids is not None and self._node_ids.dtype.kind in "iu"
+
+    def rows_of(self, node_ids):
+        """
+        Map node ids to rows.
+        :param node_ids: An iterable of node ids.
+        :return: An int64 array of rows.
+        """
+        if not self._searchable():
+            index = self.index
+            return np.fromiter((index[u] for u in node_ids), dtype=np.int64)
+        ids = self._node_ids
+        keys = np.fromiter(node_ids, dtype=ids.dtype)
+        order = self._id_order()
+        rows = np.minimum(np.searchsorted(ids, keys, sorter=order), len(ids) - 1)
+        if order is not None:
+            rows = order[rows]
+        missing = ids[rows] != keys
+        if missing.any():
+            raise KeyError(keys[missing][0].item())
+        return rows.astype(np.int64)
+
+    def row_of(self, u):
+        """
+        :param u: A node id.
+        :return: Its row, a KeyError if it is not a node.
+        """
+        if not self._searchable():
+            return self.index[u]
+        if not isinstance(u, (int, np.integer)):
+            raise KeyError(u)
+        return int(self.rows_of((u,))[0])
+
+    def ids_of(self, rows):
+        """
+        Map rows back to node ids.
+        :param rows: An array of rows.
+        :return: A list of node ids.
+        """
+        if self._nodes is None:
+            return self._node_ids[rows].tolist()
+        nodes = self._nodes
+        return [nodes[i] for i in rows.tolist()]
+
+
+class SharedCSRGraph(object):
+    """
+    A picklable handle to the arrays of a CSRGraph in multiprocessing shared memory. Pickling the handle sends
+    only the block name and layout, and attach maps the block in the receiving process so every worker reads the
+    same physical pages. Integer node ids are stored in the block too, with their sort order unless they are
+    sorted, so an attached graph maps ids to rows by binary search; other ids travel with the handle.
+    """
+
+    def __init__(self, csr):
+        """
+        :param csr: The CSRGraph to publish.
+        """
+        node_ids = csr.node_ids
+        arrays = [csr.indptr, csr.indices]
+        self.nodes = None
+        if node_ids.ndim == 1 and node_ids.dtype.kind in "iu":
+            arrays.append(node_ids)
+            order = csr._id_order()
+            if order is not None:
+                arrays.append(order)
+        else:
+            self.nodes = list(csr.nodes)
+        # (dtype, length, offset) of each array, aligned to 8 bytes.
+        self.layout = []
+        offset = 0
+        for array in arrays:
+            self.layout.append((array.dtype.str, len(array), offset))
+            offset += -(-array.nbytes // 8) * 8
+        self.directed = csr.directed
+        self._shm = shared_memory.SharedMemory(create=True, size=max(offset, 1))
+        self.name = self._shm.name
+        for array, view in zip(arrays, self._views(self._shm)):
+            view[:] = array
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_shm"] = None
+        return state
+
+    def _views(self, shm):
+        return [np.ndarray((length,), dtype=np.dtype(dtype), buffer=shm.buf, offset=offset)
+                for dtype, length, offset in self.layout]
+
+    def attach(self):
+        """
+        Map the block in this process.
+        :return: A CSRGraph whose arrays are views of the shared block.
+        """
+        shm = self._shm if self._shm is not None else shared_memory.SharedMemory(name=self.name)
+        views = self._views(shm)
+        csr = CSRGraph(views[0], views[1], views[2] if self.nodes is None else self.nodes, self.directed)
+        if self.nodes is None:
+            csr._order = views[3] if len(views) > 3 else None
+            csr._ids_sorted = len(views) == 3
+        # The mapping must live as long as the arrays viewing it.
+        csr._shared = shm
+        return csr
+
+    def unlink(self):
+        """
+        Release the block, called once by the process that published it after the workers are done.
+        """
+        if self._shm is not None:
+            self._shm.unlink()
+            try:
+                self._shm.close()
+            except BufferError:
+                # Graphs attached in this process still view the block, it is unmapped when they are freed.
+                pass
+            self._shm = None
+
+
+class NodeView(object):
+    """
+    The node side of GraphView: iterates over the node ids and keeps an attribute dict per node, created on
+    first access from the defaults.
+    """
+
+    def __init__(self, csr, defaults=None):
+        self._csr = csr
+        self._defaults = defaults or {}
+        self._data = {}
+
+    def __call__(self):
+        return self
+
+    def __iter__(self):
+        return iter(self._csr.nodes)
+
+    def __len__(self):
+        return self._csr.number_of_nodes()
+
+    def __contains__(self, u):
+        try:
+            self._csr.row_of(u)
+        except KeyError:
+            return False
+        return True
+
+    def __getitem__(self, u):
+        data = self._data.get(u)
+        if data is None:
+            self._csr.row_of(u)
+            data = self._data[u] = dict(self._defaults)
+        return data
+
+
+class GraphView(object):
+    """
+    The part of the netdispatch AGraph interface used by the diffusion model and the coverage heuristic, on top
+    of a CSRGraph so a model can run on an attached shared graph without building networkx.
+    """
+
+    def __init__(self, csr, node_defaults=None):
+        """
+        :param csr: The CSRGraph.
+        :param node_defaults: The attributes every node starts with.
+        """
+        self.graph = csr
+        self.directed = csr.directed
+        self.nodes = NodeView(csr, node_defaults)
+
+    def neighbors(self, u):
+        csr = self.graph
+        row = csr.row_of(u)
+        return csr.ids_of(csr.indices[csr.indptr[row]:csr.indptr[row + 1]])
+
+    def number_of_nodes(self):
+        return self.graph.number_of_nodes()
+
+    def number_of_edges(self):
+        return self.graph.number_of_edges()
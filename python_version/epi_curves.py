@@ -1,63 +1,14 @@
 import csv
-from os.path import exists
 
-import networkx as nx
 import numpy as np
 
+import baseline_blocking
+import batch_simulation
 import coverage_heuristic as cbh
+import graph_store
+import seed_selection
 import utils
-
-
-def choose_seed(core, seed_size):
-    component = np.random.choice(core, seed_size, replace=False)
-    seed_set_1 = []
-    seed_set_2 = []
-    seed_set_3 = []
-    for index in range(len(component)):
-        roll = np.random.randint(1, 4)
-        if roll == 3:
-            seed_set_3.append(component[index])
-        elif roll == 2:
-            seed_set_2.append(component[index])
-        elif roll == 1:
-            seed_set_1.append(component[index])
-        else:
-            raise ValueError("Not in the correct range")
-    return seed_set_1, seed_set_2, seed_set_3
-
-
-def choose_nodes_by_degree(G, budget_1, budget_2, seed_set):
-    choices_1 = []
-    choices_2 = []
-    nodes_by_degree = sorted(G.degree(), key=lambda x: x[1], reverse=True)
-    index = 0
-    while len(choices_1) < budget_1:
-        if nodes_by_degree[index][0] not in seed_set:
-            choices_1.append(nodes_by_degree[index][0])
-        index += 1
-    index = 0
-    while len(choices_2) < budget_2:
-        if nodes_by_degree[index][0] not in seed_set:
-            choices_2.append(nodes_by_degree[index][0])
-        index += 1
-    return choices_1, choices_2
-
-
-def choose_randomly(G, budget_1, budget_2, seed_set):
-    nodes = list(G.nodes())
-    choices_1 = []
-    choices_2 = []
-    index = np.random.randint(0, len(nodes))
-    while len(choices_1) < budget_1:
-        if nodes[index] not in seed_set and nodes[index] not in choices_1:
-            choices_1.append(nodes[index])
-        index = np.random.randint(0, len(nodes))
-    index = np.random.randint(0, len(nodes))
-    while len(choices_2) < budget_2:
-        if nodes[index] not in seed_set and nodes[index] not in choices_2:
-            choices_2.append(nodes[index])
-        index = np.random.randint(0, len(nodes))
-    return choices_1, choices_2
+from simulation_cache import SimulationCache
 
 
 def write_delta(model, epi_file, blocking, threshold):
@@ -76,6 +27,35 @@ def write_delta(model, epi_file, blocking, threshold):
         old_count = results['node_count']
 
 
+def write_run_delta(model, seed_sets, node_infections_1, node_infections_2, epi_file, blocking, threshold):
+    """
+    Writes the rows write_delta writes for a model from the newly infected nodes of its finished run, so the run
+    is not simulated a second time.
+    :param model: The model that was run.
+    :param seed_sets: The seed sets the model was configured with.
+    :param node_infections_1: The newly infected nodes of contagion 1 at each time returned by simulation_run.
+    :param node_infections_2: The newly infected nodes of contagion 2 at each time returned by simulation_run.
+    :param epi_file: The file to append to.
+    :param blocking: The blocking name written to the rows.
+    :param threshold: The threshold written to the rows.
+    """
+    csr = model.csr
+    state = batch_simulation.state_matrix(csr, [seed_sets])[:, 0]
+    old_count = np.bincount(state, minlength=4)
+    with open(epi_file, 'a', newline='') as epi_fp:
+        epi_write = csv.writer(epi_fp)
+        # simulation_run drops the final step without changes that write_delta still writes.
+        for k, (new_1, new_2) in enumerate(zip(node_infections_1 + [[]], node_infections_2 + [[]])):
+            if len(new_1):
+                state[csr.rows_of(new_1)] |= 1
+            if len(new_2):
+                state[csr.rows_of(new_2)] |= 2
+            count = np.bincount(state, minlength=4)
+            epi_write.writerow(
+                [str(k + 2), threshold, blocking] + list(map(lambda x: str(x), (count - old_count).tolist())))
+            old_count = count
+
+
 def main():
     field_names = ['time', 'threshold', 'blocking'] + ['state_' + str(i) for i in range(4)]
     # Add fields for node counts for each blocking method
@@ -95,29 +75,26 @@ def main():
     thresholds = (2, 3, 4)
     budgets = [.02]
     sample_number = 100
+    cache = SimulationCache()
 
     for i in range(len(net_names)):
-        np.random.seed(seeds[i])
+        rng = np.random.default_rng(seeds[i])
         net_name = net_names[i]
-        G = nx.read_edgelist(network_folder + net_name + '.edges', nodetype=int, create_using=nx.Graph)
-        # If there is a node file add it.
-        if exists(net_name + ".nodes"):
-            with open(network_folder + net_name + ".nodes", 'r') as node_fp:
-                node_str = node_fp.readline().strip('\n')
-                node_id = int(node_str)
-                G.add_node(node_id)
-        for node in G.nodes:
-            G.nodes[node]['affected_1'] = 0
-            G.nodes[node]['affected_2'] = 0
+        # Parsed once with the node file next to it into a binary cache, later runs memory map it.
+        G, _, core_numbers = graph_store.load_network(network_folder + net_name + '.edges')
+        # One model per threshold for the unblocked runs and one for the blocked ones, reset for every scenario.
+        models = {threshold: utils.build_model(G, threshold) for threshold in thresholds}
+        blocked_models = {threshold: utils.build_model(G, threshold) for threshold in thresholds}
         # Select k-core
-        k_core = list(nx.k_core(G, 20).nodes())
+        k_core = seed_selection.k_core(core_numbers, 20)
         for seed_size in [20]:
             # Initialize accumulators Mult-level dict threshold -> (budget -> (results_avg, results_blocked_avg,
             # results_degree_avg, results_random))
 
             for sample in range(sample_number):
                 # Choose seed set
-                seed_set_1, seed_set_2, seed_set_3 = choose_seed(k_core, seed_size)
+                seed_set_1, seed_set_2, seed_set_3 = seed_selection.split_seeds(
+                    rng, G, seed_selection.choose_random_k_core(rng, k_core, seed_size))
                 seed_set = set(seed_set_1 + seed_set_2 + seed_set_3)
                 for k in range(len(thresholds)):
                     # Pull out threshold
@@ -126,10 +103,10 @@ def main():
                         # Get the budget
                         budget = int(budgets[j] * G.number_of_nodes())
                         # Configure model
-                        model = utils.config_model(G, threshold, seed_set_1, seed_set_2, seed_set_3)
-                        node_infections_1, node_infections_2, results = model.simulation_run()
-                        model = utils.config_model(G, threshold, seed_set_1, seed_set_2, seed_set_3)
-                        write_delta(model, epi_file, 'no_block', threshold)
+                        model = models[threshold].reset(seed_set_1, seed_set_2, seed_set_3)
+                        node_infections_1, node_infections_2, results = cache.simulation_run(model)
+                        write_run_delta(model, (seed_set_1, seed_set_2, seed_set_3), node_infections_1,
+                                        node_infections_2, epi_file, 'no_block', threshold)
                         # Analyze node counts
                         infected_1 = results['node_count'][1] + results['node_count'][3]
                         total_infected = sum(results['node_count'][i] for i in range(1, 4))
@@ -139,35 +116,36 @@ def main():
                         budget_2 = budget - budget_1
                         # Run through the CBH from DMKD for both contagions.
                         choices_1 = cbh.try_all_sets(node_infections_1, budget_1, model, set(seed_set_1 + seed_set_3),
-                                                     1)
+                                                     contagion_index=1)
                         if len(choices_1) < budget_1:
                             budget_2 += budget_1 - len(choices_1)
                         choices_2 = cbh.try_all_sets(node_infections_2, budget_2, model, set(seed_set_2 + seed_set_3),
-                                                     2)
+                                                     contagion_index=2)
                         if len(choices_2) < budget_2:
                             choices_1 = cbh.try_all_sets(node_infections_1, budget_1 + (budget_2 - len(choices_2)),
                                                          model, set(seed_set_1 + seed_set_3),
-                                                         1)
+                                                         contagion_index=1)
 
                         # TODO: Think about the situation where we can block both at a certain time steps.
 
                         # Run again with the CBH blocking
                         # Configure model
-                        model = utils.config_model(G, threshold, seed_set_1, seed_set_2, seed_set_3, choices_1,
-                                                   choices_2)
+                        model = blocked_models[threshold].reset(seed_set_1, seed_set_2, seed_set_3, choices_1,
+                                                                choices_2)
                         write_delta(model, epi_file, 'mcich', threshold)
                         # Find high degree nodes
-                        choices_1, choices_2 = choose_nodes_by_degree(G, budget_1, budget_2, seed_set)
+                        choices_1, choices_2 = baseline_blocking.choose_nodes_by_degree(G, budget_1, budget_2, seed_set)
                         # Run forward
-                        model = utils.config_model(G, threshold, seed_set_1, seed_set_2, seed_set_3, choices_1,
-                                                   choices_2)
+                        model = blocked_models[threshold].reset(seed_set_1, seed_set_2, seed_set_3, choices_1,
+                                                                choices_2)
                         write_delta(model, epi_file, 'degree', threshold)
                         # Find random nodes
-                        choices_1, choices_2 = choose_randomly(G, budget_1, budget_2, seed_set)
+                        choices_1, choices_2 = baseline_blocking.choose_randomly(rng, G, budget_1, budget_2, seed_set)
                         # Run forward
-                        model = utils.config_model(G, threshold, seed_set_1, seed_set_2, seed_set_3, choices_1,
-                                                   choices_2)
+                        model = blocked_models[threshold].reset(seed_set_1, seed_set_2, seed_set_3, choices_1,
+                                                                choices_2)
                         write_delta(model, epi_file, 'random', threshold)
+    print('Simulation cache hits: %d misses: %d' % (cache.hits, cache.misses))
 
 
 if __name__ == '__main__':
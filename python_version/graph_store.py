@@ -0,0 +1,292 @@
+import bz2
+import gzip
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import seed_selection
+from csr_graph import CSRGraph
+
+# Bumped when the stored arrays change, so older caches are rebuilt.
+FORMAT_VERSION = 3
+_ARRAYS = ("indptr", "indices", "nodes", "degrees", "core_numbers")
+# The size of the blocks of the edge list parsed by each thread.
+_BLOCK_SIZE = 1 << 22
+_POWERS = 10 ** np.arange(19, dtype=np.int64)
+_WHITESPACE = np.frombuffer(b" \t\n\r\v\f", dtype=np.uint8)
+
+
+def _stem(edges_path):
+    for suffix in (".gz", ".bz2"):
+        if edges_path.endswith(suffix):
+            edges_path = edges_path[:-len(suffix)]
+    return os.path.splitext(edges_path)[0]
+
+
+def cache_path(edges_path):
+    """
+    :param edges_path: The path of a <name>.edges file, optionally compressed as <name>.edges.gz or .bz2.
+    :return: The directory next to it the converted graph is stored in, <name>.csr. It holds a directory of arrays
+    for the contents of the sources and meta.json, which names the current one.
+    """
+    return _stem(edges_path) + ".csr"
+
+
+def find_nodes_file(edges_path):
+    """
+    :param edges_path: The path of a <name>.edges file.
+    :return: The path of the <name>.nodes file next to it, or None if there is none.
+    """
+    path = _stem(edges_path) + ".nodes"
+    return path if os.path.exists(path) else None
+
+
+def content_hash(paths):
+    """
+    :param paths: The source files.
+    :return: The hex blake2b digest of their contents.
+    """
+    digest = hashlib.blake2b(digest_size=20)
+    for path in paths:
+        digest.update(os.path.basename(path).encode() + b"\0")
+        with open(path, 'rb') as fp:
+            for chunk in iter(lambda: fp.read(1 << 20), b""):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _stats(paths):
+    stats = {}
+    for path in paths:
+        stat = os.stat(path)
+        stats[os.path.basename(path)] = [stat.st_size, stat.st_mtime_ns]
+    return stats
+
+
+def _open(path):
+    if path.endswith(".gz"):
+        return gzip.open(path, 'rb')
+    if path.endswith(".bz2"):
+        return bz2.open(path, 'rb')
+    return open(path, 'rb')
+
+
+def _blocks(fp, block_size):
+    # Blocks end on a line break, the partial last line is carried into the next block.
+    tail = b""
+    while True:
+        data = fp.read(block_size)
+        if not data:
+            break
+        data = tail + data
+        cut = data.rfind(b"\n") + 1
+        tail = data[cut:]
+        if cut:
+            yield data[:cut]
+    if tail:
+        yield tail
+
+
+def _parse_block(block):
+    """
+    Parse the non-negative integers of whole lines of text with array operations, which release the GIL so
+    blocks parse in parallel on threads. Lines starting with # or % are comments.
+    :param block: The bytes of whole lines.
+    :return: The values, the line of each value within the block and if it stands alone between whitespace.
+    """
+    text = np.frombuffer(block, dtype=np.uint8)
+    newline = text == ord("\n")
+    line = np.cumsum(newline) - newline
+    line_starts = np.flatnonzero(np.concatenate(([True], newline[:-1])))
+    comment = np.isin(text[line_starts], (ord("#"), ord("%")))
+    digit = (text >= ord("0")) & (text <= ord("9")) & ~comment[line]
+    # Every run of digits is a number, from its first digit to the first byte after it.
+    bounds = np.flatnonzero(np.diff(digit.view(np.int8), prepend=np.int8(0), append=np.int8(0)))
+    starts, ends = bounds[::2], bounds[1::2]
+    lengths = ends - starts
+    if not len(starts):
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=bool)
+    if lengths.max() >= len(_POWERS):
+        raise ValueError("Node id with more than %d digits" % (len(_POWERS) - 1))
+    positions = np.flatnonzero(digit)
+    place = np.repeat(ends, lengths) - positions - 1
+    values = np.add.reduceat((text[positions] - ord("0")).astype(np.int64) * _POWERS[place],
+                             np.cumsum(lengths) - lengths)
+    # Padded with whitespace so the numbers at the ends of the block have neighbors.
+    space = np.isin(np.concatenate(([32], text, [32])), _WHITESPACE)
+    return values, line[starts], space[starts] & space[ends + 1]
+
+
+def _parse_edges(block):
+    values, lines, separate = _parse_block(block)
+    # The first two numbers of a line are the edge, the rest is edge data.
+    first = np.searchsorted(lines, lines)
+    rank = np.arange(len(lines)) - first
+    per_line = np.bincount(lines)
+    if np.any(per_line == 1) or not separate[rank < 2].all():
+        raise ValueError("Edge list line without two integer node ids")
+    return values[rank < 2].reshape(-1, 2)
+
+
+def read_edges(edges_path, workers=None):
+    """
+    Parse a whitespace separated edge list, compressed if its name ends in .gz or .bz2, in blocks on a thread
+    pool.
+    :param edges_path: The path of the edge list with non-negative integer node ids.
+    :param workers: The number of parsing threads, the executor default if None.
+    :return: An (m, 2) int64 array of the edges in file order.
+    """
+    with _open(edges_path) as fp, ThreadPoolExecutor(max_workers=workers) as executor:
+        edges = list(executor.map(_parse_edges, _blocks(fp, _BLOCK_SIZE)))
+    return np.concatenate(edges) if edges else np.zeros((0, 2), dtype=np.int64)
+
+
+def read_nodes(path):
+    """
+    :param path: A file of whitespace separated node ids.
+    :return: The int64 array of the ids.
+    """
+    with _open(path) as fp:
+        values, _, separate = _parse_block(fp.read())
+    if not separate.all():
+        raise ValueError("Node file with a node id that is not an integer")
+    return values
+
+
+def build_csr(edges, nodes=()):
+    """
+    Build the undirected CSR graph of an edge list directly from the arrays. Self loops and repeated edges in
+    either direction are dropped, though their nodes are kept, and the ids are mapped to the rows 0..n-1 in
+    increasing order.
+    :param edges: An (m, 2) array of node ids.
+    :param nodes: Ids of further, possibly isolated, nodes.
+    :return: The CSRGraph.
+    """
+    node_ids = np.unique(np.concatenate((edges.ravel(), np.asarray(nodes, dtype=np.int64))))
+    edges = edges[edges[:, 0] != edges[:, 1]]
+    n = len(node_ids)
+    rows = np.searchsorted(node_ids, edges)
+    # Both directions of every edge as row * n + column, sorting them orders the columns within each row.
+    keys = np.unique(np.concatenate((rows[:, 0] * n + rows[:, 1], rows[:, 1] * n + rows[:, 0])))
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(keys // n, minlength=n), out=indptr[1:])
+    csr = CSRGraph(indptr, (keys % n).astype(np.int32), node_ids.tolist())
+    csr._node_ids = node_ids
+    return csr
+
+
+def _read_meta(target):
+    meta_file = os.path.join(target, "meta.json")
+    if not os.path.exists(meta_file):
+        return None
+    with open(meta_file, 'r') as meta_fp:
+        return json.load(meta_fp)
+
+
+def _write_meta(target, meta):
+    # Replaced in one rename, so concurrent readers get the old meta or the new one.
+    meta_fd, meta_scratch = tempfile.mkstemp(dir=target, prefix="meta.", suffix=".tmp")
+    try:
+        with os.fdopen(meta_fd, 'w') as meta_fp:
+            json.dump(meta, meta_fp)
+        os.replace(meta_scratch, os.path.join(target, "meta.json"))
+    except BaseException:
+        if os.path.exists(meta_scratch):
+            os.remove(meta_scratch)
+        raise
+
+
+def convert(edges_path, nodes_path=None):
+    """
+    Parse a network once and store its CSR arrays, node ids, degrees and core numbers as .npy files next to the
+    edge list, with the hash of the sources they were built from. The arrays go to a directory named by the format
+    and the hash, written under a scratch name and renamed, and then meta.json is replaced to name it. Both steps
+    are atomic, so concurrent readers see the old cache or the new one, and concurrent conversions of the same
+    contents write the same directory, where losing the rename is fine.
+    :param edges_path: The path of the <name>.edges file.
+    :param nodes_path: A file of further node ids, or None.
+    :return: The cache directory.
+    """
+    sources = [path for path in (edges_path, nodes_path) if path is not None]
+    stats = _stats(sources)
+    digest = content_hash(sources)
+    csr = build_csr(read_edges(edges_path), read_nodes(nodes_path) if nodes_path is not None else ())
+    arrays = {"indptr": csr.indptr, "indices": csr.indices, "nodes": csr.node_ids, "degrees": np.diff(csr.indptr),
+              "core_numbers": seed_selection.core_numbers(csr)}
+    target = cache_path(edges_path)
+    os.makedirs(target, exist_ok=True)
+    current = "v%d-%s" % (FORMAT_VERSION, digest)
+    scratch = tempfile.mkdtemp(dir=target, prefix=current + ".")
+    try:
+        for name in _ARRAYS:
+            np.save(os.path.join(scratch, name + ".npy"), arrays[name])
+        try:
+            os.rename(scratch, os.path.join(target, current))
+        except OSError:
+            if not os.path.isdir(os.path.join(target, current)):
+                raise
+            # Another conversion of the same contents got there first.
+            shutil.rmtree(scratch)
+    except BaseException:
+        shutil.rmtree(scratch, ignore_errors=True)
+        raise
+    _write_meta(target, {"version": FORMAT_VERSION, "hash": digest, "sources": stats, "arrays": current})
+    # Arrays of earlier contents and formats. A reader that still maps them keeps its pages, one that read the old
+    # meta.json just before retries in load_network.
+    for entry in os.listdir(target):
+        path = os.path.join(target, entry)
+        if entry != current and re.fullmatch(r"v\d+-[0-9a-f]+", entry):
+            shutil.rmtree(path, ignore_errors=True)
+        elif entry.endswith(".npy"):
+            os.remove(path)
+    return target
+
+
+def _is_current(target, sources):
+    meta = _read_meta(target)
+    if meta is None:
+        return False
+    stats = _stats(sources)
+    if meta.get("version") != FORMAT_VERSION or sorted(meta["sources"]) != sorted(stats):
+        return False
+    if stats == meta["sources"]:
+        return True
+    # Touched since the conversion, only the contents decide.
+    if content_hash(sources) != meta["hash"]:
+        return False
+    meta["sources"] = stats
+    _write_meta(target, meta)
+    return True
+
+
+def _load_arrays(target):
+    arrays = os.path.join(target, _read_meta(target)["arrays"])
+    return {name: np.load(os.path.join(arrays, name + ".npy"), mmap_mode='r') for name in _ARRAYS}
+
+
+def load_network(edges_path):
+    """
+    Load a network from its binary cache, converting the edge list and the <name>.nodes file next to it, if any,
+    on first use or when the contents of the sources changed. The arrays are memory mapped read only, so loading
+    takes no parse and processes loading the same network share the pages. The node ids stay a mapped array too.
+    :param edges_path: The path of the <name>.edges file, optionally compressed.
+    :return: The CSRGraph, the degree array and the core number array, both in row order.
+    """
+    node_file = find_nodes_file(edges_path)
+    sources = [path for path in (edges_path, node_file) if path is not None]
+    target = cache_path(edges_path)
+    if not _is_current(target, sources):
+        convert(edges_path, node_file)
+    try:
+        arrays = _load_arrays(target)
+    except FileNotFoundError:
+        # Another process converted newer contents and removed these arrays since meta.json was read.
+        arrays = _load_arrays(target)
+    csr = CSRGraph(arrays["indptr"], arrays["indices"], arrays["nodes"])
+    return csr, arrays["degrees"], arrays["core_numbers"]
@@ -0,0 +1,99 @@
+import numpy as np
+
+
+class InfectionTimes(object):
+    """
+    The infections of a run as arrays in CSR row order: the step each node was infected with each contagion at,
+    0 for the seeds and -1 if never, and its infected neighbor count when it was. The rows are also kept sorted by
+    step, so the nodes infected at a step are a slice of that order.
+    """
+
+    def __init__(self, csr, infect_time_1, infect_time_2, affected_count_1, affected_count_2):
+        """
+        :param csr: The CSRGraph of the model that was run.
+        :param infect_time_1: The int32 step of infection with contagion 1 of every row.
+        :param infect_time_2: The int32 step of infection with contagion 2 of every row.
+        :param affected_count_1: The int32 number of neighbors infected with contagion 1 when infected with it.
+        :param affected_count_2: The int32 number of neighbors infected with contagion 2 when infected with it.
+        """
+        self.csr = csr
+        self.infect_time_1 = infect_time_1
+        self.infect_time_2 = infect_time_2
+        self.affected_count_1 = affected_count_1
+        self.affected_count_2 = affected_count_2
+        self._order = {}
+
+    @classmethod
+    def empty(cls, csr, state):
+        """
+        :param csr: The CSRGraph of the model.
+        :param state: The uint8 state array before the run.
+        :return: The InfectionTimes of a run with only the seeds infected.
+        """
+        n = csr.number_of_nodes()
+        times = [np.where(state & contagion, 0, -1).astype(np.int32) for contagion in (1, 2)]
+        return cls(csr, times[0], times[1], np.zeros(n, dtype=np.int32), np.zeros(n, dtype=np.int32))
+
+    @property
+    def steps(self):
+        """
+        :return: The number of steps after the seeds, the length of the lists simulation_run returns.
+        """
+        return max(int(self.infect_time_1.max(initial=0)), int(self.infect_time_2.max(initial=0)), 1)
+
+    def infect_time(self, contagion_index):
+        return self.infect_time_1 if contagion_index == 1 else self.infect_time_2
+
+    def affected_count(self, contagion_index):
+        return self.affected_count_1 if contagion_index == 1 else self.affected_count_2
+
+    def record(self, step, rows_1, rows_2, counts_1, counts_2):
+        """
+        Record the nodes newly infected at a step.
+        :param step: The step.
+        :param rows_1: The rows newly infected with contagion 1.
+        :param rows_2: The rows newly infected with contagion 2.
+        :param counts_1: Their numbers of neighbors infected with contagion 1.
+        :param counts_2: Their numbers of neighbors infected with contagion 2.
+        """
+        self.infect_time_1[rows_1] = step
+        self.infect_time_2[rows_2] = step
+        self.affected_count_1[rows_1] = counts_1
+        self.affected_count_2[rows_2] = counts_2
+        self._order = {}
+
+    def _sorted(self, contagion_index):
+        order = self._order.get(contagion_index)
+        if order is None:
+            infect_time = self.infect_time(contagion_index)
+            rows = np.flatnonzero(infect_time >= 0)
+            rows = rows[np.argsort(infect_time[rows], kind='stable')]
+            starts = np.searchsorted(infect_time[rows], np.arange(self.steps + 2))
+            order = self._order[contagion_index] = (rows, starts)
+        return order
+
+    def rows_at(self, step, contagion_index):
+        """
+        :param step: A step, 0 for the seeds.
+        :param contagion_index: The contagion.
+        :return: The rows infected with the contagion at the step, in row order.
+        """
+        rows, starts = self._sorted(contagion_index)
+        if step >= len(starts) - 1:
+            return rows[:0]
+        return rows[starts[step]:starts[step + 1]]
+
+    def nodes_at(self, step, contagion_index):
+        """
+        :param step: A step, 0 for the seeds.
+        :param contagion_index: The contagion.
+        :return: The array of node ids infected with the contagion at the step.
+        """
+        return self.csr.node_ids[self.rows_at(step, contagion_index)]
+
+    def node_infections(self, contagion_index):
+        """
+        :param contagion_index: The contagion.
+        :return: The newly infected nodes at each step after the seeds as arrays, like the lists of simulation_run.
+        """
+        return [self.nodes_at(step, contagion_index) for step in range(1, self.steps + 1)]
@@ -1,15 +1,52 @@
+import warnings
+
+import networkx as nx
 import numpy as np
 from ndlib.models.DiffusionModel import DiffusionModel
-#from cython.parallel import prange
+
+import bitparallel
+import csr_engine
+import numba_engine
+import partitioned_simulation
+from csr_graph import CSRGraph, GraphView
+from infection_times import InfectionTimes
+
+ENGINES = ("python", "csr", "numba")
+
 
 class MultipleContagionThreshold(DiffusionModel):
 
-    def __init__(self, graph):
+    def __init__(self, graph, engine="python"):
         # Call the super class constructor
-        super(self.__class__, self).__init__(graph)
+        if isinstance(graph, CSRGraph):
+            # Run on the arrays, e.g. a graph attached from shared memory, instead of networkx.
+            super(self.__class__, self).__init__(nx.Graph())
+            self.graph = GraphView(graph)
+            self.status = {n: 0 for n in self.graph.nodes}
+        else:
+            super(self.__class__, self).__init__(graph)
 
         # Method name
         self.name = "Multiple_Contagion_Threshold"
+        # The python engine walks the networkx graph, the csr engine runs on arrays and the numba engine runs a
+        # compiled kernel on the same arrays.
+        if engine not in ENGINES:
+            raise ValueError("Unknown engine " + str(engine))
+        if engine == "numba" and not numba_engine.AVAILABLE:
+            warnings.warn("numba is not installed, using the csr engine")
+            engine = "csr"
+        self.engine = engine
+        self._csr = None
+        self._state = None
+        self._node_count = None
+        # The configured scenario as arrays, read on first use and then updated by reset.
+        self._initial_state = None
+        self._seed_rows = None
+        self._blocked_rows = None
+        # The InfectionTimes of the current run. Per-run data lives in the model, the graph is never written to.
+        self.infection_times = None
+        # The rows a cached run left away from their initial status, set by SimulationCache in place of the times.
+        self.changed_rows = None
 
         # Available node statuses
         self.available_statuses = {
@@ -76,15 +113,115 @@ class MultipleContagionThreshold(DiffusionModel):
                 infected_counts[1] += 1
         return infected_counts
 
-    def iteration(self, node_status=True, first_infected=True):
+    @property
+    def csr(self):
+        """
+        :return: The CSRGraph of the model's graph, built on first use.
+        """
+        if self._csr is None:
+            self._csr = CSRGraph.of(self.graph.graph)
+        return self._csr
+
+    def set_initial_status(self, configuration):
+        super(self.__class__, self).set_initial_status(configuration)
+        # The scenario arrays are read again from the new configuration.
+        self._initial_state = None
+        self.changed_rows = None
+
+    def scenario_arrays(self):
+        """
+        The initial status, thresholds and blocked nodes of the configuration as arrays in CSR row order. They are
+        read from the configuration once and then kept up to date by reset, so they must not be modified.
+        :return: The uint8 initial state, the interaction adjusted thresholds and the blocked masks.
+        """
+        if self._initial_state is None:
+            csr = self.csr
+            self.clean_initial_status(self.available_statuses.values())
+            self._initial_state = csr_engine.status_array(self.initial_status or self.status, csr)
+            self._threshold_1, self._threshold_2, self._blocked_1, self._blocked_2 = csr_engine.node_arrays(self, csr)
+            self._seed_rows = np.flatnonzero(self._initial_state)
+            self._blocked_rows = [np.flatnonzero(self._blocked_1), np.flatnonzero(self._blocked_2)]
+        return self._initial_state, self._threshold_1, self._threshold_2, self._blocked_1, self._blocked_2
+
+    def reset(self, seed_set_1=None, seed_set_2=(), seed_set_3=(), blocked_1=(), blocked_2=()):
+        """
+        Rewind the model to before its first iteration, with new seeds and blocked nodes if given, so a model built
+        once for a graph and threshold runs every scenario. Only the seeds and blocked nodes of the old and the new
+        scenario and the nodes the last run infected are touched, the thresholds are kept.
+        :param seed_set_1: The nodes initially infected with contagion 1, None to rerun the current scenario.
+        :param seed_set_2: The nodes initially infected with contagion 2.
+        :param seed_set_3: The nodes initially infected with both.
+        :param blocked_1: The nodes blocked for contagion 1, only with seeds.
+        :param blocked_2: The nodes blocked for contagion 2, only with seeds.
+        :return: The model.
+        """
+        if seed_set_1 is None and (len(blocked_1) or len(blocked_2)):
+            raise ValueError("Blocked nodes are set together with the seeds")
+        csr = self.csr
+        initial_state = self.scenario_arrays()[0]
+        # The nodes the last run moved from their initial status, all of them if the run left no record of them.
+        if self.infection_times is not None:
+            times = self.infection_times
+            touched = [np.flatnonzero((times.infect_time_1 > 0) | (times.infect_time_2 > 0))]
+        elif self.changed_rows is not None:
+            touched = [self.changed_rows]
+        elif self.actual_iteration:
+            touched = [np.arange(csr.number_of_nodes())]
+        else:
+            touched = []
+        touched.append(self._seed_rows)
+        if self.status is self.initial_status:
+            # Own the status dict, set_initial_status shares it with initial_status.
+            self.status = dict(self.status)
+        if seed_set_1 is not None:
+            initial_state[self._seed_rows] = 0
+            for u in csr.ids_of(self._seed_rows):
+                self.initial_status[u] = 0
+            seed_rows = []
+            for status, seed_set in zip(("Infected", "Infected_2", "Infected_Both"),
+                                        (seed_set_1, seed_set_2, seed_set_3)):
+                initial_state[csr.rows_of(seed_set)] = self.available_statuses[status]
+                for u in seed_set:
+                    self.initial_status[u] = self.available_statuses[status]
+                self.params['status'][status] = list(seed_set)
+                seed_rows.append(csr.rows_of(seed_set))
+            self._seed_rows = np.concatenate(seed_rows)
+            touched.append(self._seed_rows)
+            for contagion, blocked in ((1, blocked_1), (2, blocked_2)):
+                mask = self._blocked_1 if contagion == 1 else self._blocked_2
+                params = self.params['nodes']['blocked_' + str(contagion)]
+                mask[self._blocked_rows[contagion - 1]] = False
+                for u in csr.ids_of(self._blocked_rows[contagion - 1]):
+                    params[u] = False
+                rows = csr.rows_of(blocked)
+                mask[rows] = True
+                for u in blocked:
+                    params[u] = True
+                self._blocked_rows[contagion - 1] = rows
+        touched = np.concatenate(touched)
+        nodes = csr.nodes
+        for row, status in zip(touched.tolist(), initial_state[touched].tolist()):
+            self.status[nodes[row]] = status
+        self.actual_iteration = 0
+        self.infection_times = None
+        self.changed_rows = None
+        return self
+
+    def iteration(self, node_status=True, first_infected=True, delta_only=False, counts=True):
+        if delta_only:
+            return self.delta_iteration(first_infected, counts)
+        if self.engine != "python":
+            return self.csr_iteration(node_status, first_infected)
 
         self.clean_initial_status(self.available_statuses.values())
         actual_status = {node: nstatus for node, nstatus in self.status.items()}
 
         # if first iteration return the initial node status
         if self.actual_iteration == 0:
+            self.infection_times = InfectionTimes.empty(self.csr, csr_engine.status_array(actual_status, self.csr))
             self.actual_iteration += 1
             delta, node_count, status_delta = self.status_delta(actual_status)
+            self._node_count = np.array(list(node_count.values()))
             return_dict = {"iteration": self.actual_iteration - 1, "status": {},
                            "node_count": node_count.copy(), "status_delta": status_delta.copy()}
             if node_status:
@@ -93,9 +230,40 @@ class MultipleContagionThreshold(DiffusionModel):
                 return_dict['first_infected_1'] = set()
                 return_dict['first_infected_2'] = set()
             return return_dict
+        changed, changed_status, first_infected_1, first_infected_2 = self.python_changes(first_infected)
+        for u, u_status in zip(changed, changed_status):
+            actual_status[u] = u_status
+
+        # identify the changes w.r.t. previous iteration
+        delta, node_count, status_delta = self.status_delta(actual_status)
+        self._node_count = np.array(list(node_count.values()))
+        # update the actual status and iterative step
+        self.status = actual_status
+        self.actual_iteration += 1
+        # return the actual configuration (only nodes with status updates)
+        # Returns a boolean to determine if the simulation has reached a fixed point.
+        return_dict = {"iteration": self.actual_iteration - 1, "status": {},
+                       "node_count": node_count.copy(), "status_delta": status_delta.copy()}
+        if node_status:
+            return_dict['status'] = actual_status.copy()
         if first_infected:
-            first_infected_1 = set()
-            first_infected_2 = set()
+            return_dict['first_infected_1'] = set(first_infected_1)
+            return_dict['first_infected_2'] = set(first_infected_2)
+        return return_dict
+
+    def python_changes(self, first_infected=True):
+        """
+        Evaluates every node against self.status without modifying it.
+        The newly infected nodes and their infected neighbor counts are recorded in self.infection_times.
+        :param first_infected: If the newly infected nodes are returned.
+        :return: The nodes that change, their new statuses and the nodes first infected with each contagion.
+        """
+        changed = []
+        changed_status = []
+        first_infected_1 = []
+        first_infected_2 = []
+        affected_1 = []
+        affected_2 = []
         # iteration inner loop
         for u in self.graph.nodes():
             # Evaluates nodes for possible updates
@@ -116,71 +284,264 @@ class MultipleContagionThreshold(DiffusionModel):
                 # Counts the infected status of neighbors and updates appropriately.
                 transition_1 = int(satisfied_1 and self.params['nodes']['blocked_1'][u] == 0)
                 transition_2 = (int(satisfied_2 and self.params['nodes']['blocked_2'][u] == 0) * 2)
-                # if self.params['nodes']['blocked_1'][u] == 0 or self.params['nodes']['blocked_2'][u] == 0:
-                #     print('blocked')
-                if u_status == 0:
-                    # Set status based off sum of transition
-                    actual_status[u] = transition_1 + transition_2
-
-                    if first_infected:
-                        if transition_1:
-                            first_infected_1.add(u)
-                            self.graph.nodes[u]['affected_1'] = cnts[0]
-                        if transition_2:
-                            first_infected_2.add(u)
-                            self.graph.nodes[u]['affected_2'] = cnts[1]
-                elif u_status == 1:
-                    # Counts the infected status of neighbors, updates the threshold based on the interaction, and
-                    # updates node state appropriately.
-                    if transition_2:
-                        actual_status[u] = 3
-                        if first_infected:
-                            first_infected_2.add(u)
-                            self.graph.nodes[u]['affected_2'] = cnts[1]
-                elif u_status == 2:
-                    # Counts the infected status of neighbors, updates the threshold based on the interaction, and
-                    # updates node state appropriately.
-                    if transition_1:
-                        actual_status[u] = 3
-                        if first_infected:
-                            first_infected_1.add(u)
-                            self.graph.nodes[u]['affected_1'] = cnts[0]
+                # A susceptible node takes the sum of the transitions, a node with one contagion moves to 3 when the
+                # other one transitions.
+                new_1 = transition_1 and not u_status & 1
+                new_2 = transition_2 and not u_status & 2
+                if new_1 or new_2:
+                    changed.append(u)
+                    changed_status.append(u_status | transition_1 | transition_2)
+                    if new_1:
+                        first_infected_1.append(u)
+                        affected_1.append(cnts[0])
+                    if new_2:
+                        first_infected_2.append(u)
+                        affected_2.append(cnts[1])
+        if self.infection_times is not None:
+            csr = self.csr
+            self.infection_times.record(self.actual_iteration, csr.rows_of(first_infected_1),
+                                        csr.rows_of(first_infected_2), affected_1, affected_2)
+        if not first_infected:
+            first_infected_1 = first_infected_2 = []
+        return changed, changed_status, first_infected_1, first_infected_2
 
-        # identify the changes w.r.t. previous iteration
-        delta, node_count, status_delta = self.status_delta(actual_status)
-        # update the actual status and iterative step
-        self.status = actual_status
+    def csr_iteration(self, node_status=True, first_infected=True):
+        """
+        The same step as iteration() evaluated with sparse matrix-vector products over the CSR adjacency.
+        The node states live in a uint8 array from the first iteration on; self.status mirrors it.
+        :param node_status: If the full status dict is returned.
+        :param first_infected: If the newly infected nodes are returned.
+        :return: The iteration dict of iteration().
+        """
+        csr = self.csr
+        if self.actual_iteration == 0:
+            self.load_arrays()
+            self.actual_iteration += 1
+            node_count = self._node_count.tolist()
+            return_dict = {"iteration": self.actual_iteration - 1, "status": {},
+                           "node_count": {st: node_count[st] for st in self.available_statuses.values()},
+                           "status_delta": {st: 0 for st in self.available_statuses.values()}}
+            if node_status:
+                return_dict['status'] = dict(self.status)
+            if first_infected:
+                return_dict['first_infected_1'] = set()
+                return_dict['first_infected_2'] = set()
+            return return_dict
+        old_count = np.bincount(self._state, minlength=4)
+        rows_1, rows_2 = self.csr_changes()
+        new_count = np.bincount(self._state, minlength=4)
+        self._node_count = new_count
+        node_count = new_count.tolist()
+        delta = (new_count - old_count).tolist()
+        self.status = dict(zip(csr.nodes, self._state.tolist()))
         self.actual_iteration += 1
-        # return the actual configuration (only nodes with status updates)
-        # Returns a boolean to determine if the simulation has reached a fixed point.
         return_dict = {"iteration": self.actual_iteration - 1, "status": {},
-                       "node_count": node_count.copy(), "status_delta": status_delta.copy()}
+                       "node_count": {st: node_count[st] for st in self.available_statuses.values()},
+                       "status_delta": {st: delta[st] for st in self.available_statuses.values()}}
         if node_status:
-            return_dict['status'] = actual_status.copy()
+            return_dict['status'] = self.status.copy()
         if first_infected:
-            return_dict['first_infected_1'] = first_infected_1
-            return_dict['first_infected_2'] = first_infected_2
+            return_dict['first_infected_1'] = set(csr.ids_of(rows_1))
+            return_dict['first_infected_2'] = set(csr.ids_of(rows_2))
         return return_dict
 
-    def simulation_run(self, first_infected=True):
+    def load_arrays(self):
+        """
+        Starts the state array of the csr engine from the scenario arrays.
+        """
+        csr = self.csr
+        self._state = self.scenario_arrays()[0].copy()
+        # The second buffer of the state, swapped with the first every step.
+        self._next_state = np.empty_like(self._state)
+        self._node_count = np.bincount(self._state, minlength=4)
+        self.infection_times = InfectionTimes.empty(csr, self._state)
+
+    def csr_changes(self):
+        """
+        Advances the state array of the csr or numba engine by one step into the spare buffer and swaps the buffers.
+        The newly infected nodes and their infected neighbor counts are recorded in self.infection_times.
+        :return: The rows newly infected with each contagion.
+        """
+        csr = self.csr
+        if self.engine == "numba":
+            new_1, new_2, counts_1, counts_2 = numba_engine.step(csr, self._state, self._threshold_1, self._threshold_2,
+                                                                 self._blocked_1, self._blocked_2, self._next_state)
+        else:
+            new_1, new_2, counts_1, counts_2 = csr_engine.step(csr.adjacency, self._state, self._threshold_1,
+                                                               self._threshold_2, self._blocked_1, self._blocked_2)
+            csr_engine.apply(self._state, new_1, new_2, out=self._next_state)
+        self._state, self._next_state = self._next_state, self._state
+        rows_1 = np.flatnonzero(new_1)
+        rows_2 = np.flatnonzero(new_2)
+        self.infection_times.record(self.actual_iteration, rows_1, rows_2, counts_1[rows_1], counts_2[rows_2])
+        return rows_1, rows_2
+
+    def delta_iteration(self, first_infected=True, counts=True):
+        """
+        The same step as iteration() reporting only the nodes that changed. self.status is updated in place for the
+        changed nodes and no full status dict is copied, so the cost of reporting scales with the number of changes.
+        :param first_infected: If the newly infected nodes are returned.
+        :param counts: If node_count and status_delta are returned.
+        :return: A dict with the iteration, the changed node ids and their new statuses as arrays and the optional
+        entries of iteration().
+        """
+        if self.actual_iteration == 0:
+            if self.engine != "python":
+                self.load_arrays()
+            else:
+                initial_state = self.scenario_arrays()[0]
+                self._node_count = np.bincount(initial_state, minlength=4)
+                self.infection_times = InfectionTimes.empty(self.csr, initial_state)
+            if self.status is self.initial_status:
+                # Own the status dict from here on, set_initial_status shares it with initial_status.
+                self.status = dict(self.status)
+            changed = np.array([], dtype=np.int64)
+            changed_status = np.array([], dtype=np.uint8)
+            old_status = changed_status
+            first_infected_1 = first_infected_2 = []
+        elif self.engine != "python":
+            csr = self.csr
+            # The spare buffer still holds the state before the step after the swap.
+            rows_1, rows_2 = self.csr_changes()
+            rows = np.union1d(rows_1, rows_2)
+            changed = csr.node_ids[rows]
+            changed_status = self._state[rows]
+            old_status = self._next_state[rows]
+            first_infected_1 = csr.ids_of(rows_1)
+            first_infected_2 = csr.ids_of(rows_2)
+            for u, u_status in zip(changed.tolist(), changed_status.tolist()):
+                self.status[u] = u_status
+        else:
+            changed, changed_status, first_infected_1, first_infected_2 = self.python_changes(first_infected)
+            old_status = np.fromiter((self.status[u] for u in changed), dtype=np.uint8, count=len(changed))
+            for u, u_status in zip(changed, changed_status):
+                self.status[u] = u_status
+            changed = np.array(changed)
+            changed_status = np.array(changed_status, dtype=np.uint8)
+        status_delta = (np.bincount(changed_status, minlength=4) - np.bincount(old_status, minlength=4))
+        self._node_count = self._node_count + status_delta
+        self.actual_iteration += 1
+        return_dict = {"iteration": self.actual_iteration - 1, "changed": changed, "changed_status": changed_status}
+        if counts:
+            node_count = self._node_count.tolist()
+            status_delta = status_delta.tolist()
+            return_dict['node_count'] = {st: node_count[st] for st in self.available_statuses.values()}
+            return_dict['status_delta'] = {st: status_delta[st] for st in self.available_statuses.values()}
+        if first_infected:
+            return_dict['first_infected_1'] = set(first_infected_1)
+            return_dict['first_infected_2'] = set(first_infected_2)
+        return return_dict
+
+    def simulation_run(self, first_infected=True, frontier=False, partitions=None):
         """
         Runs simulation to a fixed point and returns the nodes that move states each time step.
+        :param first_infected: If the newly infected nodes at each time are returned.
+        :param frontier: Only re-evaluate nodes with a neighbor that changed in the last step.
+        :param partitions: Split the graph over this many worker processes, see partitioned_simulation. None runs
+        in this process.
         :return: The newly infected nodes at each time.
         """
+        if partitions is not None:
+            return partitioned_simulation.simulation_run(self, partitions, first_infected)
+        if frontier:
+            return self.frontier_simulation_run(first_infected)
         fixed_point = False
-        results = None
         updated_node_list_1 = []
         updated_node_list_2 = []
-        self.iteration()
-        old_count = None
+        self.delta_iteration(first_infected=False, counts=False)
+        first_step = True
         while not fixed_point:
-            results = self.iteration(node_status=True, first_infected=first_infected)
-            fixed_point = results['node_count'] == old_count
+            results = self.delta_iteration(first_infected=first_infected, counts=False)
+            # The first step is never taken as the fixed point.
+            fixed_point = not first_step and not len(results['changed'])
+            first_step = False
             if first_infected:
                 updated_node_list_1.append(list(results['first_infected_1']))
                 updated_node_list_2.append(list(results['first_infected_2']))
-            old_count = results['node_count']
+        node_count = self._node_count.tolist()
+        results = {"iteration": self.actual_iteration - 1, "status": self.status.copy(),
+                   "node_count": {st: node_count[st] for st in self.available_statuses.values()},
+                   "status_delta": {st: 0 for st in self.available_statuses.values()}}
         if first_infected:
+            results['first_infected_1'] = set()
+            results['first_infected_2'] = set()
             return updated_node_list_1[:-1], updated_node_list_2[:-1], results
         else:
             return results
+
+    def packed_simulation_run(self, seed_sets, blocked_1=None, blocked_2=None):
+        """
+        Runs many seedings of the configured model to their fixed points with 64 replicates packed per machine word.
+        The thresholds, interaction terms and blocked nodes of the configuration apply to every replicate; the
+        initial status of the configuration is not used.
+        :param seed_sets: A list with a (seed_set_1, seed_set_2, seed_set_3) tuple for each replicate.
+        :param blocked_1: A list with the nodes additionally blocked for contagion 1 in each replicate.
+        :param blocked_2: A list with the nodes additionally blocked for contagion 2 in each replicate.
+        :return: The node_count dict of each replicate.
+        """
+        csr = self.csr
+        threshold_1, threshold_2, shared_blocked_1, shared_blocked_2 = csr_engine.node_arrays(self, csr)
+        results = bitparallel.simulate_packed(csr, seed_sets, threshold_1, threshold_2, blocked_1, blocked_2,
+                                              shared_blocked_1, shared_blocked_2)
+        return results['node_count']
+
+    def frontier_simulation_run(self, first_infected=True):
+        """
+        Runs the simulation to a fixed point keeping the infected neighbor counts of every node and updating them
+        along the edges of the nodes that changed. Only the nodes counting a changed node can change in the next
+        step, so the work is proportional to the edges incident to infected nodes. The fixed point is reached
+        when the frontier is empty.
+        :param first_infected: If the newly infected nodes at each time are returned.
+        :return: The same values as simulation_run.
+        """
+        csr = self.csr
+        reverse = csr.reverse
+        initial_state, threshold_1, threshold_2, blocked_1, blocked_2 = self.scenario_arrays()
+        state = initial_state.copy()
+        counts_1 = csr.adjacency @ (state & 1).astype(np.int64)
+        counts_2 = csr.adjacency @ (state >> 1).astype(np.int64)
+        self.infection_times = InfectionTimes.empty(csr, state)
+        updated_node_list_1 = []
+        updated_node_list_2 = []
+        steps = 0
+        # Every node not infected with both is evaluated in the first step.
+        frontier = np.flatnonzero(state != 3)
+        while len(frontier):
+            frontier_state = state[frontier]
+            new_1 = frontier[((frontier_state & 1) == 0) & (counts_1[frontier] >= threshold_1[frontier]) &
+                             ~blocked_1[frontier]]
+            new_2 = frontier[((frontier_state & 2) == 0) & (counts_2[frontier] >= threshold_2[frontier]) &
+                             ~blocked_2[frontier]]
+            if not len(new_1) and not len(new_2):
+                break
+            steps += 1
+            self.infection_times.record(steps, new_1, new_2, counts_1[new_1], counts_2[new_2])
+            if first_infected:
+                updated_node_list_1.append(csr.ids_of(new_1))
+                updated_node_list_2.append(csr.ids_of(new_2))
+            state[new_1] |= 1
+            state[new_2] |= 2
+            # Update the counts of the nodes that see the changed nodes.
+            touched_1 = reverse.gather(new_1)
+            touched_2 = reverse.gather(new_2)
+            np.add.at(counts_1, touched_1, 1)
+            np.add.at(counts_2, touched_2, 1)
+            frontier = np.unique(np.concatenate((touched_1, touched_2)))
+        # Match the iteration bookkeeping of simulation_run, which ends on an iteration without changes after at
+        # least two iterations past the initial one.
+        self.actual_iteration = max(steps, 1) + 2
+        self.status = dict(zip(csr.nodes, state.tolist()))
+        self._state = state
+        node_count = np.bincount(state, minlength=4).tolist()
+        results = {"iteration": self.actual_iteration - 1, "status": self.status.copy(),
+                   "node_count": {st: node_count[st] for st in self.available_statuses.values()},
+                   "status_delta": {st: 0 for st in self.available_statuses.values()}}
+        if first_infected:
+            results['first_infected_1'] = set()
+            results['first_infected_2'] = set()
+            if not updated_node_list_1:
+                updated_node_list_1.append([])
+                updated_node_list_2.append([])
+            return updated_node_list_1, updated_node_list_2, results
+        else:
+            return results
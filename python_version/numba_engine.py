@@ -0,0 +1,53 @@
+import numpy as np
+
+try:
+    from numba import njit, prange
+except ImportError:
+    njit = None
+    prange = range
+
+# If the kernel is compiled. Without numba the model falls back to the csr engine.
+AVAILABLE = njit is not None
+
+
+def _step(indptr, indices, state, threshold_1, threshold_2, blocked_1, blocked_2, out, counts_1, counts_2):
+    # Every node only reads the old state and writes its own slot, so the rows are independent.
+    for u in prange(len(state)):
+        count_1 = 0
+        count_2 = 0
+        for k in range(indptr[u], indptr[u + 1]):
+            v_state = state[indices[k]]
+            count_1 += v_state & 1
+            count_2 += v_state >> 1
+        counts_1[u] = count_1
+        counts_2[u] = count_2
+        new_state = state[u]
+        if new_state & 1 == 0 and count_1 >= threshold_1[u] and not blocked_1[u]:
+            new_state |= 1
+        if new_state & 2 == 0 and count_2 >= threshold_2[u] and not blocked_2[u]:
+            new_state |= 2
+        out[u] = new_state
+
+
+if AVAILABLE:
+    _step = njit(parallel=True, nogil=True, cache=True)(_step)
+
+
+def step(csr, state, threshold_1, threshold_2, blocked_1, blocked_2, out):
+    """
+    Evaluate one synchronous step of the threshold model in a compiled kernel that runs over the nodes on all cores
+    without the GIL. The neighbor counts, thresholds, blocked masks and transitions are those of csr_engine.step.
+    :param csr: The CSRGraph of the model.
+    :param state: The uint8 state array.
+    :param threshold_1: The thresholds for contagion 1.
+    :param threshold_2: The thresholds for contagion 2.
+    :param blocked_1: The mask of nodes blocked for contagion 1.
+    :param blocked_2: The mask of nodes blocked for contagion 2.
+    :param out: The uint8 array the state after the step is written to.
+    :return: The masks of nodes newly infected with each contagion and the infected neighbor counts.
+    """
+    counts_1 = np.empty(len(state), dtype=np.int64)
+    counts_2 = np.empty(len(state), dtype=np.int64)
+    _step(csr.indptr, csr.indices, state, threshold_1, threshold_2, blocked_1, blocked_2, out, counts_1, counts_2)
+    changed = out ^ state
+    return (changed & 1).astype(bool), (changed & 2).astype(bool), counts_1, counts_2
@@ -0,0 +1,195 @@
+import multiprocessing
+from multiprocessing import shared_memory
+from threading import BrokenBarrierError
+
+import numpy as np
+
+import csr_engine
+from infection_times import InfectionTimes
+
+
+def partition(csr, parts):
+    """
+    Split the rows into contiguous ranges with about the same number of edges each, since the work of a step is
+    proportional to the edges of the rows evaluated.
+    :param csr: The CSRGraph.
+    :param parts: The number of ranges.
+    :return: An array of parts + 1 row boundaries.
+    """
+    bounds = np.searchsorted(csr.indptr, np.linspace(0, csr.indptr[-1], parts + 1))
+    bounds[0] = 0
+    bounds[-1] = csr.number_of_nodes()
+    return np.maximum.accumulate(bounds)
+
+
+class _SharedArrays(object):
+    """
+    Named arrays in one shared memory block, picklable as the block name and layout like SharedCSRGraph.
+    """
+
+    def __init__(self, specs):
+        """
+        :param specs: A list of (name, dtype, length, fill value) tuples.
+        """
+        self.layout = []
+        offset = 0
+        for name, dtype, length, _ in specs:
+            self.layout.append((name, np.dtype(dtype).str, length, offset))
+            offset += -(-np.dtype(dtype).itemsize * length // 8) * 8
+        self._shm = shared_memory.SharedMemory(create=True, size=max(offset, 1))
+        self.name = self._shm.name
+        self.arrays = self._views(self._shm)
+        for name, _, _, fill in specs:
+            self.arrays[name][:] = fill
+
+    def __getstate__(self):
+        return {"layout": self.layout, "name": self.name}
+
+    def _views(self, shm):
+        return {name: np.ndarray((length,), dtype=np.dtype(dtype), buffer=shm.buf, offset=offset)
+                for name, dtype, length, offset in self.layout}
+
+    def attach(self):
+        """
+        :return: The mapped block and a dict of its arrays, which must not outlive the block.
+        """
+        shm = shared_memory.SharedMemory(name=self.name)
+        return shm, self._views(shm)
+
+    def unlink(self):
+        self.arrays = None
+        self._shm.close()
+        self._shm.unlink()
+
+
+def _run_partition(graph, block, part, lo, hi, barrier):
+    csr = graph.attach()
+    shm, arrays = block.attach()
+    try:
+        _run_steps(csr, arrays, part, lo, hi, barrier)
+    except BrokenBarrierError:
+        # Another worker failed.
+        pass
+    except BaseException:
+        barrier.abort()
+        raise
+    finally:
+        del arrays
+        try:
+            shm.close()
+        except BufferError:
+            # A traceback still holds views of the block, it is unmapped on exit.
+            pass
+
+
+def _run_steps(csr, arrays, part, lo, hi, barrier):
+    n = csr.number_of_nodes()
+    parts = len(arrays["changes"]) // 2
+    # The columns a step reads, the rows of this partition and their neighbors in other partitions. The rows are
+    # sliced down to these columns once, so every step gathers only their states from the shared buffer instead
+    # of evaluating the whole state.
+    adjacency = csr.adjacency[lo:hi]
+    cols = np.union1d(np.arange(lo, hi), adjacency.indices)
+    adjacency = adjacency[:, cols]
+    start = int(np.searchsorted(cols, lo))
+    threshold_1 = arrays["threshold_1"][lo:hi]
+    threshold_2 = arrays["threshold_2"][lo:hi]
+    blocked_1 = arrays["blocked_1"][lo:hi]
+    blocked_2 = arrays["blocked_2"][lo:hi]
+    step = 0
+    while True:
+        # Double buffered, every step reads the old state of its columns and writes the rows it owns in the new one.
+        state = arrays["state"][(step % 2) * n:(step % 2 + 1) * n][cols]
+        out = arrays["state"][(1 - step % 2) * n:(2 - step % 2) * n]
+        local = state[start:start + hi - lo]
+        counts_1 = adjacency @ (state & 1)
+        counts_2 = adjacency @ (state >> 1)
+        new_1 = ((local & 1) == 0) & (counts_1 >= threshold_1) & ~blocked_1
+        new_2 = ((local & 2) == 0) & (counts_2 >= threshold_2) & ~blocked_2
+        csr_engine.apply(local, new_1, new_2, out=out[lo:hi])
+        rows_1 = np.flatnonzero(new_1)
+        rows_2 = np.flatnonzero(new_2)
+        arrays["infected_step_1"][lo + rows_1] = step
+        arrays["infected_step_2"][lo + rows_2] = step
+        arrays["affected_1"][lo + rows_1] = counts_1[rows_1]
+        arrays["affected_2"][lo + rows_2] = counts_2[rows_2]
+        # The change counts alternate between two slots so a slot is not reset while others still read it.
+        changes = arrays["changes"][(step % 2) * parts:(step % 2 + 1) * parts]
+        changes[part] = len(rows_1) + len(rows_2)
+        barrier.wait()
+        step += 1
+        # Every worker sums the same slot, so all of them stop at the same step. As in simulation_run the first
+        # step is never the fixed point.
+        if step > 1 and not changes.sum():
+            return
+
+
+def simulation_run(model, partitions, first_infected=True):
+    """
+    Runs the model to a fixed point on several processes. The rows are split into contiguous partitions, each
+    worker evaluates the nodes of its partition and writes their states into a shared buffer that the others read
+    the boundary nodes from, and the workers meet at a barrier after every synchronous step. A step without
+    changes in any partition is the fixed point. Since every step only reads the state of the step before, the
+    results equal the sequential simulation_run. Starting the workers takes a while, so this pays off on graphs
+    where a single step is slow.
+    :param model: A configured MultipleContagionThreshold that has not been run.
+    :param partitions: The number of worker processes, at least one.
+    :param first_infected: If the newly infected nodes at each time are returned.
+    :return: The same values as simulation_run.
+    """
+    if partitions < 1:
+        raise ValueError("A partitioned run needs at least one partition")
+    csr = model.csr
+    n = csr.number_of_nodes()
+    initial_state, threshold_1, threshold_2, blocked_1, blocked_2 = model.scenario_arrays()
+    block = _SharedArrays([("state", np.uint8, 2 * n, np.concatenate((initial_state, initial_state))),
+                           ("threshold_1", np.int64, n, threshold_1), ("threshold_2", np.int64, n, threshold_2),
+                           ("blocked_1", bool, n, blocked_1), ("blocked_2", bool, n, blocked_2),
+                           ("infected_step_1", np.int32, n, -1), ("infected_step_2", np.int32, n, -1),
+                           ("affected_1", np.int64, n, 0), ("affected_2", np.int64, n, 0),
+                           ("changes", np.int64, 2 * partitions, 0)])
+    graph = csr.share()
+    try:
+        bounds = partition(csr, partitions)
+        # Forking a process that has run the threaded numba kernel can deadlock, so the workers are spawned.
+        context = multiprocessing.get_context("spawn")
+        barrier = context.Barrier(partitions)
+        workers = [context.Process(target=_run_partition,
+                                           args=(graph, block, part, bounds[part], bounds[part + 1], barrier))
+                   for part in range(partitions)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        if any(worker.exitcode != 0 for worker in workers):
+            raise RuntimeError("A partition worker failed")
+        state = block.arrays["state"][:n].copy()
+        infected_steps = [block.arrays["infected_step_1"].copy(), block.arrays["infected_step_2"].copy()]
+        affected = [block.arrays["affected_1"].copy(), block.arrays["affected_2"].copy()]
+    finally:
+        graph.unlink()
+        block.unlink()
+    # The number of steps with changes, the run ends on one more step without any.
+    steps = max(int(max(infected.max() for infected in infected_steps)) + 1, 1)
+    model.status = dict(zip(csr.nodes, state.tolist()))
+    model.actual_iteration = steps + 2
+    # Worker step 0 is the first step after the seeds.
+    times = [np.where(infected >= 0, infected + 1, np.where(initial_state & contagion, 0, -1)).astype(np.int32)
+             for infected, contagion in zip(infected_steps, (1, 2))]
+    model.infection_times = InfectionTimes(csr, times[0], times[1], affected[0].astype(np.int32),
+                                           affected[1].astype(np.int32))
+    node_count = np.bincount(state, minlength=4).tolist()
+    results = {"iteration": model.actual_iteration - 1, "status": model.status.copy(),
+               "node_count": {st: node_count[st] for st in model.available_statuses.values()},
+               "status_delta": {st: 0 for st in model.available_statuses.values()}}
+    if not first_infected:
+        return results
+    node_infections = []
+    for contagion in (1, 2):
+        rows = np.flatnonzero(infected_steps[contagion - 1] >= 0)
+        rows = rows[np.argsort(infected_steps[contagion - 1][rows], kind='stable')]
+        ends = np.searchsorted(infected_steps[contagion - 1][rows], np.arange(steps), side='right')
+        node_infections.append([csr.ids_of(step) for step in np.split(rows, ends[:-1])])
+    results['first_infected_1'] = set()
+    results['first_infected_2'] = set()
+    return node_infections[0], node_infections[1], results
@@ -1,80 +1,141 @@
 import numpy as np
+import scipy.sparse as sp
+from scipy.optimize import linprog
 
+import csr_engine
 
-def choose_seed_nodes(model, budget, vaccination_costs):
+
+def choose_seed_nodes(model, budget, vaccination_costs, seed_set=()):
     """
     This is a driver functions that takes a threshold model instance assigns nodes to be vaccinated given
     the budget and vaccine costs using the potential-based heuristic.
     :param model: The ndlib diffusion model defined in multiple_contagions.py. The model must already be configured.
     :param budget: The vaccination budget.
     :param vaccination_costs: A list of vaccine costs for each state.
+    :param seed_set: Nodes that may not be vaccinated.
     :return: A dictionary containing the vaccinated nodes, and the contagions that they have been vaccinated against
     """
-    node_updates = simulation_run(model)
+    csr = model.csr
+    initial_state = csr_engine.status_array(model.status, csr)
+    node_infections_1, node_infections_2, _ = model.simulation_run()
+
+    potentials = find_potentials(model, node_updates(csr, initial_state, node_infections_1, node_infections_2))
 
-    potentials = find_potentials(model, node_updates)
+    return choose_blocking(model, potentials, budget, vaccination_costs, seed_set)
 
-    # TODO: Construct a linear program
 
-    # TODO: Call the program
+def choose_blocking(model, potentials, budget, vaccination_costs, seed_set=()):
+    """
+    Select the nodes to vaccinate from the potentials of a run. Vaccinating a node against a contagion is worth the
+    potentials of the states that hold the contagion. The knapsack of these values under the budget is relaxed to a
+    linear program, the variables at one are taken and the budget left over is filled in order of value per cost.
+    The values are divided by the largest one for the solver, and if the relaxation still fails the whole budget is
+    filled in that order.
+    :param model: The model the potentials were found on.
+    :param potentials: The potential array from find_potentials.
+    :param budget: The vaccination budget.
+    :param vaccination_costs: The positive cost of vaccinating a node against contagion 1 and 2.
+    :param seed_set: Nodes that may not be vaccinated.
+    :return: A dictionary from the vaccinated nodes to the list of contagions they are vaccinated against.
+    """
+    csr = model.csr
+    values = np.stack((potentials[:, [1, 3]].sum(axis=(1, 2)), potentials[:, [2, 3]].sum(axis=(1, 2))), axis=1)
+    values[csr.rows_of(seed_set)] = 0
+    # Only nodes that spread anything are worth a variable, variable k is (candidates[k] // 2, candidates[k] % 2).
+    candidates = np.flatnonzero(values.ravel() > 0)
+    if budget <= 0 or not len(candidates):
+        return {}
+    gains = values.ravel()[candidates].astype(np.float64)
+    if not np.isfinite(gains).all():
+        raise ValueError("Potentials that are not finite")
+    costs = np.asarray(vaccination_costs, dtype=np.float64)[candidates % 2]
+    # Potentials span many orders of magnitude, HiGHS rejects or rounds away gains that are not scaled to one.
+    result = linprog(-gains / gains.max(), A_ub=sp.csr_array(costs[None, :]), b_ub=[budget], bounds=(0, 1),
+                     method='highs')
+    chosen = result.x > 1 - 1e-9 if result.status == 0 else np.zeros(len(candidates), dtype=bool)
+    spent = costs[chosen].sum()
+    for k in np.argsort(-gains / costs, kind='stable').tolist():
+        if not chosen[k] and spent + costs[k] <= budget:
+            chosen[k] = True
+            spent += costs[k]
+    blocking = {}
+    for k in np.flatnonzero(chosen).tolist():
+        blocking.setdefault(csr.nodes[candidates[k] // 2], []).append(candidates[k] % 2 + 1)
+    return blocking
 
-    # TODO: Select the return dictionary from the results
 
-    return None
+# _SOURCES[state, next_state, target] is 1 when the potential of a node in state to reach target adds the potential
+# of a neighbor in next_state to reach target, and _ONES[state, target] is 1 when each such neighbor also counts once.
+_SOURCES = np.zeros(shape=(4, 4, 4), dtype=np.float64)
+_ONES = np.zeros(shape=(4, 4), dtype=np.float64)
+for _state, _target, _next_states, _one in [(1, 1, (1, 3), 1), (1, 2, (3,), 0), (1, 3, (1, 3), 1),
+                                            (2, 1, (3,), 0), (2, 2, (2, 3), 1), (2, 3, (2, 3), 1),
+                                            (3, 1, (1, 3), 0), (3, 2, (2, 3), 1), (3, 3, (1, 2, 3), 1)]:
+    _SOURCES[_state, list(_next_states), _target] = 1
+    _ONES[_state, _target] = _one
+# The potentials grow by about the squared step count at every step back, past this they are scaled down.
+_RESCALE = 1e100
 
 
-def simulation_run(model):
+def node_updates(csr, initial_state, node_infections_1, node_infections_2):
     """
-    Runs simulation to a fixed point and returns the nodes that move states each time step.
-    :param model: The ndlib diffusion model defined in multiple_contagions.py. The model must already be configured.
-    :return:
+    Rebuild the state changes of a run from the infections that simulation_run returns.
+    :param csr: The CSRGraph of the model.
+    :param initial_state: The uint8 state array before the run, as from csr_engine.status_array.
+    :param node_infections_1: The nodes newly infected with contagion 1 at each time.
+    :param node_infections_2: The nodes newly infected with contagion 2 at each time.
+    :return: A list with the (rows, states) arrays of the nodes that moved up in state at each time, starting
+    with the seeds.
     """
-    fixed_point = False
-    updated_node_list = []
-    while not fixed_point:
-        results = model.iteration(node_status=True)
-        fixed_point = results['status'] == set()
-        updated_node_list.append(results['status'])
-    return updated_node_list[:-1]
+    state = initial_state.copy()
+    rows = np.flatnonzero(state)
+    updates = [(rows, state[rows])]
+    for infected_1, infected_2 in zip(node_infections_1, node_infections_2):
+        rows_1 = csr.rows_of(infected_1)
+        rows_2 = csr.rows_of(infected_2)
+        state[rows_1] |= 1
+        state[rows_2] |= 2
+        rows = np.union1d(rows_1, rows_2)
+        updates.append((rows, state[rows]))
+    return updates
 
 
 def find_potentials(model, node_updates):
     """
-    Takes simulation results and uses them to along with model's graph to calculate potentials.
+    Takes simulation results and uses them to along with model's graph to calculate potentials. The recursion runs
+    backwards over the time steps; at each step the neighbors updated in the next step are selected by slicing the
+    adjacency matrix, so the whole run costs sparse products over the edges of the updated nodes.
+    A step reads the potentials of the next step as they were before it. The recursion is linear in the potentials
+    and the neighbor counts, so when the potentials of a long run grow too large they are all divided by the same
+    factor, as are the counts of the steps still to come, which keeps every ratio between them.
     :param model: The ndlib diffusion model defined in multiple_contagions.py. The model must already be configured.
-    :param node_updates: The nodes that were updated each time step.
-    :return: The potential array.
+    :param node_updates: The (rows, states) arrays of the nodes that were updated each time step, see node_updates.
+    :return: The float64 potential array, where potentials[row][state][target] is the potential of the node in
+    state, up to a common factor on long runs.
     """
+    adjacency = model.csr.adjacency
     # Initialize the 3d-array of potentials to 0.
-    potentials = np.zeros(shape=(model.graph.number_of_nodes(), 3, 3), dtype=np.float32)
+    potentials = np.zeros(shape=(model.csr.number_of_nodes(), 4, 4), dtype=np.float64)
+    # The weight of one neighbor count, scaled down with the potentials.
+    unit = 1.0
     # Iterate backwards through the sets starting at the nodes that moved up in state before the fixed point.
     # len(node_updates) - 1 is the end of the list, so we start at -1 of that index.
     T = len(node_updates) - 1
-    for i in range(len(node_updates) - 2, 0):
+    for i in range(len(node_updates) - 2, -1, -1):
+        rows, states = node_updates[i]
+        next_rows = node_updates[i + 1][0]
+        if not len(rows) or not len(next_rows):
+            continue
         scaling_factor = (T - i) * (T - i)
-        # Retrieve nodes and states from the update dict
-        for node, state in node_updates[i]:
-            # Update the potential for each state in potentials[node][state]
-            for next_step_node, next_step_state in node_updates[i + 1]:
-                if next_step_node in model.graph.neighbors(node):
-                    if state == 1:
-                        potentials[node][state][1] += scaling_factor * (1 + potentials[next_step_node][1][1] +
-                                                                        potentials[next_step_node][3][1])
-                        potentials[node][state][2] += scaling_factor * potentials[next_step_node][3][2]
-                        potentials[node][state][1] += scaling_factor * (1 + potentials[next_step_node][1][3] +
-                                                                        potentials[next_step_node][3][3])
-                    elif state == 2:
-                        potentials[node][state][1] += scaling_factor * potentials[next_step_node][3][1]
-                        potentials[node][state][2] += scaling_factor * (1 + potentials[next_step_node][2][2] +
-                                                                        potentials[next_step_node][3][2])
-                        potentials[node][state][1] += scaling_factor * (1 + potentials[next_step_node][2][3] +
-                                                                        potentials[next_step_node][3][3])
-                    elif state == 3:
-                        potentials[node][state][1] += scaling_factor * (
-                                potentials[next_step_node][3][1] + potentials[next_step_node][1][1])
-                        potentials[node][state][2] += scaling_factor * (1 + potentials[next_step_node][2][2] +
-                                                                        potentials[next_step_node][3][2])
-                        potentials[node][state][1] += scaling_factor * (
-                                    1 + potentials[next_step_node][1][3] + potentials[next_step_node][2][3] +
-                                    potentials[next_step_node][3][3])
+        # Edges from the nodes of this step to the nodes of the next one.
+        edges = adjacency[rows][:, next_rows]
+        neighbor_count = edges.sum(axis=1)
+        # Sum of the potentials of the neighbors in each state, shape (len(rows), 4, 4).
+        neighbor_potentials = (edges @ potentials[next_rows].reshape(len(next_rows), 16)).reshape(len(rows), 4, 4)
+        update = (_SOURCES[states] * neighbor_potentials).sum(axis=1) + _ONES[states] * (unit * neighbor_count[:, None])
+        potentials[rows, states] += scaling_factor * update
+        largest = potentials[rows, states].max()
+        if largest > _RESCALE:
+            potentials /= largest
+            unit /= largest
     return potentials
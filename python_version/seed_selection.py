@@ -0,0 +1,152 @@
+import numpy as np
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+
+def _peel(indptr, indices, degree, vert, pos, bin_start):
+    # Batagelj and Zaversnik: visit the nodes by increasing current degree, every neighbor of higher degree loses
+    # one and moves to the front of its bin, which keeps vert sorted by degree.
+    for i in range(len(vert)):
+        v = vert[i]
+        for k in range(indptr[v], indptr[v + 1]):
+            u = indices[k]
+            if degree[u] > degree[v]:
+                du = degree[u]
+                pu = pos[u]
+                pw = bin_start[du]
+                w = vert[pw]
+                if u != w:
+                    pos[u] = pw
+                    vert[pu] = w
+                    pos[w] = pu
+                    vert[pw] = u
+                bin_start[du] += 1
+                degree[u] -= 1
+
+
+if njit is not None:
+    _peel = njit(nogil=True, cache=True)(_peel)
+
+
+def core_numbers(csr):
+    """
+    Compute the core number of every node in O(|E|) time, the largest k for which it is in the k-core.
+    :param csr: The undirected CSRGraph.
+    :return: An int32 array of the core numbers in row order.
+    """
+    degree = np.diff(csr.indptr)
+    vert = np.argsort(degree, kind='stable')
+    pos = np.empty_like(vert)
+    pos[vert] = np.arange(len(vert))
+    bin_start = np.searchsorted(degree[vert], np.arange(degree.max(initial=0) + 1))
+    _peel(np.asarray(csr.indptr), np.asarray(csr.indices), degree, vert, pos, bin_start)
+    return degree.astype(np.int32)
+
+
+def k_core(core_numbers, k):
+    """
+    :param core_numbers: The core numbers of a graph.
+    :param k: The order of the core.
+    :return: The sorted rows of the k-core, the same nodes as networkx k_core.
+    """
+    return np.flatnonzero(core_numbers >= k)
+
+
+def choose_random_k_core(rng, core_rows, num_seeds):
+    """
+    Choose seeds uniformly from a core without repeats, like choose_random_k_core of the Julia SeedSelection.
+    :param rng: A numpy Generator.
+    :param core_rows: The rows of the core.
+    :param num_seeds: The number of seeds.
+    :return: The array of seed rows.
+    """
+    return rng.choice(core_rows, num_seeds, replace=False)
+
+
+def _check_component(csr, start, num_seeds):
+    # A breadth first search from start that stops once it has num_seeds nodes, the samplers would never end on a
+    # smaller component.
+    member = np.zeros(csr.number_of_nodes(), dtype=bool)
+    member[start] = True
+    frontier = np.array([start])
+    size = 1
+    while len(frontier) and size < num_seeds:
+        frontier = np.unique(csr.gather(frontier))
+        frontier = frontier[~member[frontier]]
+        member[frontier] = True
+        size += len(frontier)
+    if size < num_seeds:
+        raise ValueError("%d seeds from a component of %d nodes" % (num_seeds, size))
+
+
+def choose_connected(rng, csr, num_seeds, start):
+    """
+    Grow a connected component from a node, each draw expands a random member of it to a random neighbor.
+    :param rng: A numpy Generator.
+    :param csr: The CSRGraph to walk on, the k-core subgraph to stay within it.
+    :param num_seeds: The number of nodes of the component, at most the size of the component of start.
+    :param start: The row of the first node.
+    :return: The array of rows in the order they joined, a ValueError if the component of start is smaller.
+    """
+    indptr, indices = csr.indptr, csr.indices
+    _check_component(csr, start, num_seeds)
+    component = np.empty(num_seeds, dtype=np.int64)
+    member = np.zeros(csr.number_of_nodes(), dtype=bool)
+    component[0] = start
+    member[start] = True
+    size = 1
+    while size < num_seeds:
+        # The uniform draws come in batches, a draw picks the member and another the neighbor.
+        for expand, pick in rng.random((4 * num_seeds, 2)):
+            node = component[int(expand * size)]
+            lo = indptr[node]
+            choice = indices[lo + int(pick * (indptr[node + 1] - lo))]
+            if not member[choice]:
+                member[choice] = True
+                component[size] = choice
+                size += 1
+                if size == num_seeds:
+                    break
+    return component
+
+
+def choose_by_centola(rng, csr, num_seeds):
+    """
+    Choose the neighborhood seeds of Centola like choose_by_centola of the Julia SeedSelection: starting from a
+    random node, all the neighbors of the current node join in order, then a random neighbor becomes the current
+    node, until there are num_seeds.
+    :param rng: A numpy Generator.
+    :param csr: The CSRGraph.
+    :param num_seeds: The number of seeds, at most the size of the component of the start.
+    :return: The array of seed rows, a ValueError if the component of the start is smaller.
+    """
+    seeds = np.empty(num_seeds, dtype=np.int64)
+    member = np.zeros(csr.number_of_nodes(), dtype=bool)
+    node = rng.integers(csr.number_of_nodes())
+    _check_component(csr, node, num_seeds)
+    seeds[0] = node
+    member[node] = True
+    size = 1
+    while size < num_seeds:
+        neighbors = csr.indices[csr.indptr[node]:csr.indptr[node + 1]]
+        new = neighbors[~member[neighbors]][:num_seeds - size]
+        member[new] = True
+        seeds[size:size + len(new)] = new
+        size += len(new)
+        node = neighbors[rng.integers(len(neighbors))]
+    return seeds
+
+
+def split_seeds(rng, csr, rows):
+    """
+    Assign every seed uniformly to contagion 1, contagion 2 or both.
+    :param rng: A numpy Generator.
+    :param csr: The CSRGraph of the rows.
+    :param rows: The array of seed rows.
+    :return: The node id lists of the seeds of contagion 1, of contagion 2 and of both.
+    """
+    rolls = rng.integers(1, 4, len(rows))
+    return tuple(csr.ids_of(rows[rolls == roll]) for roll in (1, 2, 3))
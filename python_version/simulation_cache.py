@@ -0,0 +1,117 @@
+import hashlib
+from collections import OrderedDict
+
+import numpy as np
+
+import csr_engine
+from infection_times import InfectionTimes
+
+
+class SimulationCache(object):
+    """
+    A least recently used cache of simulation_run results. The key is the fingerprint of the graph together with
+    the interaction adjusted thresholds, the blocked masks and the initial statuses of the configured model, so two
+    models built by utils.config_model with the same arguments share an entry. Entries are stored as arrays and
+    evicted oldest first once their total size passes the memory cap.
+    """
+
+    def __init__(self, max_bytes=1 << 28):
+        """
+        :param max_bytes: The memory cap of the stored results in bytes.
+        """
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def key(model, first_infected=True):
+        """
+        :param model: A configured MultipleContagionThreshold that has not been run.
+        :param first_infected: If the run records the newly infected nodes.
+        :return: The digest identifying the run.
+        """
+        initial_state, threshold_1, threshold_2, blocked_1, blocked_2 = model.scenario_arrays()
+        digest = hashlib.blake2b(model.csr.fingerprint.encode(), digest_size=20)
+        for array in (threshold_1, threshold_2, blocked_1, blocked_2):
+            digest.update(np.ascontiguousarray(array).tobytes())
+        digest.update(initial_state.tobytes())
+        digest.update(bytes([first_infected]))
+        return digest.hexdigest()
+
+    def simulation_run(self, model, first_infected=True):
+        """
+        Return the results of model.simulation_run(first_infected), running it only on a miss. On a hit the model is
+        left at its final status with its infection_times, as the run would have done.
+        :param model: A configured MultipleContagionThreshold that has not been run.
+        :param first_infected: If the newly infected nodes at each time are returned.
+        :return: What model.simulation_run(first_infected) returns.
+        """
+        key = self.key(model, first_infected)
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            output = model.simulation_run(first_infected=first_infected)
+            self._store(key, model, output, first_infected)
+            return output
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return self._restore(model, entry, first_infected)
+
+    def _store(self, key, model, output, first_infected):
+        csr = model.csr
+        results = output[2] if first_infected else output
+        entry = {"iteration": results['iteration'], "node_count": dict(results['node_count']),
+                 "status": csr_engine.status_array(results['status'], csr)}
+        # The rows the run moved, a hit only writes these into the status of the model.
+        entry["changed"] = np.flatnonzero(entry["status"] != model.scenario_arrays()[0])
+        arrays = [entry["status"], entry["changed"]]
+        if first_infected:
+            times = model.infection_times
+            entry["infection_times"] = [times.infect_time_1.copy(), times.infect_time_2.copy(),
+                                        times.affected_count_1.copy(), times.affected_count_2.copy()]
+            arrays += entry["infection_times"]
+            for contagion in (1, 2):
+                steps = [np.array(step, dtype=csr.node_ids.dtype) for step in output[contagion - 1]]
+                entry["node_infections_" + str(contagion)] = steps
+                arrays += steps
+        entry["nbytes"] = sum(array.nbytes for array in arrays)
+        if entry["nbytes"] > self.max_bytes:
+            return
+        self._entries[key] = entry
+        self.nbytes += entry["nbytes"]
+        while self.nbytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.nbytes -= evicted["nbytes"]
+
+    def _restore(self, model, entry, first_infected):
+        csr = model.csr
+        if model.status is model.initial_status:
+            # Own the status dict, set_initial_status shares it with initial_status.
+            model.status = dict(model.status)
+        # The model has not run, so only the rows the run changed differ from its status.
+        changed = entry["changed"]
+        nodes = csr.nodes
+        for row, status in zip(changed.tolist(), entry["status"][changed].tolist()):
+            model.status[nodes[row]] = status
+        model.actual_iteration = entry["iteration"] + 1
+        model.infection_times = None
+        model.changed_rows = None
+        if "infection_times" in entry:
+            model.infection_times = InfectionTimes(csr, *[array.copy() for array in entry["infection_times"]])
+        else:
+            # reset rewinds these rows instead of every node.
+            model.changed_rows = changed
+        results = {"iteration": entry["iteration"], "status": model.status.copy(),
+                   "node_count": dict(entry["node_count"]),
+                   "status_delta": {st: 0 for st in model.available_statuses.values()}}
+        if not first_infected:
+            return results
+        results['first_infected_1'] = set()
+        results['first_infected_2'] = set()
+        return ([step.tolist() for step in entry["node_infections_1"]],
+                [step.tolist() for step in entry["node_infections_2"]], results)
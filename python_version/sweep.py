@@ -0,0 +1,47 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from csr_graph import SharedCSRGraph
+
+# The graph of the sweep, set once in every worker process by the pool initializer.
+_graph = None
+
+
+def _init_worker(graph):
+    global _graph
+    # A shared graph is mapped, not copied, so workers add no memory for it.
+    _graph = graph.attach() if isinstance(graph, SharedCSRGraph) else graph
+
+
+def _run_cell(cell_function, cell):
+    return cell_function(_graph, *cell)
+
+
+def run_sweep(graph, cell_function, cells, max_workers=None, chunksize=None):
+    """
+    Runs independent cells of an experiment grid on a process pool. The graph is handed to every worker once by
+    the pool initializer instead of being pickled with each task, and the results are yielded in the order of cells
+    no matter which worker finished first, each as soon as it and the cells before it are done.
+    :param graph: The graph shared by all cells, or a SharedCSRGraph that every worker attaches to.
+    :param cell_function: A module level function called as cell_function(graph, *cell).
+    :param cells: A list of argument tuples, one for each cell.
+    :param max_workers: The number of worker processes, all CPUs if None. One runs the cells in this process.
+    :param chunksize: The number of cells sent to a worker at a time, about four chunks per worker if None.
+    :return: A generator of the results of the cells.
+    """
+    if max_workers is None:
+        max_workers = os.cpu_count()
+    if max_workers == 1:
+        if isinstance(graph, SharedCSRGraph):
+            graph = graph.attach()
+        for cell in cells:
+            yield cell_function(graph, *cell)
+        return
+    if chunksize is None:
+        chunksize = max(1, len(cells) // (4 * max_workers))
+    # Workers are spawned, a fork would copy the locks of threads the caller or numba started and can hang.
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('spawn'),
+                             initializer=_init_worker, initargs=(graph,)) as executor:
+        yield from executor.map(partial(_run_cell, cell_function), cells, chunksize=chunksize)
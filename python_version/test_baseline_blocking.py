@@ -0,0 +1,28 @@
+import unittest
+
+import networkx as nx
+import numpy as np
+
+import baseline_blocking
+from csr_graph import CSRGraph
+
+
+class BaselineBlocking(unittest.TestCase):
+    G = nx.barabasi_albert_graph(300, 2, seed=5)
+    seed_set = {0, 1, 2, 50}
+
+    def test_degree_ranking(self):
+        ranked = [u for u, _ in sorted(self.G.degree(), key=lambda x: x[1], reverse=True) if u not in self.seed_set]
+        for graph in [self.G, CSRGraph.from_networkx(self.G)]:
+            choices_1, choices_2 = baseline_blocking.choose_nodes_by_degree(graph, 10, 4, self.seed_set)
+            assert choices_1 == ranked[:10] and choices_2 == ranked[:4]
+
+    def test_random(self):
+        choices = baseline_blocking.choose_randomly(np.random.default_rng(2), self.G, 100, 296, self.seed_set)
+        for blocked, budget in zip(choices, (100, 296)):
+            assert len(set(blocked)) == budget and not set(blocked) & self.seed_set
+        assert choices == baseline_blocking.choose_randomly(np.random.default_rng(2), self.G, 100, 296, self.seed_set)
+
+
+if __name__ == '__main__':
+    unittest.main()
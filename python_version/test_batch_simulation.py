@@ -0,0 +1,34 @@
+import unittest
+
+import networkx as nx
+import numpy as np
+
+import batch_simulation
+import utils
+from csr_graph import CSRGraph
+
+
+class BatchSimulation(unittest.TestCase):
+    G = nx.barabasi_albert_graph(300, 3, seed=5)
+    seed_sets = [([0, 1, 2], [3, 4], [5]), ([10, 11], [12, 13], [14, 15]), ([0, 1, 2], [3, 4], [5])]
+    blocked_1 = [[], [20, 21], list(range(6, 40))]
+    blocked_2 = [[30], [], list(range(6, 40))]
+    thresholds = [1, 2, 1]
+
+    def test_matches_simulation_run(self):
+        csr = CSRGraph.of(self.G)
+        batch = batch_simulation.simulate_batch(csr, batch_simulation.state_matrix(csr, self.seed_sets), self.thresholds,
+                                                batch_simulation.mask_matrix(csr, self.blocked_1),
+                                                batch_simulation.mask_matrix(csr, self.blocked_2))
+        for r in range(len(self.seed_sets)):
+            model = utils.config_model(self.G, self.thresholds[r], *self.seed_sets[r], self.blocked_1[r],
+                                       self.blocked_2[r])
+            infections_1, infections_2, results = model.simulation_run()
+            assert batch['node_count'][r] == results['node_count']
+            for i in range(batch['steps'][r]):
+                assert set(infections_1[i]) == set(np.flatnonzero(batch['infect_time_1'][:, r] == i + 1))
+                assert set(infections_2[i]) == set(np.flatnonzero(batch['infect_time_2'][:, r] == i + 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
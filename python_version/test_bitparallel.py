@@ -0,0 +1,26 @@
+import unittest
+
+import networkx as nx
+import numpy as np
+
+import utils
+
+
+class PackedSimulation(unittest.TestCase):
+    G = nx.barabasi_albert_graph(300, 3, seed=5)
+
+    def test_matches_simulation_run(self):
+        rng = np.random.RandomState(3)
+        seed_sets = []
+        for _ in range(70):
+            component = rng.choice(300, 12, replace=False).tolist()
+            seed_sets.append((component[:4], component[4:8], component[8:]))
+        model = utils.config_model(self.G, 2, [], [], [], blocked_1=[7, 8, 9])
+        counts = model.packed_simulation_run(seed_sets)
+        for r in [0, 63, 64, 69]:
+            model = utils.config_model(self.G, 2, *seed_sets[r], blocked_1=[7, 8, 9])
+            assert counts[r] == model.simulation_run(first_infected=False)['node_count']
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,11 +1,17 @@
+import itertools
+import time
 import unittest
+from concurrent.futures import ThreadPoolExecutor
 
 import ndlib.models.ModelConfig as mc
 import networkx as nx
 import numpy as np
+import scipy.sparse as sp
 
 import coverage_heuristic as cbh
 import multiple_contagion
+import utils
+from infection_times import InfectionTimes
 
 
 class TestMulticover(unittest.TestCase):
@@ -46,14 +52,33 @@ class TestMulticover(unittest.TestCase):
         assert coverage == [{1, 2}, {2, 3}, {3, 1}]
 
 
+class TestSparseMulticover(unittest.TestCase):
+
+    def test_sparse_matches_greedy_smc(self):
+        rng = np.random.RandomState(1)
+        for _ in range(200):
+            elements = rng.choice(30, 20, replace=False)
+            subsets = [set(rng.choice(elements, rng.randint(0, 8), replace=False).tolist()) for _ in range(20)]
+            requirement = {element: rng.randint(1, 4) for element in elements.tolist()}
+            budget = rng.randint(1, 25)
+            _, chosen, unsatisfied = cbh.greedy_smc(budget, subsets, set(requirement), dict(requirement))
+            columns = {element: j for j, element in enumerate(requirement)}
+            incidence = sp.csr_array(([1] * sum(len(subset) for subset in subsets),
+                                      ([i for i, subset in enumerate(subsets) for _ in subset],
+                                       [columns[element] for subset in subsets for element in subset])),
+                                     shape=(len(subsets), len(requirement)))
+            picks, unsatisfied_mask = cbh.sparse_greedy_smc(budget, incidence,
+                                                            np.array(list(requirement.values())))
+            assert set(picks) == chosen
+            assert {element for element, j in columns.items() if unsatisfied_mask[j]} == unsatisfied
+
+
 class TestTryAll(unittest.TestCase):
     node_infections = [[1, 2, 3, 4], [5, 6, 7]]
     G = nx.DiGraph()
     G.add_nodes_from([i for i in range(1, 14)])
     G.add_edges_from([(i, j) for i in {1, 2, 3, 4} for j in {5, 6, 7}])
     G.add_edges_from([(5, 12), (5, 10), (5, 13)])
-    for node in [i for i in range(1, 14)]:
-        G.nodes[node]['affected_1'] = 3
     model = multiple_contagion.MultipleContagionThreshold(G)
     config = mc.Configuration()
     config.add_node_set_configuration('threshold_1', {u: 2 for u in G.nodes})
@@ -64,6 +89,9 @@ class TestTryAll(unittest.TestCase):
     config.add_node_set_configuration('blocked_1', {u: False for u in G.nodes})
     config.add_node_set_configuration('blocked_2', {u: False for u in G.nodes})
     model.set_initial_status(config)
+    model.infection_times = InfectionTimes.empty(model.csr, np.zeros(len(G), dtype=np.uint8))
+    # Every node had 3 infected neighbors when infected.
+    model.infection_times.affected_count_1[:] = 3
     threshold_index = 1
 
     def test_try_all_1(self):
@@ -80,6 +108,91 @@ class TestTryAll(unittest.TestCase):
         solution = cbh.try_all_sets(self.node_infections, 1, self.model, seed_set=set(), contagion_index=1)
         assert list(solution) == [1]
 
+    def test_try_all_sweep(self):
+        node_infections = [[1, 2, 3, 4, 10, 11, 12, 13], [5, 6, 7]]
+        budgets = [0, 1, 2, 4, 8]
+        solutions = cbh.try_all_sets_sweep(node_infections, budgets, self.model, set(), contagion_index=1)
+        for budget, (solution, unsatisfied) in zip(budgets, solutions):
+            expected = cbh.try_all_sets(node_infections, budget, self.model, set(), contagion_index=1)
+            assert list(solution) == list(expected)
+        assert [unsatisfied for _, unsatisfied in solutions] == [3, 3, 0, 0, 0]
+
+    def test_try_all_parallel(self):
+        node_infections = [[1, 2, 3, 4, 10, 11, 12, 13], [5, 6, 7], [10, 11, 12], [1, 2, 3], [4, 5, 6], [7, 8, 9]]
+        calls = []
+
+        def coverage_function(available_to_block, next_infected, budget, model, contagion_index):
+            calls.append(len(available_to_block))
+            if len(available_to_block) == 8:
+                return [1, 2], 0
+            time.sleep(.2)
+            return [], 1
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            solution = cbh.try_all_sets(node_infections, 2, self.model, set(), coverage_function, 1, executor)
+            assert solution == [1, 2]
+            # At most the step after the first one starts before the rest are cancelled.
+            assert len(calls) <= 2
+            for budget in [0, 1, 2, 4]:
+                expected = cbh.try_all_sets(node_infections, budget, self.model, set(), contagion_index=1)
+                solution = cbh.try_all_sets(node_infections, budget, self.model, set(), contagion_index=1,
+                                            executor=executor)
+                assert list(solution) == list(expected)
+
+    def test_try_all_sweep_parallel(self):
+        node_infections = [list(range(10, 19)), list(range(20, 28)), list(range(30, 37)), list(range(40, 46)),
+                           list(range(50, 55)), list(range(60, 64)), [1]]
+        calls = []
+
+        def coverage_sweep(available_to_block, next_infected, budgets, model, contagion_index):
+            calls.append(len(available_to_block))
+            # The first step is slow and leaves nodes uncovered, the second covers every budget at once.
+            if len(available_to_block) == 9:
+                time.sleep(.5)
+                return [([], 1) for _ in budgets]
+            if len(available_to_block) == 8:
+                return [([20], 0) for _ in budgets]
+            time.sleep(.2)
+            return [([], 1) for _ in budgets]
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            solutions = cbh.try_all_sets_sweep(node_infections, [1, 2], self.model, set(), coverage_sweep, 1,
+                                               executor)
+        assert solutions == [([20], 0), ([20], 0)]
+        # The later steps are cancelled once the second is done, not when the first one returns.
+        assert len(calls) <= 3
+
+
+class ILPFormulation(unittest.TestCase):
+    G = nx.barabasi_albert_graph(300, 3, seed=1)
+
+    def test_optimal_cover(self):
+        model = utils.config_model(self.G, 2, [0, 1, 2, 3, 4], [], [])
+        node_infections_1, _, _ = model.simulation_run()
+        available_to_block = np.setdiff1d(node_infections_1[0], [0, 1, 2, 3, 4])
+        incidence, requirement, _ = cbh.cover_matrix(available_to_block, node_infections_1[1], model, 1)
+        for budget in [1, 2, 3]:
+            # Enumerate every blocking of the budget for the least number of unsatisfied nodes.
+            fewest = incidence.shape[1]
+            for blocking in itertools.combinations(range(len(available_to_block)), budget):
+                x = np.zeros(len(available_to_block))
+                x[list(blocking)] = 1
+                fewest = min(fewest, int(np.sum(incidence.T @ x < requirement)))
+            solution, unsatisfied = cbh.ilp_formulation(available_to_block, node_infections_1[1], budget, model, 1)
+            assert unsatisfied == fewest and len(solution) <= budget
+            assert unsatisfied <= cbh.multi_cover_formulation(available_to_block, node_infections_1[1], budget, model,
+                                                              1)[1]
+
+    def test_sweep_matches_single_budgets(self):
+        model = utils.config_model(self.G, 2, [0, 1, 2, 3, 4], [], [])
+        node_infections_1, _, _ = model.simulation_run()
+        available_to_block = np.setdiff1d(node_infections_1[0], [0, 1, 2, 3, 4])
+        budgets = [3, 0, 1, 5, 2]
+        sweep = cbh.ilp_sweep(available_to_block, node_infections_1[1], budgets, model, 1)
+        for budget, (solution, unsatisfied) in zip(budgets, sweep):
+            assert unsatisfied == cbh.ilp_formulation(available_to_block, node_infections_1[1], budget, model, 1)[1]
+            assert len(solution) <= budget
+
 
 class SimulationRun(unittest.TestCase):
     G = nx.Graph()
@@ -0,0 +1,50 @@
+import pickle
+import unittest
+
+import networkx as nx
+
+import coverage_heuristic as cbh
+import utils
+from csr_graph import CSRGraph
+
+
+class SharedGraph(unittest.TestCase):
+    G = nx.barabasi_albert_graph(300, 3, seed=9)
+
+    def setUp(self):
+        self.shared = CSRGraph.of(self.G).share()
+
+    def tearDown(self):
+        self.shared.unlink()
+
+    def test_attached_graph_matches_networkx(self):
+        attached = pickle.loads(pickle.dumps(self.shared)).attach()
+        assert attached.nodes == list(self.G.nodes)
+        results = []
+        for graph in [self.G, attached]:
+            model = utils.config_model(graph, 2, [0, 1, 2], [3, 4, 5], [6])
+            node_infections_1, node_infections_2, run = model.simulation_run()
+            choices = cbh.try_all_sets(node_infections_1, 6, model, {0, 1, 2, 6}, cbh.multi_cover_formulation, 1)
+            results.append((node_infections_1, node_infections_2, run['node_count'], choices))
+        assert results[0] == results[1]
+
+    def test_attached_ids_without_node_objects(self):
+        # Unsorted ids, so the attached graph searches them through the shared order.
+        G = nx.relabel_nodes(self.G, {u: (u * 7919) % 1009 for u in self.G})
+        shared = CSRGraph.of(G).share()
+        try:
+            attached = pickle.loads(pickle.dumps(shared)).attach()
+            nodes = list(G.nodes)
+            rows = attached.rows_of(nodes[::-1])
+            assert rows.tolist() == list(range(len(nodes)))[::-1]
+            assert attached.ids_of(rows) == nodes[::-1]
+            with self.assertRaises(KeyError):
+                attached.rows_of([nodes[0], 1009])
+            assert attached._nodes is None and attached._index is None
+            del attached
+        finally:
+            shared.unlink()
+
+
+if __name__ == '__main__':
+    unittest.main()
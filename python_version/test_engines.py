@@ -0,0 +1,181 @@
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+import ndlib.models.ModelConfig as mc
+import networkx as nx
+import numpy as np
+
+import coverage_heuristic as cbh
+import multiple_contagion
+import utils
+from simulation_cache import SimulationCache
+
+
+class CSREngine(unittest.TestCase):
+    G = nx.barabasi_albert_graph(300, 3, seed=7)
+
+    def configure(self, engine):
+        rng = np.random.RandomState(11)
+        model = multiple_contagion.MultipleContagionThreshold(self.G, engine=engine)
+        config = mc.Configuration()
+        config.add_node_set_configuration('threshold_1', {u: int(rng.randint(1, 4)) for u in self.G.nodes})
+        config.add_node_set_configuration('threshold_2', {u: int(rng.randint(1, 4)) for u in self.G.nodes})
+        config.add_node_set_configuration('blocked_1', {u: bool(rng.rand() < .1) for u in self.G.nodes})
+        config.add_node_set_configuration('blocked_2', {u: bool(rng.rand() < .1) for u in self.G.nodes})
+        config.add_model_initial_configuration('Infected', list(range(0, 10)))
+        config.add_model_initial_configuration('Infected_2', list(range(10, 20)))
+        config.add_model_initial_configuration('Infected_Both', list(range(20, 25)))
+        config.add_model_parameter('interaction_1', .5)
+        config.add_model_parameter('interaction_2', -.5)
+        model.set_initial_status(config)
+        return model
+
+    def test_matches_python_engine(self):
+        python_model = self.configure("python")
+        csr_model = self.configure("csr")
+        numba_model = self.configure("numba")
+        for _ in range(10):
+            python_results = python_model.iteration()
+            assert python_results == csr_model.iteration()
+            assert python_results == numba_model.iteration()
+
+    def test_delta_iteration_matches_iteration(self):
+        for engine in ["python", "csr", "numba"]:
+            full_model = self.configure(engine)
+            delta_model = self.configure(engine)
+            for _ in range(10):
+                previous = dict(full_model.status)
+                full = full_model.iteration()
+                delta = delta_model.iteration(delta_only=True)
+                assert full['node_count'] == delta['node_count']
+                assert full['status_delta'] == delta['status_delta']
+                assert full['first_infected_1'] == delta['first_infected_1']
+                assert {u: full_model.status[u] for u in full_model.status if full_model.status[u] != previous[u]} == \
+                    dict(zip(delta['changed'].tolist(), delta['changed_status'].tolist()))
+
+    def test_frontier_matches_simulation_run(self):
+        infections_1, infections_2, results = self.configure("python").simulation_run()
+        frontier_1, frontier_2, frontier_results = self.configure("python").simulation_run(frontier=True)
+        assert [set(step) for step in infections_1] == [set(step) for step in frontier_1]
+        assert [set(step) for step in infections_2] == [set(step) for step in frontier_2]
+        assert results == frontier_results
+
+    def test_infection_times(self):
+        model = self.configure("python")
+        infections_1, infections_2, _ = model.simulation_run()
+        times = model.infection_times
+        assert times.infect_time_1.dtype == np.int32 and times.affected_count_1.dtype == np.int32
+        assert times.steps == len(infections_1)
+        for contagion, infections in [(1, infections_1), (2, infections_2)]:
+            assert [set(step.tolist()) for step in times.node_infections(contagion)] == [set(step) for step in infections]
+            # A node infected at a step counts the neighbors infected before it.
+            infect_time = times.infect_time(contagion)
+            for step, infected in enumerate(infections, 1):
+                for u in infected:
+                    assert times.affected_count(contagion)[times.csr.index[u]] == \
+                        sum(0 <= infect_time[times.csr.index[v]] < step for v in self.G.neighbors(u))
+        assert set(times.nodes_at(0, 1).tolist()) == set(range(0, 10)).union(range(20, 25))
+        for engine, options in [("csr", {}), ("numba", {}), ("python", {"frontier": True}), ("csr", {"partitions": 2})]:
+            other = self.configure(engine)
+            other.simulation_run(**options)
+            for contagion in (1, 2):
+                assert np.array_equal(times.infect_time(contagion), other.infection_times.infect_time(contagion))
+                assert np.array_equal(times.affected_count(contagion), other.infection_times.affected_count(contagion))
+
+    def test_try_all_sets_on_infection_times(self):
+        model = self.configure("csr")
+        infections_1, infections_2, _ = model.simulation_run()
+        for contagion, infections in [(1, infections_1), (2, infections_2)]:
+            budgets = [0, 2, 5, 20]
+            from_times = cbh.try_all_sets_sweep(model.infection_times, budgets, model, set(range(25)),
+                                                contagion_index=contagion)
+            from_lists = cbh.try_all_sets_sweep(infections, budgets, model, set(range(25)), contagion_index=contagion)
+            assert [(list(solution), unsatisfied) for solution, unsatisfied in from_times] == \
+                [(list(solution), unsatisfied) for solution, unsatisfied in from_lists]
+
+    def test_partitioned_matches_simulation_run(self):
+        infections_1, infections_2, results = self.configure("python").simulation_run()
+        for partitions in [1, 3]:
+            partitioned_1, partitioned_2, partitioned_results = self.configure("csr").simulation_run(
+                partitions=partitions)
+            assert [set(step) for step in infections_1] == [set(step) for step in partitioned_1]
+            assert [set(step) for step in infections_2] == [set(step) for step in partitioned_2]
+            assert results == partitioned_results
+
+
+class ConcurrentRuns(unittest.TestCase):
+    G = nx.barabasi_albert_graph(300, 3, seed=6)
+    seed_sets = [([0, 1, 2], [3, 4, 5], [6]), ([10, 11], [12, 13], [14]), ([20, 21, 22], [], [23, 24])]
+
+    def block(self, seed_sets):
+        model = utils.config_model(self.G, 2, *seed_sets)
+        node_infections_1, node_infections_2, results = model.simulation_run()
+        seed_set = set(seed_sets[0] + seed_sets[2])
+        return results['node_count'], cbh.try_all_sets(model.infection_times, 5, model, seed_set, contagion_index=1)
+
+    def test_threads_share_one_graph(self):
+        expected = [self.block(seed_sets) for seed_sets in self.seed_sets]
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            for _ in range(3):
+                results = list(executor.map(self.block, self.seed_sets))
+                assert [(count, list(choices)) for count, choices in results] == \
+                    [(count, list(choices)) for count, choices in expected]
+        # The runs leave the graph as they found it.
+        assert all(not self.G.nodes[u] for u in self.G.nodes)
+
+
+class ModelReset(unittest.TestCase):
+    G = nx.barabasi_albert_graph(400, 3, seed=1)
+
+    def test_matches_config_model(self):
+        rng = np.random.default_rng(0)
+        for engine in ["python", "csr", "numba"]:
+            model = utils.build_model(self.G, 2)
+            model.engine = engine
+            cache = SimulationCache()
+            for trial in range(8):
+                nodes = rng.choice(400, 40, replace=False).tolist()
+                scenario = (nodes[:5], nodes[5:9], nodes[9:11], nodes[11:11 + trial], nodes[20:20 + trial // 2])
+                fresh = utils.config_model(self.G, 2, *scenario)
+                fresh.engine = engine
+                expected = fresh.simulation_run()
+                model.reset(*scenario)
+                results = model.simulation_run() if trial % 2 else cache.simulation_run(model)
+                assert results[:2] == expected[:2]
+                assert results[2]['node_count'] == expected[2]['node_count']
+                assert results[2]['status'] == expected[2]['status']
+            # Without arguments the last scenario runs again.
+            assert model.reset().simulation_run()[2]['node_count'] == expected[2]['node_count']
+
+    def test_blocked_need_seeds(self):
+        model = utils.build_model(self.G, 2).reset([0, 1], [2], [], [20])
+        with self.assertRaises(ValueError):
+            model.reset(None, blocked_1=[21])
+        assert model.scenario_arrays()[3].nonzero()[0].tolist() == [20] and model.params['nodes']['blocked_1'][20]
+
+    def test_reset_after_cached_run(self):
+        class CountingDict(dict):
+            writes = 0
+
+            def __setitem__(self, key, value):
+                self.writes += 1
+                super().__setitem__(key, value)
+
+        scenario = ([0, 1, 2], [3, 4], [], [5, 6], [7])
+        cache = SimulationCache()
+        cache.simulation_run(utils.config_model(self.G, 2, *scenario), first_infected=False)
+        model = utils.build_model(self.G, 2)
+        results = cache.simulation_run(model.reset(*scenario), first_infected=False)
+        assert cache.hits == 1 and model.status == results['status']
+        changed = model.changed_rows
+        assert 0 < len(changed) < self.G.number_of_nodes()
+        model.status = CountingDict(model.status)
+        expected = utils.config_model(self.G, 2, [10], [11], [12]).simulation_run()
+        model.reset([10], [11], [12])
+        # Only the old and new seeds and blocked nodes and the rows the cached run changed are rewound.
+        assert model.status.writes <= len(changed) + 8
+        assert model.simulation_run() == expected
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+import gzip
+import json
+import os
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+import networkx as nx
+import numpy as np
+
+import graph_store
+from csr_graph import CSRGraph
+
+
+class GraphStore(unittest.TestCase):
+    G = nx.barabasi_albert_graph(200, 4, seed=8)
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.edges = os.path.join(self.folder.name, 'net.edges')
+        nx.write_edgelist(self.G, self.edges, data=False)
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_matches_networkx(self):
+        G = nx.Graph()
+        G.add_nodes_from(sorted(self.G))
+        G.add_edges_from(self.G.edges)
+        expected = CSRGraph.from_networkx(G)
+        for _ in range(2):
+            csr, degrees, core_numbers = graph_store.load_network(self.edges)
+            assert isinstance(csr.indices, np.memmap)
+            assert csr.nodes == expected.nodes and csr.fingerprint == expected.fingerprint
+            assert degrees.tolist() == [d for _, d in G.degree()]
+            assert core_numbers.tolist() == [nx.core_number(G)[u] for u in csr.nodes]
+        k_core = csr.subgraph(np.flatnonzero(core_numbers >= 4))
+        assert k_core.fingerprint == CSRGraph.from_networkx(G.subgraph(k_core.nodes)).fingerprint
+
+    def test_parses_snap_files(self):
+        edges = list(self.G.edges)
+        with gzip.open(self.edges + '.gz', 'wt') as edges_fp:
+            edges_fp.write('# Nodes: 200\n% comment 1 2\n\n')
+            for u, v in edges:
+                edges_fp.write('%d\t%d 0.5\n' % (v * 31 + 7, u * 31 + 7))
+            # A repeated edge and a self loop.
+            edges_fp.write('%d %d\n%d %d' % (edges[0][0] * 31 + 7, edges[0][1] * 31 + 7, 5000, 5000))
+        with open(os.path.join(self.folder.name, 'net.nodes'), 'w') as nodes_fp:
+            nodes_fp.write('6000\n6001\n')
+        csr, degrees, _ = graph_store.load_network(self.edges + '.gz')
+        G = nx.relabel_nodes(self.G, {u: u * 31 + 7 for u in self.G})
+        G.add_nodes_from([5000, 6000, 6001])
+        assert csr.nodes == sorted(G) and degrees.tolist() == [G.degree(u) for u in csr.nodes]
+        rows = np.repeat(np.arange(csr.number_of_nodes()), degrees)
+        assert set(zip(csr.ids_of(rows), csr.ids_of(csr.indices))) == \
+            set(G.edges) | {(v, u) for u, v in G.edges}
+
+    def arrays(self):
+        target = graph_store.cache_path(self.edges)
+        with open(os.path.join(target, 'meta.json')) as meta_fp:
+            return os.path.join(target, json.load(meta_fp)['arrays'])
+
+    def test_invalidated_by_contents(self):
+        graph_store.load_network(self.edges)
+        arrays = self.arrays()
+        converted = os.stat(os.path.join(arrays, 'indptr.npy')).st_mtime_ns
+        # Rewriting the same contents keeps the cache.
+        nx.write_edgelist(self.G, self.edges, data=False)
+        graph_store.load_network(self.edges)
+        assert self.arrays() == arrays and os.stat(os.path.join(arrays, 'indptr.npy')).st_mtime_ns == converted
+        with open(self.edges, 'a') as edges_fp:
+            edges_fp.write('0 1000\n')
+        csr, _, _ = graph_store.load_network(self.edges)
+        assert csr.number_of_edges() == self.G.number_of_edges() + 1 and 1000 in csr.nodes
+        assert self.arrays() != arrays and not os.path.exists(arrays)
+
+    def test_concurrent_loads_and_conversions(self):
+        graph_store.load_network(self.edges)
+
+        def load():
+            for _ in range(30):
+                csr, _, _ = graph_store.load_network(self.edges)
+                assert csr.number_of_nodes() == 200
+
+        def convert():
+            for _ in range(10):
+                # Touching the sources makes the loads refresh meta.json while the conversions replace it.
+                os.utime(self.edges)
+                graph_store.convert(self.edges)
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            for future in [executor.submit(task) for task in (load, load, convert, convert)]:
+                future.result()
+        assert sorted(os.listdir(graph_store.cache_path(self.edges))) == \
+            sorted(['meta.json', os.path.basename(self.arrays())])
+
+
+if __name__ == '__main__':
+    unittest.main()
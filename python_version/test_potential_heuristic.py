@@ -0,0 +1,66 @@
+import unittest
+
+import networkx as nx
+import numpy as np
+
+import csr_engine
+import potential_heuristic
+import utils
+
+
+class Potentials(unittest.TestCase):
+
+    def test_path_potentials(self):
+        G = nx.path_graph([1, 2, 3])
+        model = utils.config_model(G, 1, [1], [], [])
+        initial_state = csr_engine.status_array(model.status, model.csr)
+        node_infections_1, node_infections_2, _ = model.simulation_run()
+        updates = potential_heuristic.node_updates(model.csr, initial_state, node_infections_1, node_infections_2)
+        assert [rows.tolist() for rows, _ in updates] == [[0], [1], [2]]
+        potentials = potential_heuristic.find_potentials(model, updates)
+        # Node 2 reaches node 3 with weight 1, node 1 reaches both with weight 4.
+        assert potentials[1, 1, 1] == 1 and potentials[1, 1, 3] == 1
+        assert potentials[0, 1, 1] == 8 and potentials[0, 1, 3] == 8
+        assert potentials[2].sum() == 0 and potentials[:, 2].sum() == 0
+
+    def test_choose_blocking(self):
+        G = nx.barabasi_albert_graph(300, 3, seed=2)
+        seed_set = [0, 1, 2, 3, 4, 5]
+        for costs in [(1, 1), (1, 3), (2, 1)]:
+            model = utils.config_model(G, 2, seed_set[:2], seed_set[2:4], seed_set[4:])
+            blocking = potential_heuristic.choose_seed_nodes(model, 10, costs, seed_set)
+            assert blocking and not set(blocking).intersection(seed_set)
+            assert sum(costs[contagion - 1] for contagions in blocking.values() for contagion in contagions) <= 10
+
+    def test_choose_blocking_wide_gains(self):
+        # Gains from 1e-100 to 1e73 as on long cascades, which HiGHS does not solve unscaled.
+        G = nx.path_graph(21)
+        model = utils.config_model(G, 1, [0], [], [])
+        potentials = np.zeros((21, 4, 4))
+        potentials[1:, 1, 1] = 10.0 ** np.linspace(-100, 73, 20)
+        blocking = potential_heuristic.choose_blocking(model, potentials, 3, (1, 1), [0])
+        assert blocking == {20: [1], 19: [1], 18: [1]}
+
+    def test_long_cascade(self):
+        # 58 steps, the potentials reach about 1e173 and overflowed float32.
+        G = nx.convert_node_labels_to_integers(nx.grid_2d_graph(30, 30))
+        model = utils.config_model(G, 1, [0], [899], [])
+        initial_state = csr_engine.status_array(model.status, model.csr)
+        node_infections_1, node_infections_2, _ = model.simulation_run()
+        updates = potential_heuristic.node_updates(model.csr, initial_state, node_infections_1, node_infections_2)
+        potentials = potential_heuristic.find_potentials(model, updates)
+        rescale = potential_heuristic._RESCALE
+        potential_heuristic._RESCALE = np.inf
+        try:
+            unscaled = potential_heuristic.find_potentials(model, updates)
+        finally:
+            potential_heuristic._RESCALE = rescale
+        assert np.isfinite(potentials).all() and potentials.max() < unscaled.max()
+        assert np.allclose(potentials / potentials.max(), unscaled / unscaled.max())
+        model = utils.config_model(G, 1, [0], [899], [])
+        blocking = potential_heuristic.choose_seed_nodes(model, 20, [1, 1], {0, 899})
+        assert 0 < len(blocking) <= 20 and not set(blocking) & {0, 899}
+
+
+if __name__ == '__main__':
+    unittest.main()
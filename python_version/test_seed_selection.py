@@ -0,0 +1,53 @@
+import unittest
+
+import networkx as nx
+import numpy as np
+
+import seed_selection
+from csr_graph import CSRGraph
+
+
+class SeedSelection(unittest.TestCase):
+    G = nx.powerlaw_cluster_graph(500, 4, 0.3, seed=2)
+
+    def test_core_numbers(self):
+        G = self.G.copy()
+        G.add_node(1000)
+        csr = CSRGraph.from_networkx(G)
+        core = nx.core_number(G)
+        assert seed_selection.core_numbers(csr).tolist() == [core[u] for u in csr.nodes]
+        rows = seed_selection.k_core(seed_selection.core_numbers(csr), 5)
+        assert set(csr.ids_of(rows)) == set(nx.k_core(G, 5))
+
+    def test_samplers(self):
+        csr = CSRGraph.from_networkx(self.G)
+        rng = np.random.default_rng(0)
+        core = seed_selection.k_core(seed_selection.core_numbers(csr), 4)
+        for _ in range(50):
+            seeds = seed_selection.choose_random_k_core(rng, core, 20)
+            assert len(set(seeds.tolist())) == 20 and set(seeds.tolist()) <= set(core.tolist())
+            for seeds in [seed_selection.choose_connected(rng, csr, 20, rng.integers(500)),
+                          seed_selection.choose_by_centola(rng, csr, 20)]:
+                assert len(set(seeds.tolist())) == 20
+                assert nx.is_connected(self.G.subgraph(csr.ids_of(seeds)))
+            seed_sets = seed_selection.split_seeds(rng, csr, seeds)
+            assert sorted(sum(seed_sets, [])) == sorted(csr.ids_of(seeds))
+        # The first node has more than two neighbors, so the other seeds all come from its neighborhood.
+        seeds = seed_selection.choose_by_centola(np.random.default_rng(3), csr, 3)
+        first = csr.nodes[seeds[0]]
+        assert set(csr.ids_of(seeds[1:])) <= set(self.G[first])
+
+    def test_small_component(self):
+        # Two components of 5 nodes, too small for 6 seeds.
+        csr = CSRGraph.from_networkx(nx.disjoint_union(nx.cycle_graph(5), nx.complete_graph(5)))
+        rng = np.random.default_rng(0)
+        with self.assertRaises(ValueError):
+            seed_selection.choose_connected(rng, csr, 6, 7)
+        with self.assertRaises(ValueError):
+            seed_selection.choose_by_centola(rng, csr, 6)
+        assert sorted(seed_selection.choose_connected(rng, csr, 5, 7).tolist()) == [5, 6, 7, 8, 9]
+        assert len(set(seed_selection.choose_by_centola(rng, csr, 5).tolist())) == 5
+
+
+if __name__ == '__main__':
+    unittest.main()
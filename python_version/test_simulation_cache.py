@@ -0,0 +1,35 @@
+import unittest
+
+import networkx as nx
+import numpy as np
+
+import utils
+from simulation_cache import SimulationCache
+
+
+class SimulationCacheTest(unittest.TestCase):
+    G = nx.barabasi_albert_graph(300, 3, seed=4)
+
+    def test_hit_matches_simulation_run(self):
+        cache = SimulationCache()
+        model = utils.config_model(self.G, 2, [0, 1, 2], [3, 4, 5], [6], blocked_1=[7])
+        expected = model.simulation_run()
+        times = model.infection_times
+        for _ in range(3):
+            model = utils.config_model(self.G, 2, [0, 1, 2], [3, 4, 5], [6], blocked_1=[7])
+            assert cache.simulation_run(model) == expected
+            assert np.array_equal(model.infection_times.infect_time_1, times.infect_time_1)
+            assert np.array_equal(model.infection_times.affected_count_2, times.affected_count_2)
+        assert (cache.hits, cache.misses) == (2, 1)
+
+    def test_evicts_least_recently_used(self):
+        cache = SimulationCache(max_bytes=700)
+        for seed in [0, 1, 0, 2]:
+            cache.simulation_run(utils.config_model(self.G, 2, [seed], [], []), first_infected=False)
+        assert len(cache) == 2 and cache.nbytes <= 700
+        cache.simulation_run(utils.config_model(self.G, 2, [0], [], []), first_infected=False)
+        assert (cache.hits, cache.misses) == (2, 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,38 @@
+import unittest
+
+import networkx as nx
+import numpy as np
+
+import compute_blocking
+import seed_selection
+import sweep
+from csr_graph import CSRGraph
+
+
+class Sweep(unittest.TestCase):
+    G = nx.barabasi_albert_graph(400, 8, seed=4)
+
+    def test_workers_match_one_process(self):
+        rng = np.random.default_rng(4)
+        csr = CSRGraph.of(self.G)
+        k_core = seed_selection.k_core(seed_selection.core_numbers(csr), 8)
+        cells = []
+        for sample in range(2):
+            seed_set_1, seed_set_2, seed_set_3 = seed_selection.split_seeds(
+                rng, csr, seed_selection.choose_random_k_core(rng, k_core, 10))
+            for threshold in (2, 3):
+                cells.append(('ba', threshold, 10, seed_set_1, seed_set_2, seed_set_3, [.01, .03], 11 + sample))
+        shared = csr.share()
+        try:
+            rows = [list(sweep.run_sweep(shared, compute_blocking.block_cell, cells, max_workers=workers))
+                    for workers in (1, 2)]
+        finally:
+            shared.unlink()
+        assert len(rows[0]) == len(cells) and all(len(cell_rows) == 2 for cell_rows in rows[0])
+        # Everything but the CBH and potential timings
+        assert [[row[:4] + row[6:] for row in cell_rows] for cell_rows in rows[0]] == \
+               [[row[:4] + row[6:] for row in cell_rows] for cell_rows in rows[1]]
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -27,3 +27,15 @@ def config_model(G, threshold, seed_set_1, seed_set_2, seed_set_3=None, blocked_
     # Set configuration
     model.set_initial_status(config)
     return model
+
+
+def build_model(G, threshold):
+    """
+    Configure a model once for a graph and threshold without seeds or blocked nodes. Every scenario is then set
+    with model.reset(seed_set_1, seed_set_2, seed_set_3, blocked_1, blocked_2), which costs the size of the
+    scenario instead of a new configuration of every node.
+    :param G: The network, a networkx graph or a CSRGraph.
+    :param threshold: The threshold of every node.
+    :return: The MultipleContagionThreshold.
+    """
+    return config_model(G, threshold, [], [], [])